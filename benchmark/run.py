@@ -0,0 +1,419 @@
+"""
+Benchmark moreshell against a fake IPython shell.
+
+Measures ``%magic`` decoration, argument parsing, magic module loading and
+unloading, ``import moreshell`` cold start, and end-to-end line and cell
+``%magic`` dispatch. Results are written as JSON and can be compared with
+the results of a previous run::
+
+    python benchmark/run.py --output baseline.json
+    # ... change something ...
+    python benchmark/run.py --compare baseline.json
+
+The comparison exits with status 1 if any benchmark got slower by more than
+the ``--threshold`` fraction
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from timeit import Timer, default_timer
+
+import zetup
+from zetup import with_arguments
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from moreshell import IPython_magic, IPython_cell_magic  # noqa: E402
+from moreshell.module import import_magic_modules  # noqa: E402
+
+#: All benchmark functions, by name, in order of definition.
+BENCHMARKS = OrderedDict()
+
+#: The sizes of the generated magic modules for load/unload benchmarks.
+MODULE_SIZES = (10, 100, 1000)
+
+
+def benchmark(name):
+    """
+    Register a benchmark function under `name`.
+
+    The function takes the number of repetitions and returns a callable to
+    be timed, or the best measured seconds per operation by itself
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+class fake_shell(object):
+    """Minimal stand-in for an IPython ``InteractiveShell``."""
+
+    def __init__(self):
+        self.magics_manager = fake_magics_manager()
+
+    def run_line_magic(self, name, line):
+        """Dispatch like ``InteractiveShell.run_line_magic``."""
+        return self.magics_manager.magics['line'][name](line)
+
+    def run_cell_magic(self, name, line, cell):
+        """Dispatch like ``InteractiveShell.run_cell_magic``."""
+        return self.magics_manager.magics['cell'][name](line, cell)
+
+
+class fake_magics_manager(object):
+    """Minimal stand-in for ``IPython.core.magic.MagicsManager``."""
+
+    def __init__(self):
+        self.magics = {'line': {}, 'cell': {}}
+
+
+def small_arguments():
+    """Get a ``with_arguments`` spec with a few options."""
+    return (
+        with_arguments
+        ('value')
+        ('-f', '--flag', action='store_true')
+        ('-o', '--option'))
+
+
+def large_arguments(size=50):
+    """Get a ``with_arguments`` spec with `size` options."""
+    arguments = with_arguments('value')
+    for index in range(size):
+        arguments = arguments('--option-{}'.format(index))
+        arguments = arguments('--flag-{}'.format(index), action='store_true')
+    return arguments
+
+
+LARGE_LINE = ' '.join(
+    ['value'] + ['--option-{0} {0} --flag-{0}'.format(index)
+                 for index in range(0, 50, 5)])
+
+
+@benchmark('decorate.small')
+def decorate_small(repeat):
+    """Measure decorating a function with a few options."""
+    def decorate():
+        @IPython_magic(small_arguments())
+        def magic(shell, args):
+            return args
+
+    return decorate
+
+
+@benchmark('decorate.large')
+def decorate_large(repeat):
+    """Measure decorating a function with 100 options."""
+    def decorate():
+        @IPython_magic(large_arguments())
+        def magic(shell, args):
+            return args
+
+    return decorate
+
+
+@benchmark('decorate.magic_only')
+def decorate_magic_only(repeat):
+    """Measure creating a ``%magic`` with an existing decorator."""
+    magic_deco = IPython_magic(small_arguments(), stats=False)
+
+    def magic(shell, args):
+        return args
+
+    return lambda: magic_deco(magic)
+
+
+def allocated_per_call(func, number=100):
+    """Get the mean bytes allocated and kept by `number` calls of `func`."""
+    import tracemalloc
+
+    results = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(number):
+            results.append(func())
+        return (tracemalloc.get_traced_memory()[0] - before) / float(number)
+
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark('memory.decorate')
+def memory_decorate(repeat):
+    """Measure the bytes per ``%magic`` together with its decorator."""
+    arguments = small_arguments()
+
+    def decorate():
+        @IPython_magic(arguments)
+        def magic(shell, args):
+            return args
+
+        return magic
+
+    return allocated_per_call(decorate)
+
+
+@benchmark('memory.magic_only')
+def memory_magic_only(repeat):
+    """Measure the bytes per ``%magic`` created with an existing decorator."""
+    magic_deco = IPython_magic(small_arguments(), stats=False)
+
+    def magic(shell, args):
+        return args
+
+    return allocated_per_call(lambda: magic_deco(magic))
+
+
+def parse_benchmark(arguments, line, **options):
+    """Get a callable parsing `line` with a ``%magic`` of `arguments`."""
+    @IPython_magic(arguments, **options)
+    def magic(shell, args):
+        return args
+
+    def parse():
+        magic.parse(line)
+
+    return parse
+
+
+@benchmark('parse.small.uncached')
+def parse_small_uncached(repeat):
+    """Measure ``argparse`` parsing of a short line."""
+    return parse_benchmark(
+        small_arguments(), 'value -f --option 1', parse_cache=False)
+
+
+@benchmark('parse.small.cached')
+def parse_small_cached(repeat):
+    """Measure parsing a short line with the ``parse_cache``."""
+    return parse_benchmark(
+        small_arguments(), 'value -f --option 1', parse_cache=128)
+
+
+@benchmark('parse.small.compiled')
+def parse_small_compiled(repeat):
+    """Measure parsing a short line with the ``compiled_parser``."""
+    return parse_benchmark(
+        small_arguments(), 'value -f --option 1', parse_cache=False,
+        compiled=True)
+
+
+@benchmark('parse.large.uncached')
+def parse_large_uncached(repeat):
+    """Measure ``argparse`` parsing of a long line with many options."""
+    return parse_benchmark(large_arguments(), LARGE_LINE, parse_cache=False)
+
+
+@benchmark('parse.large.cached')
+def parse_large_cached(repeat):
+    """Measure parsing a long line with the ``parse_cache``."""
+    return parse_benchmark(large_arguments(), LARGE_LINE, parse_cache=128)
+
+
+def write_magic_module(dirname, size):
+    """Write a magic module with `size` ``%magic`` and get its name."""
+    name = 'moreshell_benchmark_magics_{}'.format(size)
+    names = ['bench_magic_{}'.format(index) for index in range(size)]
+    lines = [
+        "from moreshell import IPython_magic_module, IPython_magic, "
+        "with_arguments",
+        "",
+        "IPython_magic_module(__name__, {!r})".format(names),
+    ]
+    for magic_name in names:
+        lines.extend([
+            "",
+            "@IPython_magic(with_arguments('value'))",
+            "def {}(shell, args):".format(magic_name),
+            "    return args.value",
+        ])
+    with open(os.path.join(dirname, name + '.py'), 'w') as module:
+        module.write('\n'.join(lines) + '\n')
+    return name
+
+
+def load_unload_benchmark(size):
+    """Create a benchmark for a magic module with `size` ``%magic``."""
+    def load_unload(repeat):
+        """Measure loading and unloading a generated magic module."""
+        mod, = import_magic_modules([write_magic_module(TEMP_DIR, size)])
+        shell = fake_shell()
+
+        def run():
+            mod.load(shell)
+            mod.unload(shell)
+
+        return run
+
+    return load_unload
+
+
+for size in MODULE_SIZES:
+    benchmark('module.load_unload.{}'.format(size))(
+        load_unload_benchmark(size))
+
+
+@benchmark('import.cold_start')
+def import_cold_start(repeat):
+    """Measure ``import moreshell`` in fresh interpreters."""
+    command = [sys.executable, '-c', 'import moreshell']
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(min(repeat, 5)):
+            start = default_timer()
+            subprocess.check_call(
+                command, env=env, stdout=devnull, stderr=devnull)
+            duration = default_timer() - start
+            best = duration if best is None else min(best, duration)
+    return best
+
+
+@benchmark('dispatch.line')
+def dispatch_line(repeat):
+    """Measure calling a line ``%magic`` through the fake shell."""
+    shell = fake_shell()
+
+    @IPython_magic(small_arguments())
+    def bench_magic(shell, args):
+        return args.value
+
+    bench_magic.load(shell)
+    return lambda: shell.run_line_magic('bench_magic', 'value -f')
+
+
+@benchmark('dispatch.cell')
+def dispatch_cell(repeat):
+    """Measure calling a cell ``%%magic`` through the fake shell."""
+    shell = fake_shell()
+
+    @IPython_cell_magic(small_arguments())
+    def bench_magic(shell, args, block):
+        return block
+
+    bench_magic.load(shell)
+    return lambda: shell.run_cell_magic('bench_magic', 'value -f', 'cell')
+
+
+@benchmark('dispatch.map')
+def dispatch_map(repeat):
+    """Measure calling a line ``%magic`` per line with ``.map``."""
+    @IPython_magic(small_arguments())
+    def bench_magic(shell, args):
+        return args.value
+
+    lines = ['value -f'] * 100
+    return lambda: bench_magic.map(lines)
+
+
+#: Temporary directory for generated magic modules, set by :func:`main`.
+TEMP_DIR = None
+
+
+def measure(func, repeat, number):
+    """
+    Run benchmark `func` and get the best seconds per operation.
+
+    Callables returned by `func` are timed `repeat` times `number` calls
+    """
+    timed = func(repeat)
+    if not callable(timed):
+        return timed
+
+    timer = Timer(timed)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the relative changes of `results` against `baseline` results.
+
+    Returns the names of benchmarks that got slower than `threshold`
+    """
+    regressions = []
+    print("{:<32} {:>12} {:>12} {:>8}".format(
+        'benchmark', 'baseline', 'current', 'change'))
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print("{:<32} {:>12} {:>12.3e} {:>8}".format(
+                name, '-', current, 'new'))
+            continue
+
+        change = current / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' !'
+        print("{:<32} {:>12.3e} {:>12.3e} {:>+7.1%}{}".format(
+            name, before, current, change, flag))
+    return regressions
+
+
+@zetup.program(
+    with_arguments
+    ('-k', '--filter', default='',
+     help="Only run benchmarks whose names contain this text")
+    ('-r', '--repeat', type=int, default=5,
+     help="Timing repetitions per benchmark, of which the best is taken")
+    ('-n', '--number', type=int, default=1000,
+     help="Calls per timing repetition")
+    ('-o', '--output', help="Write the JSON results to this file")
+    ('-c', '--compare', metavar='BASELINE',
+     help="Compare with the JSON results of a previous run")
+    ('-t', '--threshold', type=float, default=0.1,
+     help="Slowdown fraction counted as regression, defaulting to 0.1")
+)
+def main(args):
+    """Run the moreshell benchmarks."""
+    global TEMP_DIR
+
+    TEMP_DIR = tempfile.mkdtemp(prefix='moreshell-benchmark-')
+    sys.path.insert(0, TEMP_DIR)
+    results = OrderedDict()
+    try:
+        for name, func in BENCHMARKS.items():
+            if args.filter not in name:
+                continue
+
+            number = args.number
+            if name.startswith(('decorate.', 'module.', 'dispatch.map')):
+                number = max(1, number // 100)
+            results[name] = measure(func, args.repeat, number)
+            unit = 'B' if name.startswith('memory.') else 's'
+            print("{:<32} {:>12.3e} {}".format(name, results[name], unit))
+    finally:
+        sys.path.remove(TEMP_DIR)
+        shutil.rmtree(TEMP_DIR)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'results': results,
+            }, output, indent=1)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(
+                results, json.load(baseline)['results'], args.threshold)
+        if regressions:
+            print("Regressions: {}".format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
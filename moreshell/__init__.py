@@ -1,23 +1,54 @@
 """Start here to createMORE IPython shell magic."""
 
 import sys
-from argparse import ArgumentParser
 from importlib import import_module
-from inspect import ismodule
 
 import zetup
-from decorator import decorator
-from moretools import dictkeys, qualname
 from zetup import with_arguments
 
-from .magic import IPython_magic, IPython_cell_magic, IPythonMagicExit
-from .module import IPython_magic_module, load_magic_modules
+#: The submodules defining the API, which are imported on first access.
+API_MODULES = {
+    'IPython_cell_magic': 'magic',
+    'IPython_magic': 'magic',
+    'IPythonMagicBudgetExceeded': 'magic',
+    'IPythonMagicExit': 'magic',
+    'IPython_magic_module': 'module',
+    'load_magic_modules': 'module',
+}
+
+
+def __getattr__(name):
+    """
+    Import the API from its submodule on first access (PEP 562).
+
+    So that ``import moreshell`` stays cheap for code that doesn't use most
+    of it
+    """
+    try:
+        modname = API_MODULES[name]
+
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = globals()[name] = getattr(
+        import_module('.' + modname, __name__), name)
+    return value
+
+
+if sys.version_info < (3, 7):  # pragma: no cover
+    # no module __getattr__ before PEP 562
+    from .magic import (
+        IPython_magic, IPython_cell_magic, IPythonMagicBudgetExceeded,
+        IPythonMagicExit)
+    from .module import IPython_magic_module, load_magic_modules
 
 
 zetup.toplevel(__name__, (
     'IPython_cell_magic',
     'IPython_magic',
     'IPython_magic_module',
+    'IPythonMagicBudgetExceeded',
     'IPythonMagicExit',
     'load_magic_modules',
 
@@ -27,3 +58,15 @@ zetup.toplevel(__name__, (
     # that it's also exposed here as part of the moreshell API
     'with_arguments',
 ))
+
+
+def load_ipython_extension(shell):
+    """
+    Provide the handler for ``%load_ext moreshell`` in IPython.
+
+    Which loads the built-in ``%moreshell_...`` magic
+    """
+    from .module import load_magic_modules
+
+    load_magic_modules(
+        'batch', 'jobs', 'pipe', 'stats', package=__name__, shell=shell)
@@ -0,0 +1,146 @@
+"""Run ``async def``-based ``%magic`` on event loops."""
+
+import asyncio
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from threading import Lock, Thread
+
+import zetup
+
+__all__ = (
+    'coroutine_timeout', 'loop_thread', 'run_coroutine', 'running_loop',
+    'thread_future')
+
+
+class coroutine_timeout(Exception):
+    """
+    Waiting for a coroutine in :func:`moreshell.aio.run_coroutine` timed out.
+
+    The coroutine was cancelled. Unlike ``asyncio.TimeoutError``, it can't
+    be raised by the coroutine itself
+    """
+
+
+class loop_thread(zetup.object):
+    """
+    Dedicated event loop running forever in a daemon thread.
+
+    Used for ``async def``-based ``%magic`` if no event loop is running in
+    the IPython shell's thread
+    """
+
+    #: The shared instance created by :meth:`.get`.
+    instance = None
+
+    #: Guards the creation of the shared :attr:`.instance`.
+    lock = Lock()
+
+    def __init__(self):
+        """Create a new event loop and start running it in a new thread."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(
+            target=self.run, name='moreshell-event-loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        """Get the shared instance, which is started on first use."""
+        with cls.lock:
+            if cls.instance is None:
+                cls.instance = cls()
+            return cls.instance
+
+    def run(self):
+        """Run the event loop forever in the current thread."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule `coro` and get a ``concurrent.futures.Future``."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class thread_future(zetup.object):
+    """
+    Awaitable handle of a coroutine scheduled on the :class:`.loop_thread`.
+
+    Wraps the ``concurrent.futures.Future`` of :meth:`.loop_thread.submit`,
+    whose methods, like ``result(timeout)``, stay available for waiting
+    synchronously. Awaiting it in any other event loop doesn't block that
+    loop
+    """
+
+    def __init__(self, future):
+        """Wrap the ``concurrent.futures.Future``."""
+        self.future = future
+
+    def __getattr__(self, name):
+        return getattr(self.future, name)
+
+    def __await__(self):
+        # wrapped on awaiting, for getting an asyncio.Future of that loop
+        return asyncio.wrap_future(self.future).__await__()
+
+
+def running_loop():
+    """Get the event loop running in the current thread or ``None``."""
+    # asyncio.get_running_loop only exists since Python 3.7
+    return asyncio._get_running_loop()
+
+
+async def close_after(coro, reader):
+    """
+    Await `coro` and close the mapped cell block `reader` afterwards.
+
+    With :meth:`moreshell.stream.block_reader.close_after`
+    """
+    try:
+        result = await coro
+
+    except BaseException:
+        reader.release()
+        raise
+
+    return reader.close_after(result)
+
+
+def run_coroutine(coro, schedule=False, timeout=None):
+    """
+    Run the `coro` returned by an ``async def``-based ``%magic``.
+
+    By default, the coroutine is run on the shared
+    :class:`moreshell.aio.loop_thread` and its result is waited for. This
+    also works inside a running event loop, like IPython's ``autoawait``
+    loop, which can't be blocked on itself. After the optional `timeout`
+    in seconds, the coroutine is cancelled and
+    :exc:`moreshell.aio.coroutine_timeout` is raised
+
+    With `schedule`, the coroutine is only scheduled and an awaitable handle
+    is returned immediately, so that many ``%magic`` calls can overlap their
+    I/O. If an event loop is running in the current thread, the coroutine is
+    scheduled there as ``asyncio.Task``, which can be awaited inline with
+    IPython's ``autoawait``. Otherwise it is scheduled on the shared
+    :class:`moreshell.aio.loop_thread` and a
+    :class:`moreshell.aio.thread_future` is returned, which can be awaited
+    later, or waited for with its ``result`` method. A `timeout` is then
+    applied with ``asyncio.wait_for``
+    """
+    if schedule:
+        if timeout:
+            coro = asyncio.wait_for(coro, timeout)
+        loop = running_loop()
+        if loop is not None:
+            return loop.create_task(coro)
+
+        return thread_future(loop_thread.get().submit(coro))
+
+    future = loop_thread.get().submit(coro)
+    try:
+        return future.result(timeout)
+
+    except FuturesTimeoutError:
+        if not future.cancel():
+            # done meanwhile, or the coroutine raised asyncio.TimeoutError
+            return future.result()
+
+        raise coroutine_timeout(timeout)
@@ -0,0 +1,157 @@
+"""Run a ``%magic`` over many argument lines at once."""
+
+import sys
+from collections import OrderedDict
+from timeit import default_timer
+
+import zetup
+
+from moreshell import (
+    IPython_magic_module, IPython_cell_magic, IPythonMagicExit,
+    with_arguments)
+from moreshell.lazy import lazy_magic
+
+IPython_magic_module(__name__, [
+    'batch_result',
+    'run_batch',
+    'moreshell_batch',
+])
+
+
+class batch_result(zetup.object):
+    """
+    The results of a ``%magic`` run over many argument lines, in order.
+
+    Created by :func:`moreshell.batch.run_batch`. Indexing gives the result
+    of a line or re-raises its error. The exceptions of all failed lines,
+    including argument errors, are collected in :attr:`.errors`
+    """
+
+    def __init__(self, magic, lines):
+        """Prepare for the results of `magic` called with `lines`."""
+        self.magic = magic
+        self.lines = list(lines)
+
+        #: The results by line, with ``None`` for failed lines.
+        self.results = [None] * len(self.lines)
+
+        #: The exceptions of failed lines by line index.
+        self.errors = OrderedDict()
+
+    def __repr__(self):
+        return "<{} of {!r}: {} lines, {} errors>".format(
+            type(self).__name__, self.magic, len(self), len(self.errors))
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __getitem__(self, index):
+        error = self.errors.get(index)
+        if error is not None:
+            raise error
+
+        return self.results[index]
+
+    @property
+    def ok(self):
+        """Check if all lines succeeded."""
+        return not self.errors
+
+
+def timed_call(magic, args, block):
+    """
+    Call `magic` with parsed `args` and cell `block`.
+
+    Returns the result or ``sys.exc_info()``, and the start and end times
+    """
+    start = default_timer()
+    try:
+        result = magic.call(args, *block)
+
+    except Exception:
+        return None, sys.exc_info(), start, default_timer()
+
+    return result, None, start, default_timer()
+
+
+def run_batch(magic, lines, block=(), workers=None):
+    """
+    Call `magic` with each argument line of `lines` and optional `block`.
+
+    Parses all lines first, in one pass with the same parser, and then
+    calls the ``%magic`` for every successfully parsed line, either one
+    after another or with `workers` threads. Errors of single lines don't
+    stop the others. Returns a :class:`moreshell.batch.batch_result`
+    """
+    batch = batch_result(magic, lines)
+    stats = magic.stats
+    parsed = []
+    for index, line in enumerate(batch.lines):
+        start = default_timer()
+        try:
+            args = magic.parse(line)
+
+        except (Exception, IPythonMagicExit) as exc:
+            batch.errors[index] = exc
+            if stats is not None:
+                stats.errors += 1
+                stats.record(start, None, default_timer())
+            continue
+
+        parsed.append((index, args, default_timer() - start))
+
+    if workers and workers > 1 and len(parsed) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(
+                lambda item: timed_call(magic, item[1], block), parsed))
+    else:
+        outcomes = [timed_call(magic, args, block) for _, args, _ in parsed]
+
+    for (index, _, parse_time), outcome in zip(parsed, outcomes):
+        result, exc_info, start, end = outcome
+        if exc_info is None:
+            batch.results[index] = result
+        else:
+            batch.errors[index] = exc_info[1]
+        if stats is not None:
+            stats.errors += exc_info is not None
+            stats.record(start - parse_time, start, end)
+    batch.errors = OrderedDict(sorted(batch.errors.items()))
+    return batch
+
+
+@IPython_cell_magic(
+    with_arguments
+    ('name', help="The line magic to run for each line of the cell")
+    ('-w', '--workers', type=int, default=None,
+     help="Run the lines in parallel on this number of threads")
+    ('-x', '--raise', dest='raise_error', action='store_true',
+     help="Raise the error of the first failed line"),
+    stats=False)
+def moreshell_batch(shell, args, block):
+    """
+    Run a line ``%magic`` for each argument line of the cell block.
+
+    Not yet imported ``%magic`` from lazily loaded modules get imported
+    first
+
+    Returns the :class:`moreshell.batch.batch_result`
+    """
+    name = args.name.lstrip('%')
+    magic = shell.magics_manager.magics['line'].get(name)
+    if isinstance(magic, lazy_magic):
+        magic = magic.resolve()
+    if not hasattr(magic, 'map'):
+        raise ValueError(
+            "%{} is no line magic created with moreshell".format(name))
+
+    lines = [line for line in block.splitlines() if line.strip()]
+    batch = magic.map(lines, workers=args.workers)
+    if args.raise_error and batch.errors:
+        raise next(iter(batch.errors.values()))
+    return batch
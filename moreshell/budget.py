@@ -0,0 +1,391 @@
+"""Bound the wall time, CPU time, and memory of single ``%magic`` calls."""
+
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from functools import partial
+from timeit import default_timer
+
+import zetup
+
+from .magic import IPythonMagicBudgetExceeded
+
+try:
+    from ctypes import c_long, c_ulong, py_object, pythonapi
+except ImportError:  # pragma: no cover
+    # budgets are only checked after the calls, like on PyPy
+    pythonapi = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # no rlimits on Windows
+    resource = None
+
+__all__ = ('budget', )
+
+#: The ``dest`` names of the options added by budgets.
+BUDGET_OPTIONS = ('timeout', 'max_cpu_seconds', 'max_memory')
+
+#: The resources measured by budgets, by their option names.
+BUDGET_RESOURCES = (
+    ('wall', 'timeout'), ('cpu', 'max_cpu_seconds'), ('memory', 'max_memory'))
+
+#: Seconds between the usage checks of :class:`.watchdog` threads.
+POLL_INTERVAL = 0.01
+
+#: Multipliers of the unit suffixes accepted by :func:`.parse_size`.
+SIZE_UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_size(text):
+    """
+    Get the number of bytes of a size `text` with optional unit suffix.
+
+    >>> parse_size('512'), parse_size('64K'), parse_size('1.5GB')
+    (512, 65536, 1610612736)
+    """
+    number = text.strip().upper()
+    if number.endswith('B'):
+        number = number[:-1]
+    factor = SIZE_UNITS.get(number[-1:], 1)
+    if factor != 1:
+        number = number[:-1]
+    try:
+        return int(float(number) * factor)
+
+    except ValueError:
+        raise ValueError("Invalid size: {!r}".format(text))
+
+
+def inject_budget_options(magic_deco):
+    """Add the ``--timeout`` and resource limit options to `magic_deco`."""
+    magic_deco.inject_option(
+        '--timeout', type=float, metavar='SECONDS',
+        help="Cancel after this wall time, 0 for no limit")
+    magic_deco.inject_option(
+        '--max-cpu-seconds', type=float, metavar='SECONDS',
+        help="Cancel after this CPU time, 0 for no limit")
+    magic_deco.inject_option(
+        '--max-memory', type=parse_size, metavar='SIZE',
+        help="Cancel when using this much more memory, like 512M, "
+        "0 for no limit")
+
+
+def requested_budget(creator, options):
+    """
+    Get the :class:`.budget` of a call with popped injected `options`.
+
+    Flags given in the call override the options of the `creator`. Returns
+    ``None`` without any limits
+    """
+    limits = {}
+    for name in BUDGET_OPTIONS:
+        value = options.get(name)
+        limits[name] = getattr(creator, name) if value is None else value
+    if not any(limits.values()):
+        return None
+
+    return budget(**limits)
+
+
+def statm_bytes(field):
+    """
+    Get a memory size of this process from ``/proc/self/statm``.
+
+    The `field` is ``0`` for the virtual and ``1`` for the resident size.
+    Returns ``None`` if not available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[field])
+
+    except (IOError, OSError):  # pragma: no cover
+        return None
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def memory_usage():
+    """
+    Get the resident memory size of this process in bytes.
+
+    Or the peak size where the current one isn't available, and ``None``
+    without both
+    """
+    size = statm_bytes(1)
+    if size is None and resource is not None:  # pragma: no cover
+        size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # in kilobytes on Linux, but in bytes on macOS
+        if sys.platform != 'darwin':
+            size *= 1024
+    return size
+
+
+def process_cpu_time():
+    """Get the user and system CPU seconds of this process."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def thread_cpu_clock(ident):
+    """
+    Get a function measuring the CPU seconds of the thread `ident`.
+
+    Falls back to the CPU time of the whole process where per-thread clocks
+    are not available
+    """
+    try:
+        clock_id = time.pthread_getcpuclockid(ident)
+
+    except (AttributeError, OSError):  # pragma: no cover
+        return process_cpu_time
+
+    return partial(time.clock_gettime, clock_id)
+
+
+class budget_interrupt(BaseException):
+    """
+    Cancels a ``%magic`` call exceeding its :class:`.budget`.
+
+    Not derived from ``Exception``, like ``KeyboardInterrupt``, so that the
+    ``%magic`` doesn't accidentally catch it
+    """
+
+
+def interrupt(ident):
+    """Raise :exc:`.budget_interrupt` in the thread `ident` asynchronously."""
+    if pythonapi is not None:
+        # thread IDs are unsigned since PY37
+        c_ident = c_ulong if sys.version_info >= (3, 7) else c_long
+        pythonapi.PyThreadState_SetAsyncExc(
+            c_ident(ident), py_object(budget_interrupt))
+
+
+class watchdog(zetup.object):
+    """
+    Thread checking the usage of the calling thread against a `limits`.
+
+    Which are a :class:`.budget`. The wall and CPU time are measured for
+    the calling thread, while memory is the growth of the resident size of
+    the whole process. Once exceeded, :attr:`.exceeded` is set and the
+    calling thread is interrupted with :exc:`.budget_interrupt`, which is
+    raised as soon as it runs Python code again
+    """
+
+    def __init__(self, limits):
+        """Start watching the calling thread."""
+        self.limits = limits
+        self.ident = threading.current_thread().ident
+        self.cpu_clock = thread_cpu_clock(self.ident)
+        self.start_time = default_timer()
+        self.cpu_start = self.cpu_clock()
+        self.memory_start = memory_usage()
+
+        #: The exceeded ``(resource, limit, usage)``, if any.
+        self.exceeded = None
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def usage(self):
+        """Get the wall and CPU seconds and memory bytes used so far."""
+        memory = memory_usage()
+        if memory is not None and self.memory_start is not None:
+            memory -= self.memory_start
+        return {
+            'wall': default_timer() - self.start_time,
+            'cpu': self.cpu_clock() - self.cpu_start,
+            'memory': memory,
+        }
+
+    def check(self):
+        """Get the first exceeded ``(resource, limit, usage)``, if any."""
+        usage = self.usage()
+        for resource_name, option in BUDGET_RESOURCES:
+            limit = getattr(self.limits, option)
+            used = usage[resource_name]
+            if limit and used is not None and used > limit:
+                return resource_name, limit, usage
+
+        return None
+
+    def watch(self):
+        """Check the usage periodically until finished or exceeded."""
+        while not self.finished.wait(POLL_INTERVAL):
+            exceeded = self.check()
+            if exceeded is not None:
+                with self.lock:
+                    if not self.finished.is_set():
+                        self.exceeded = exceeded
+                        interrupt(self.ident)
+                return
+
+    def stop(self):
+        """Stop watching, without interrupting the calling thread anymore."""
+        with self.lock:
+            self.finished.set()
+        self.thread.join()
+
+
+class budget(zetup.object):
+    """
+    Limits of a single ``%magic`` call.
+
+    Created from the ``timeout=``, ``max_cpu_seconds=``, and ``max_memory=``
+    options of :class:`moreshell.IPython_magic` and the matching flags. Zero
+    or ``None`` means no limit
+    """
+
+    def __init__(self, timeout=None, max_cpu_seconds=None, max_memory=None):
+        """Limit wall and CPU seconds, and memory growth in bytes."""
+        self.timeout = timeout or None
+        self.max_cpu_seconds = max_cpu_seconds or None
+        self.max_memory = max_memory or None
+
+    def __repr__(self):
+        return "<budget timeout={!r}, max_cpu_seconds={!r}, max_memory={!r}>" \
+            .format(self.timeout, self.max_cpu_seconds, self.max_memory)
+
+    def exceeded(self, magic, resource_name, limit, usage):
+        """Create the :exc:`moreshell.IPythonMagicBudgetExceeded` error."""
+        return IPythonMagicBudgetExceeded(
+            magic.creator.prog, resource_name, limit, usage)
+
+    def run(self, magic, args, *block):
+        """
+        Run `magic` with `args` and `block`, cancelled when exceeding limits.
+
+        By a :class:`.watchdog` thread, which raises an exception in the
+        current thread. Code blocked in C calls, like ``time.sleep``, is only
+        cancelled when returning, and on Python implementations without
+        ``PyThreadState_SetAsyncExc``, the error is raised after the call.
+        Coroutines of ``async def`` functions are run with
+        :meth:`.run_coroutine` instead
+        """
+        if magic.is_coroutine:
+            return self.run_coroutine(magic, args, *block)
+
+        dog = watchdog(self)
+        try:
+            try:
+                result = magic.run(args, *block)
+            finally:
+                dog.stop()
+
+        except budget_interrupt:
+            if dog.exceeded is None:
+                raise  # from a signal handler of run_in_worker
+
+        if dog.exceeded is not None:
+            raise self.exceeded(magic, *dog.exceeded)
+
+        return result
+
+    def run_coroutine(self, magic, args, *block):
+        """
+        Run the coroutine of `magic` with `args` and `block` within limits.
+
+        Coroutines run on the :class:`moreshell.aio.loop_thread`, where a
+        :class:`.watchdog` can't interrupt them, so only the timeout is
+        applied. The result is waited for with the timeout and the coroutine
+        is cancelled when exceeded. Scheduled coroutines are wrapped with
+        ``asyncio.wait_for`` instead, which raises ``asyncio.TimeoutError``
+        when awaited
+        """
+        from .aio import coroutine_timeout
+
+        start_time = default_timer()
+        try:
+            return magic.run(args, *block, timeout=self.timeout)
+
+        except coroutine_timeout:
+            raise self.exceeded(magic, 'wall', self.timeout, {
+                'wall': default_timer() - start_time, 'cpu': None,
+                'memory': None,
+            })
+
+    def run_in_worker(self, magic, args, *block):
+        """
+        Run `magic` with `args` and `block` in a worker process.
+
+        CPU time and memory are limited with the ``RLIMIT_CPU`` and
+        ``RLIMIT_AS`` rlimits of the whole worker process, which is then
+        interrupted by ``SIGXCPU`` or fails allocating memory. The CPU limit
+        has a resolution of whole seconds. Only the timeout is checked by a
+        :class:`.watchdog` thread. The previous limits are restored after
+        the call
+        """
+        if resource is None:  # pragma: no cover
+            return self.run(magic, args, *block)
+
+        def on_sigxcpu(signum, frame):
+            raise budget_interrupt()
+
+        try:
+            handler = signal.signal(signal.SIGXCPU, on_sigxcpu)
+
+        except ValueError:  # pragma: no cover
+            # signal handlers can only be set in the main thread
+            return self.run(magic, args, *block)
+
+        start_time = default_timer()
+        cpu_start = process_cpu_time()
+        memory_start = statm_bytes(0)
+
+        def usage():
+            memory = statm_bytes(0)
+            return {
+                'wall': default_timer() - start_time,
+                'cpu': process_cpu_time() - cpu_start,
+                'memory': None if memory is None else memory - memory_start,
+            }
+
+        previous = []
+        if self.max_cpu_seconds:
+            previous.append(set_soft_rlimit(
+                resource.RLIMIT_CPU,
+                int(math.ceil(cpu_start + self.max_cpu_seconds))))
+        if self.max_memory and memory_start is not None:
+            previous.append(set_soft_rlimit(
+                resource.RLIMIT_AS, memory_start + self.max_memory))
+        try:
+            try:
+                if self.timeout:
+                    return budget(timeout=self.timeout).run(
+                        magic, args, *block)
+
+                return magic.run(args, *block)
+
+            finally:
+                for limit, soft in previous:
+                    set_soft_rlimit(limit, soft)
+                signal.signal(signal.SIGXCPU, handler)
+
+        except budget_interrupt:
+            raise self.exceeded(
+                magic, 'cpu', self.max_cpu_seconds, usage())
+
+        except MemoryError:
+            if not self.max_memory:  # pragma: no cover
+                raise
+
+            raise self.exceeded(magic, 'memory', self.max_memory, usage())
+
+
+def set_soft_rlimit(limit, soft):
+    """
+    Set the soft value of the rlimit `limit`, but not above the hard one.
+
+    :return: The `limit` and its previous soft value
+    """
+    previous, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(limit, (soft, hard))
+    return limit, previous
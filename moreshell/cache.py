@@ -0,0 +1,187 @@
+"""Bounded in-memory caches used by ``%magic`` functions."""
+
+from argparse import Namespace
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+from hashlib import sha1
+from threading import Lock
+from timeit import default_timer
+
+import zetup
+from six import binary_type, integer_types, text_type
+
+__all__ = ('bounded_cache', 'cache_info', 'copy_namespace', 'result_key')
+
+#: Statistics snapshot returned by :meth:`bounded_cache.info`.
+cache_info = namedtuple(
+    'cache_info', ['hits', 'misses', 'maxsize', 'currsize', 'hit_rate'])
+
+#: Value types which can be shared between parse results without copying.
+IMMUTABLE_TYPES = (
+    (type(None), bool, float, complex, binary_type, text_type, frozenset) +
+    integer_types)
+
+#: Sentinel for cache misses, since ``None`` is a valid cached value.
+MISSING = object()
+
+
+class bounded_cache(zetup.object):
+    """
+    Thread-safe least-recently-used mapping with a maximum size.
+
+    Counts hits and misses of :meth:`.get` for checking cache efficiency:
+
+    >>> cache = bounded_cache(maxsize=2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> 'b' in cache
+    False
+    >>> cache.get('b') is None
+    True
+    >>> cache.info()
+    cache_info(hits=1, misses=1, maxsize=2, currsize=2, hit_rate=0.5)
+
+    With a `ttl`, entries also expire that many seconds after being cached
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        """
+        Create an empty cache holding at most `maxsize` entries.
+
+        Which optionally expire after `ttl` seconds
+        """
+        if maxsize < 1:
+            raise ValueError(
+                "maxsize of {!r} must be positive, not: {!r}"
+                .format(type(self), maxsize))
+
+        if ttl is not None and ttl <= 0:
+            raise ValueError(
+                "ttl of {!r} must be positive or None, not: {!r}"
+                .format(type(self), ttl))
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        expires = entry[0]
+        return expires is not None and default_timer() >= expires
+
+    def get(self, key, default=None):
+        """
+        Get the value cached for `key` or `default` if there is none.
+
+        Marks a found entry as most recently used and counts a hit or miss.
+        Expired entries are removed and count as misses
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or self._expired(entry):
+                self.misses += 1
+                return default
+
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def __setitem__(self, key, value):
+        """Cache `value` for `key` and evict the least recently used entry."""
+        expires = None
+        if self.ttl is not None:
+            expires = default_timer() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """Get the ratio of hits to all lookups, or ``0.0`` if none yet."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def info(self):
+        """Get a :class:`moreshell.cache.cache_info` statistics snapshot."""
+        return cache_info(
+            self.hits, self.misses, self.maxsize, len(self), self.hit_rate)
+
+
+def copy_namespace(args):
+    """
+    Copy an ``argparse.Namespace`` for handing it out from a cache.
+
+    Only values of mutable types are deep-copied, so that a ``%magic``
+    modifying e.g. a list default in its parsed arguments can't change the
+    cached original
+    """
+    return Namespace(**dict(
+        (name, value if isinstance(value, IMMUTABLE_TYPES)
+         else deepcopy(value))
+        for name, value in vars(args).items()))
+
+
+def freeze(value):
+    """
+    Turn `value` into a hashable equivalent for use in cache keys.
+
+    Lists and tuples become tuples, sets become frozensets, and dicts become
+    sorted tuples of items, recursively
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, freeze(item)) for key, item in value.items()))
+
+    return value
+
+
+def result_key(args, *block):
+    """
+    Get the result cache key of a ``%magic`` call.
+
+    From the parsed `args` and the SHA-1 digest of the cell `block`, if
+    given. Returns ``None`` if the parsed arguments can't be hashed, or if
+    the `block` isn't a string, like a :class:`moreshell.stream.file_block`
+    """
+    try:
+        key = tuple(sorted(
+            (name, freeze(value)) for name, value in vars(args).items()))
+        hash(key)
+
+    except TypeError:
+        return None
+
+    if block:
+        text, = block
+        if isinstance(text, text_type):
+            text = text.encode('utf-8')
+        elif not isinstance(text, binary_type):
+            return None
+
+        key += (sha1(text).hexdigest(), )
+    return key
@@ -1,14 +1,59 @@
+import sys
+
 import pytest
 
+# sharding and last-failed selection of %test_moreshell runs
+from moreshell.test.sharding import (  # noqa: F401
+    pytest_collection_modifyitems, pytest_runtest_logreport)
+
 
 @pytest.fixture
 def magic_module__name__():
     return '.'.join((__package__, 'test', 'magic_module'))
 
 
+class shell_events(object):
+    """Stand-in for IPython's ``shell.events`` manager."""
+
+    def __init__(self):
+        self.callbacks = {'pre_run_cell': []}
+
+    def register(self, event, callback):
+        self.callbacks[event].append(callback)
+
+    def unregister(self, event, callback):
+        self.callbacks[event].remove(callback)
+
+    def trigger(self, event, *args):
+        for callback in list(self.callbacks[event]):
+            callback(*args)
+
+
 @pytest.fixture
 def shell():
+    """Get a fresh mocked shell with ``magics_manager`` and ``events``."""
     class shell_mock(object):
         class magics_manager(object):
             magics = {'line': {}, 'cell': {}}
+
+        events = shell_events()
     return shell_mock
+
+
+@pytest.fixture
+def echo_magic_module__name__():
+    """Get the name of the not yet imported echo magic test module."""
+    name = '.'.join((__package__, 'test', 'echo_magic_module'))
+    sys.modules.pop(name, None)
+    yield name
+    sys.modules.pop(name, None)
+
+
+# modules using asyncio or async def syntax
+collect_ignore = [] if sys.version_info >= (3, 5) else [
+    'aio.py', 'test_aio.py']
+
+# modules needing os.fork, AF_UNIX sockets, or rlimits
+if sys.platform == 'win32':  # pragma: no cover
+    collect_ignore.extend([
+        'budget.py', 'forkserver.py', 'test_budget.py', 'test_forkserver.py'])
@@ -0,0 +1,433 @@
+"""
+Run out-of-process ``%magic`` work in children of a warm forkserver.
+
+The server process is started once, preloads a configurable list of
+modules, and forks a child per request, which starts with all those
+imports done. Requests and replies go over a local ``AF_UNIX`` socket
+
+The server runs this file directly instead of importing :mod:`moreshell`,
+so that the forked children import it freshly, like ``python -m`` would,
+for example for measuring its coverage
+"""
+
+import codecs
+import os
+import pickle
+import runpy
+import select
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+from importlib import import_module
+from threading import Lock, Thread
+
+import zetup
+
+__all__ = ('forkserver', 'forked_process', 'server')
+
+#: Prefix of every message with the length of the pickled data.
+HEADER = struct.Struct('!Q')
+
+#: Runs this file as server without the siblings of this file shadowing
+#  other modules, as running it by path would.
+LAUNCHER = (
+    "import runpy, sys; del sys.argv[0]; "
+    "runpy.run_path(sys.argv[0], run_name='__main__')")
+
+
+def dump_message(message):
+    """
+    Get the bytes of `message` for sending them over a socket.
+
+    Raises ``TypeError`` if `message` can't be pickled
+    """
+    try:
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+    except Exception as exc:  # pickle raises all kinds of exceptions
+        raise TypeError(
+            "Can't send {!r} to forkserver: It can't be pickled ({})"
+            .format(message, exc))
+
+    return HEADER.pack(len(data)) + data
+
+
+def send_message(sock, message):
+    """Send the picklable `message` over `sock`."""
+    sock.sendall(dump_message(message))
+
+
+def recv_exactly(sock, size):
+    """Receive exactly `size` bytes from `sock`."""
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 2 ** 16))
+        if not chunk:
+            raise EOFError("Forkserver connection closed unexpectedly")
+
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """Receive the next message sent with :func:`.send_message`."""
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return pickle.loads(recv_exactly(sock, size))
+
+
+def exit_code(code):
+    """
+    Get the process exit code of a ``SystemExit(code)``.
+
+    >>> exit_code(None), exit_code(3), exit_code("failed")
+    (0, 3, 1)
+    """
+    if code is None:
+        return 0
+
+    if isinstance(code, int):
+        return int(code)  # also for int enums like pytest's ExitCode
+
+    sys.stderr.write("{}\n".format(code))
+    return 1
+
+
+def run_module_main(name, argv, env, cwd):
+    """
+    Run module `name` like ``python -m`` with `argv`, `env`, and `cwd`.
+
+    :return: The exit code
+    """
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.argv = [name] + list(argv)
+    try:
+        runpy.run_module(name, run_name='__main__', alter_sys=True)
+
+    except SystemExit as exc:
+        return exit_code(exc.code)
+
+    return 0
+
+
+def run_request(conn):
+    """
+    Receive a request over `conn` and run it.
+
+    Either ``('module', name, argv, env, cwd)`` for
+    :func:`.run_module_main`, or ``('call', func, args, kwargs)``
+
+    :return: The ``('return', value)`` or ``('raise', exception)`` outcome
+    """
+    try:
+        message = recv_message(conn)
+        if message[0] == 'module':
+            return 'return', run_module_main(*message[1:])
+
+        func, args, kwargs = message[1:]
+        return 'return', func(*args, **kwargs)
+
+    except BaseException as exc:  # also SystemExit of called functions
+        return 'raise', exc
+
+
+def send_outcome(conn, outcome):
+    """Send the `outcome` of :func:`.run_request` back over `conn`."""
+    try:
+        data = dump_message(outcome)
+
+    except TypeError as exc:
+        data = dump_message(('raise', exc))
+    conn.sendall(data)
+
+
+def forward_output(conn):  # pragma: no cover
+    """
+    Send everything written to stdout and stderr over `conn`.
+
+    Redirects the file descriptors of the forked child, so that output of
+    subprocesses and extension modules is included
+
+    :return: The function for flushing and finishing the forwarding
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    read_fd, write_fd = os.pipe()
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+
+    def forward():
+        for chunk in iter(lambda: os.read(read_fd, 2 ** 16), b''):
+            send_message(conn, ('output', chunk))
+        os.close(read_fd)
+
+    thread = Thread(target=forward)
+    thread.daemon = True
+    thread.start()
+
+    def finish():
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(null_fd, 1)
+        os.dup2(null_fd, 2)
+        thread.join()
+
+    return finish
+
+
+def serve_child(listener, conn):  # pragma: no cover
+    """
+    Handle the connection `conn` in a freshly forked child.
+
+    Never returns. The child exits without cleanup, which means that its
+    coverage is never measured
+    """
+    try:
+        listener.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        finish = forward_output(conn)
+        outcome = run_request(conn)
+        finish()
+        send_outcome(conn, outcome)
+    finally:
+        os._exit(0)
+
+
+def serve(path, preload):
+    """
+    Preload modules, listen on socket `path`, and fork per connection.
+
+    Writes ``ready`` to stdout when listening, and stops when stdin gets
+    closed by the starting :class:`.forkserver`, which also happens when
+    its process dies
+    """
+    for name in preload:
+        import_module(name)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(64)
+    # let the system reap the exited children
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    while sys.stdin not in select.select([listener, sys.stdin], [], [])[0]:
+        conn = listener.accept()[0]
+        if os.fork() == 0:  # pragma: no cover
+            serve_child(listener, conn)
+        conn.close()
+    listener.close()
+
+
+class forked_process(zetup.object):
+    """
+    Handle of work running in a child of a :class:`.forkserver`.
+
+    Resembles ``subprocess.Popen`` with ``stdout=PIPE`` and
+    ``stderr=STDOUT``: The merged output is read as text with
+    :meth:`.readline`, also via :attr:`.stdout`, and :meth:`.wait` gets the
+    exit code of module runs
+    """
+
+    def __init__(self, sock):
+        """Read replies from the connected `sock`."""
+        self.socket = sock
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.buffer = u''
+        #: The ``('return', value)`` or ``('raise', exception)`` outcome.
+        self.outcome = None
+
+    @property
+    def stdout(self):
+        """Get this handle, which can be read like ``Popen.stdout``."""
+        return self
+
+    def receive(self):
+        """
+        Receive the next output chunk or the outcome.
+
+        :return: ``False`` if the outcome was already received
+        """
+        if self.outcome is not None:
+            return False
+
+        kind, value = recv_message(self.socket)
+        if kind == 'output':
+            self.buffer += self.decoder.decode(value)
+        else:
+            self.buffer += self.decoder.decode(b'', True)
+            self.outcome = kind, value
+            self.socket.close()
+        return True
+
+    def readline(self):
+        """Read the next output line, or ``''`` at the end."""
+        while u'\n' not in self.buffer and self.receive():
+            pass
+        line, newline, self.buffer = self.buffer.partition(u'\n')
+        return line + newline
+
+    def close(self):
+        """Do nothing, like closing a ``Popen.stdout`` before :meth:`.wait`."""
+
+    def result(self):
+        """
+        Wait for the outcome and discard any unread output.
+
+        :return: The return value of the called function
+        :raises: The exception raised by the called function
+        """
+        while self.receive():
+            pass
+        self.buffer = u''
+        kind, value = self.outcome
+        if kind == 'raise':
+            raise value
+
+        return value
+
+    def wait(self):
+        """Get the exit code of a module run, like ``Popen.wait``."""
+        return self.result()
+
+
+class forkserver(zetup.object):
+    """
+    Warm server process forking children for out-of-process ``%magic``.
+
+    Like :class:`moreshell.process.process_pool`, the server is started on
+    first use and kept running, and it is stopped automatically when its
+    parent process exits. Instead of starting a fresh interpreter per
+    external command, which repeats all imports, the work is run in a child
+    forked from the server, whose `preload` modules are already imported.
+    Only available on platforms with ``os.fork`` and ``AF_UNIX`` sockets
+    """
+
+    def __init__(self, preload=()):
+        """Prepare a server with `preload` modules, started on demand."""
+        self.preload = list(preload)
+        self.process = None
+        self.socket_dir = None
+        self._lock = Lock()
+
+    @property
+    def socket_path(self):
+        """Get the path of the server's socket."""
+        return os.path.join(self.socket_dir, 'socket')
+
+    def set_preload(self, names):
+        """Change the preloaded modules, which restarts the server."""
+        self.shutdown()
+        self.preload = list(names)
+
+    def start(self):
+        """
+        Start the server, unless already running.
+
+        With the current ``sys.path`` as ``PYTHONPATH``, since the forked
+        children inherit the imports of the server
+        """
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+
+            if not hasattr(os, 'fork') or not hasattr(
+                    socket, 'AF_UNIX'):  # pragma: no cover
+                raise RuntimeError(
+                    "{!r} needs os.fork and AF_UNIX sockets".format(self))
+
+            self._stop()
+            # PY2 gives the byte-code file name if not compiled from source
+            filename = __file__[:-1] if __file__.endswith('.pyc') else (
+                __file__)
+            self.socket_dir = tempfile.mkdtemp(prefix='moreshell-forkserver-')
+            # for finding what this process found via sys.path changes
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            self.process = subprocess.Popen(
+                [sys.executable, '-c', LAUNCHER, filename, self.socket_path]
+                + self.preload,
+                env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            if self.process.stdout.readline() != b'ready\n':
+                self._stop()
+                raise RuntimeError(
+                    "Forkserver failed to preload {!r}".format(self.preload))
+
+    def request(self, message):
+        """Send the request `message` to a new child."""
+        data = dump_message(message)
+        self.start()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        sock.sendall(data)
+        return forked_process(sock)
+
+    def spawn_module(self, name, argv=(), env=None):
+        """
+        Run module `name` like ``python -m`` in a new child.
+
+        With the command line `argv`, the environment variables `env`,
+        which default to ``os.environ``, and the current working directory
+
+        :return: The :class:`.forked_process` handle
+        """
+        return self.request((
+            'module', name, list(argv),
+            dict(os.environ if env is None else env), os.getcwd()))
+
+    def run_module(self, name, argv=(), env=None):
+        """
+        Run module `name` like :meth:`.spawn_module` and print its output.
+
+        :return: The exit code
+        """
+        process = self.spawn_module(name, argv, env=env)
+        for line in iter(process.readline, u''):
+            sys.stdout.write(line)
+        return process.wait()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call `func` with `args` and `kwargs` in a new child.
+
+        All of them and the result must be picklable, so `func` must be
+        defined at the top level of an importable module. Output of the
+        child is printed
+
+        :return: The return value of `func`
+        :raises: The exception raised by `func`
+        """
+        process = self.request(('call', func, args, kwargs))
+        for line in iter(process.readline, u''):
+            sys.stdout.write(line)
+        return process.result()
+
+    def shutdown(self):
+        """Stop the server, which is restarted on demand."""
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        process, self.process = self.process, None
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+            process.stdout.close()
+        if self.socket_dir is not None:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+            self.socket_dir = None
+
+
+#: The shared :class:`moreshell.forkserver.forkserver` of all ``%magic``.
+server = forkserver()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1], sys.argv[2:])
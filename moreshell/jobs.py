@@ -0,0 +1,200 @@
+"""Run ``%magic`` in the background and manage the resulting jobs."""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+from timeit import default_timer
+
+import zetup
+
+from moreshell import IPython_magic_module, IPython_magic, with_arguments
+
+IPython_magic_module(__name__, [
+    'job_manager',
+    'magic_job',
+    'jobs',
+    'moreshell_jobs',
+])
+
+
+class magic_job(zetup.object):
+    """
+    Handle of a ``%magic`` call running in the background.
+
+    Returned by ``%magic`` created with the ``background=`` option or called
+    with the ``--background`` flag. Wraps the ``concurrent.futures.Future``
+    of the call
+    """
+
+    def __init__(self, id, magic, future):
+        """Initialize with job `id`, the running `magic`, and its `future`."""
+        self.id = id
+        self.magic = magic
+        self.future = future
+        self.started = default_timer()
+        self.finished = None
+        future.add_done_callback(self._finish)
+
+    def _finish(self, future):
+        self.finished = default_timer()
+
+    def __repr__(self):
+        return "<job {} {!r} {} at {}>".format(
+            self.id, self.magic, self.status, hex(id(self)).rstrip('L'))
+
+    @property
+    def status(self):
+        """
+        Get the job status.
+
+        One of ``'pending'``, ``'running'``, ``'done'``, ``'failed'``, or
+        ``'cancelled'``
+        """
+        future = self.future
+        if future.cancelled():
+            return 'cancelled'
+
+        if future.done():
+            return 'failed' if future.exception() is not None else 'done'
+
+        return 'running' if future.running() else 'pending'
+
+    @property
+    def elapsed(self):
+        """Get the seconds the job has been running or took to finish."""
+        return (self.finished or default_timer()) - self.started
+
+    def done(self):
+        """Check if the job is finished, failed, or cancelled."""
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the job to finish and get the ``%magic`` result.
+
+        Re-raises any exception of the ``%magic``
+        """
+        return self.future.result(timeout=timeout)
+
+    def exception(self, timeout=None):
+        """Wait for the job to finish and get any raised exception."""
+        return self.future.exception(timeout=timeout)
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish without raising its exception."""
+        self.exception(timeout=timeout)
+        return self
+
+    def cancel(self):
+        """
+        Cancel the job if it is still pending.
+
+        Already running jobs can't be cancelled. Returns if cancelled
+        """
+        return self.future.cancel()
+
+
+class job_manager(zetup.object):
+    """
+    Thread pool running ``%magic`` in the background.
+
+    Keeps track of the resulting :class:`moreshell.jobs.magic_job` handles,
+    which are listed, waited for, cancelled, and collected with the
+    ``%moreshell_jobs`` magic
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Prepare a thread pool of `max_workers`, which is created on demand.
+
+        The default number of workers is determined by
+        ``concurrent.futures.ThreadPoolExecutor``. It can be changed until
+        the first job is submitted or after :meth:`.shutdown`
+        """
+        self.max_workers = max_workers
+        self.executor = None
+        self.jobs = OrderedDict()
+        self._ids = count(1)
+        self._lock = Lock()
+
+    def __iter__(self):
+        return iter(list(self.jobs.values()))
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __getitem__(self, id):
+        try:
+            return self.jobs[id]
+
+        except KeyError:
+            raise KeyError("No moreshell job with ID {!r}".format(id))
+
+    def submit(self, magic, args, *block, **kwargs):
+        """
+        Run `magic` with parsed `args` and cell `block` in the background.
+
+        Using :meth:`moreshell.magic.magic_function.invoke`, which also gets
+        the `kwargs`, and returning a :class:`moreshell.jobs.magic_job`
+        """
+        with self._lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            job = magic_job(
+                next(self._ids), magic,
+                self.executor.submit(magic.invoke, args, *block, **kwargs))
+            self.jobs[job.id] = job
+        return job
+
+    def clear(self):
+        """Forget all finished jobs."""
+        with self._lock:
+            for job in list(self.jobs.values()):
+                if job.done():
+                    del self.jobs[job.id]
+
+    def shutdown(self, wait=True):
+        """Shut down the thread pool, which is recreated on demand."""
+        with self._lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+#: The shared :class:`moreshell.jobs.job_manager` of all ``%magic``.
+jobs = job_manager()
+
+
+@IPython_magic(
+    with_arguments
+    ('ids', nargs='*', type=int, metavar='ID',
+     help="Job IDs, defaulting to all jobs")
+    ('-w', '--wait', action='store_true', help="Wait for the jobs to finish")
+    ('-c', '--cancel', action='store_true', help="Cancel pending jobs")
+    ('-r', '--result', action='store_true',
+     help="Wait for and return the job results")
+    ('--clear', action='store_true', help="Forget all finished jobs")
+)
+def moreshell_jobs(shell, args):
+    """List, wait for, cancel, and collect background ``%magic`` jobs."""
+    selected = [jobs[id] for id in args.ids] if args.ids else list(jobs)
+    if args.cancel:
+        for job in selected:
+            job.cancel()
+    if args.wait:
+        for job in selected:
+            job.wait()
+    if args.result:
+        results = [job.result() for job in selected]
+        return results[0] if len(args.ids) == 1 else results
+
+    for job in selected:
+        print("[{}] {:<9} {:>9.3f}s  {!r}".format(
+            job.id, job.status, job.elapsed, job.magic))
+    if args.clear:
+        jobs.clear()
@@ -0,0 +1,223 @@
+"""Register ``%magic`` functions without importing their modules."""
+
+import ast
+import sys
+from collections import OrderedDict
+
+import zetup
+
+import moreshell
+
+__all__ = ('lazy_magic', 'lazy_magic_module', 'scan_magic_module')
+
+#: Decorator names mapped to the kind of magic they create.
+DECORATORS = {
+    'IPython_magic': 'line',
+    'IPython_cell_magic': 'cell',
+}
+
+
+def find_module_file(name):
+    """Find the source file of the module `name` without importing it."""
+    filename = getattr(sys.modules.get(name), '__file__', None)
+    if filename:
+        # PY2 gives the byte-code file name if not compiled from source
+        return filename[:-1] if filename.endswith('.pyc') else filename
+
+    try:
+        from importlib.util import find_spec
+
+    except ImportError:  # pragma: no cover
+        from pkgutil import get_loader
+
+        loader = get_loader(name)
+        return loader and loader.get_filename()
+
+    spec = find_spec(name)
+    return spec and spec.has_location and spec.origin
+
+
+def decorator_name(node):
+    """Get the (last dotted) name used in a decorator expression `node`."""
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+
+    return getattr(node, 'id', None)
+
+
+def string_value(node):
+    """Get the value of a string literal `node` or ``None``."""
+    value = getattr(node, 's', getattr(node, 'value', None))
+    if isinstance(value, str):
+        return value
+
+    return None
+
+
+def scan_magic_module(name):
+    """
+    Statically find the ``%magic`` defined in the module `name`.
+
+    By parsing the module source for the names given to
+    :class:`moreshell.IPython_magic_module` and for the functions decorated
+    with :class:`moreshell.IPython_magic`,
+    :class:`moreshell.IPython_cell_magic`, and ``.cell_magic``
+
+    Returns an ordered mapping of magic names to their kinds of magic, or
+    ``None`` if the module source can't be found or if not all of its magic
+    names can be resolved
+    """
+    filename = find_module_file(name)
+    if not filename or not filename.endswith('.py'):
+        return None
+
+    with open(filename, 'rb') as source:
+        tree = ast.parse(source.read(), filename)
+
+    names = None
+    kinds = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and (
+                decorator_name(node) == 'IPython_magic_module' and
+                len(node.args) > 1 and
+                isinstance(node.args[1], (ast.List, ast.Tuple))):
+            names = [string_value(item) for item in node.args[1].elts]
+
+        elif type(node).__name__ in ('FunctionDef', 'AsyncFunctionDef'):
+            for deco in node.decorator_list:
+                kind = DECORATORS.get(decorator_name(deco))
+                if kind is None and decorator_name(deco) == 'cell_magic':
+                    kind = 'cell'
+                if kind is not None:
+                    kinds.setdefault(node.name, []).append(kind)
+
+    if not names or None in names or not all(
+            name in kinds for name in names):
+        return None
+
+    return OrderedDict((name, kinds[name]) for name in names)
+
+
+class lazy_magic(zetup.object):
+    """
+    Placeholder for a not yet imported ``%magic`` or cell ``%%magic``.
+
+    Registered in IPython's ``magics_manager`` by
+    :meth:`moreshell.lazy.lazy_magic_module.load`. On its first call, it
+    imports the real :class:`moreshell.IPython_magic_module`, which replaces
+    all placeholders of the module with the real ``%magic`` functions, and
+    forwards the call
+    """
+
+    #: The IPython shell instance, which is assigned by :meth:`.load`.
+    shell = None
+
+    def __init__(self, module, name, kind_of_magic='line', help=None):
+        """
+        Initialize with the :class:`moreshell.lazy.lazy_magic_module`.
+
+        And with the `name` and `kind_of_magic` of the real ``%magic``, and
+        optionally its `help` text from a
+        :class:`moreshell.manifest.magic_manifest`, which is then used as
+        ``__doc__`` for ``%magic?`` in IPython
+        """
+        self.module = module
+        self.__name__ = name
+        self.kind_of_magic = kind_of_magic
+        self.__doc__ = help
+
+    def __repr__(self):
+        return "<lazy {}{} from {!r} at {}>".format(
+            '%' if self.kind_of_magic == 'line' else '%%', self.__name__,
+            self.module.__name__, hex(id(self)).rstrip('L'))
+
+    def load(self, shell):
+        shell.magics_manager.magics[self.kind_of_magic][self.__name__] = self
+        self.shell = shell
+
+    def unload(self, shell):
+        magics = shell.magics_manager.magics[self.kind_of_magic]
+        if magics.get(self.__name__) is self:
+            del magics[self.__name__]
+        self.shell = None
+
+    def resolve(self):
+        """Import the real module and get the real ``%magic`` function."""
+        magic = getattr(self.module.resolve(self.shell), self.__name__)
+        if self.kind_of_magic != magic.kind_of_magic:
+            magic = magic.cell
+        return magic
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+
+class lazy_magic_module(zetup.object):
+    """
+    Stand-in for a not yet imported :class:`moreshell.IPython_magic_module`.
+
+    Returned by :func:`moreshell.load_magic_modules` in lazy mode. Provides
+    the same :meth:`.load` and :meth:`.unload` interface, but only for
+    :class:`moreshell.lazy.lazy_magic` placeholders
+    """
+
+    def __init__(self, name, magics, helps=None):
+        """
+        Initialize with module `name` and `magics` from its static scan.
+
+        As returned by :func:`moreshell.lazy.scan_magic_module` or
+        :meth:`moreshell.manifest.magic_manifest.magics`, the latter also
+        providing the optional `helps` texts
+        """
+        helps = helps or {}
+        self.__name__ = name
+        self.magics = [
+            lazy_magic(
+                self, magic_name, kind, help=helps.get((magic_name, kind)))
+            for magic_name, kinds in magics.items() for kind in kinds]
+
+    def __repr__(self):
+        return "<lazy magic module {!r} at {}>".format(
+            self.__name__, hex(id(self)).rstrip('L'))
+
+    def load(self, shell):
+        for magic in self.magics:
+            magic.load(shell=shell)
+
+    def unload(self, shell):
+        """
+        Remove the placeholders from `shell`.
+
+        And the real ``%magic`` of the module, if already resolved and
+        loaded into `shell`
+        """
+        self.unload_placeholders(shell)
+        mod = sys.modules.get(self.__name__)
+        if isinstance(mod, moreshell.IPython_magic_module):
+            mod.unload(shell=shell)
+
+    def unload_placeholders(self, shell):
+        """Remove only the placeholders of this module from `shell`."""
+        for magic in self.magics:
+            magic.unload(shell=shell)
+
+    def resolve(self, shell):
+        """
+        Import the real :class:`moreshell.IPython_magic_module`.
+
+        And replace all placeholders of this module registered in `shell`
+        with the real ``%magic`` functions
+        """
+        mod = sys.modules.get(self.__name__)
+        if not isinstance(mod, moreshell.IPython_magic_module):
+            from .module import import_magic_modules
+
+            mod, = import_magic_modules([self.__name__])
+        if shell is None:
+            return mod
+
+        self.unload_placeholders(shell)
+        mod.load(shell=shell)
+        return mod
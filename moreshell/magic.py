@@ -1,13 +1,29 @@
 """The fancy decorator way of defining new ``%magic`` functions."""
 
 from abc import ABCMeta, abstractproperty
+from timeit import default_timer
+
+try:
+    from inspect import iscoroutinefunction
+
+except ImportError:  # pragma: no cover
+    def iscoroutinefunction(func):
+        """PY2 has no ``async def``."""
+        return False
 
 import zetup
 from six import with_metaclass
 
 import moreshell
+from . import trace
+from .cache import MISSING, bounded_cache, copy_namespace, result_key
+from .parser import compiled_parser
+from .profiling import (
+    inject_profile_options, profiling_requested, run_profiled)
 
-__all__ = ('IPython_magic', 'IPython_cell_magic', 'IPythonMagicExit')
+__all__ = (
+    'IPython_magic', 'IPython_cell_magic', 'IPythonMagicBudgetExceeded',
+    'IPythonMagicExit')
 
 
 class IPythonMagicExit(SystemExit):
@@ -21,6 +37,59 @@ class IPythonMagicExit(SystemExit):
     __package__ = moreshell
 
 
+class IPythonMagicBudgetExceeded(Exception):
+    """
+    A :class:`moreshell.IPython_magic`-based ``%magic`` exceeded its budget.
+
+    Of wall time, CPU time, or memory, set with the ``timeout=``,
+    ``max_cpu_seconds=``, and ``max_memory=`` options of the creator, or
+    with the matching ``--timeout``, ``--max-cpu-seconds``, and
+    ``--max-memory`` flags. See :class:`moreshell.budget.budget`
+
+    The exceeded `resource` is ``'wall'``, ``'cpu'``, or ``'memory'``, and
+    the `usage` maps all three to the seconds and bytes used until
+    cancellation, with ``None`` for unmeasured ones
+    """
+
+    __package__ = moreshell
+
+    #: Descriptions of the resources.
+    RESOURCE_NAMES = {
+        'wall': 'wall time', 'cpu': 'CPU time', 'memory': 'memory'}
+
+    def __init__(self, prog, resource, limit, usage):
+        Exception.__init__(self, prog, resource, limit, usage)
+        self.prog = prog
+        self.resource = resource
+        self.limit = limit
+        self.usage = usage
+
+    def __str__(self):
+        figures = []
+        for name in ['wall', 'cpu', 'memory']:
+            value = self.usage.get(name)
+            if value is not None:
+                figures.append(
+                    '{} {}'.format(name, format_usage(name, value)))
+        return "{} exceeded its {} budget of {} ({})".format(
+            self.prog, self.RESOURCE_NAMES[self.resource],
+            format_usage(self.resource, self.limit).lstrip('+'),
+            ', '.join(figures))
+
+
+def format_usage(resource, value):
+    """
+    Format a `value` of seconds or bytes according to the `resource` kind.
+
+    >>> format_usage('cpu', 2), format_usage('memory', -2 ** 19)
+    ('2.00s', '-0.5 MiB')
+    """
+    if resource == 'memory':
+        return '{:+.1f} MiB'.format(value / 2.0 ** 20)
+
+    return '{:.2f}s'.format(value)
+
+
 class magic_function_meta(ABCMeta, zetup.meta):
     """Metaclass for :class:`moreshell.magic.magic_function`."""
 
@@ -28,33 +97,56 @@ class magic_function_meta(ABCMeta, zetup.meta):
         """
         Create a ``.__doc__`` property for every ``%magic``.
 
-        To get the ``--help`` output when using ``%magic?`` in IPython
+        To get the ``--help`` output when using ``%magic?`` in IPython. It is
+        rendered only once and neither printed nor raising ``SystemExit``.
+        See :meth:`moreshell.IPython_magic.format_help`
         """
         ABCMeta.__init__(cls, clsname, bases, clsattrs)
         zetup.meta.__init__(cls, clsname, bases, clsattrs)
 
         def __doc__(self):
-            """Print the ``--help`` output of this ``%magic``."""
-            self.creator.parse_args(['--help'])
+            """Get the ``--help`` output of this ``%magic``."""
+            return self.creator.format_help()
 
         cls.__doc__ = property(__doc__)
 
 
-class magic_function(with_metaclass(magic_function_meta, zetup.object)):
+class magic_function(with_metaclass(magic_function_meta, object)):
     """
     Abstract base class for ``%magic`` and cell ``%%magic`` functions.
 
     Which are created with :class:`moreshell.IPython_magic` and
     :class:`moreshell.IPython_cell_magic`, respectively.
+
+    All per-``%magic`` state is kept in slots of the instances, which are
+    all of the two shared concrete classes
+    :class:`moreshell.magic.line_magic` and
+    :class:`moreshell.magic.cell_magic`. They have no ``__dict__``, which is
+    why this class is not derived from ``zetup.object``
     """
 
+    __slots__ = (
+        '__func__', '__name__', '_module', 'is_coroutine', 'parse_cache',
+        'result_cache', 'result_store', 'stats', 'shell')
+
     #:  It's a kind of magic.
     #
     #   There can be only two: ``'line'`` or ``'cell'``
     kind_of_magic = 'line'
 
-    #: The IPython shell instance, which is assigned by :meth:`.load`.
-    shell = None
+    @property
+    def __module__(self):
+        """
+        Get the name of the module defining the ``%magic``.
+
+        A property backed by a slot, since ``'__module__'`` can't be used in
+        ``__slots__`` next to the class attribute of the same name
+        """
+        return self._module
+
+    @__module__.setter
+    def __module__(self, name):
+        self._module = name
 
     def __init__(self, func):
         """Initialize with `func` from which the ``%magic`` was created."""
@@ -62,6 +154,52 @@ class magic_function(with_metaclass(magic_function_meta, zetup.object)):
         self.__module__ = func.__module__
         self.__name__ = func.__name__
 
+        #: The IPython shell instance, which is assigned by :meth:`.load`.
+        self.shell = None
+
+        #: Was this ``%magic`` created from an ``async def`` function?
+        self.is_coroutine = iscoroutinefunction(func)
+
+        #: The :class:`moreshell.cache.bounded_cache` of :meth:`.parse`
+        #  results, or ``None`` if disabled via the ``parse_cache=`` option
+        #  of the creator
+        self.parse_cache = None
+        if self.creator.parse_cache_size:
+            self.parse_cache = bounded_cache(self.creator.parse_cache_size)
+
+        #: The :class:`moreshell.cache.bounded_cache` of :meth:`.call`
+        #  results, or ``None`` if disabled via the ``cache=`` option of the
+        #  creator
+        self.result_cache = None
+        if self.creator.cache:
+            self.result_cache = bounded_cache(
+                128 if self.creator.cache is True else self.creator.cache,
+                ttl=self.creator.cache_ttl)
+
+        #: The :class:`moreshell.persist.result_store` of :meth:`.call`
+        #  results, or ``None`` if disabled via the ``persist=`` option of
+        #  the creator
+        self.result_store = self.creator.persist
+        if self.result_store is True:
+            from .persist import default_store
+
+            self.result_store = default_store()
+        elif not self.result_store:
+            self.result_store = None
+
+        #: The :class:`moreshell.stats.magic_stats` of :meth:`.execute`, or
+        #  ``None`` if disabled via the ``stats=`` option of the creator
+        self.stats = None
+        if self.creator.stats:
+            from .stats import magic_stats
+
+            self.stats = magic_stats(self.creator.prog)
+
+    def __repr__(self):
+        return "<{}{} at {}>".format(
+            '%' if self.kind_of_magic == 'line' else '%%', self.__name__,
+            hex(id(self)).rstrip('L'))
+
     @abstractproperty
     def creator(self):  # pragma: no cover
         """
@@ -83,8 +221,334 @@ class magic_function(with_metaclass(magic_function_meta, zetup.object)):
         self.shell = None
 
     def parse(self, line):
-        """Parse the argument `line` of a ``%magic`` call."""
-        return self.creator.parse_args(line.split())
+        """
+        Parse the argument `line` of a ``%magic`` call.
+
+        If enabled, results are cached per raw `line` in :attr:`.parse_cache`,
+        so that repeated calls skip ``argparse`` completely. Every call gets
+        its own copy of the cached ``argparse.Namespace``, and `line` is
+        parsed again if the cached values can't be copied
+        """
+        cache = self.parse_cache
+        if cache is None:
+            return self.creator.parse_args(line.split())
+
+        args = cache.get(line, MISSING)
+        if args is MISSING:
+            args = cache[line] = self.creator.parse_args(line.split())
+        try:
+            return copy_namespace(args)
+
+        except Exception:  # deepcopy raises all kinds of exceptions
+            return self.creator.parse_args(line.split())
+
+    def stage(self, line=''):
+        """
+        Get a pipeline stage calling this ``%magic`` with argument `line`.
+
+        A :class:`moreshell.pipe.pipeline_stage`, which is combined with
+        others into a :class:`moreshell.pipe.pipeline` with ``|``
+        """
+        from .pipe import pipeline_stage
+
+        return pipeline_stage(self, line)
+
+    def map(self, lines, block=None, workers=None):
+        """
+        Call the ``%magic`` with each argument line of `lines`.
+
+        And the same cell `block` for every line of a cell ``%%magic``,
+        without going through IPython's magic dispatch. All lines are parsed
+        first and then run in order, or in parallel on `workers` threads.
+        Returns a :class:`moreshell.batch.batch_result` of the results in
+        order, which also collects the errors of failed lines
+        """
+        from .batch import run_batch
+
+        return run_batch(
+            self, lines, () if block is None else (block, ), workers=workers)
+
+    def execute(self, line, *block):
+        """
+        Parse the argument `line` and :meth:`.call` with cell `block`.
+
+        Which is what happens when IPython calls the ``%magic``. Parse and
+        execution times are recorded in :attr:`.stats`, if enabled, and
+        written as spans to the :data:`moreshell.trace.active` trace file,
+        if tracing
+        """
+        stats = self.stats
+        tracer = trace.active
+        if stats is None and tracer is None:
+            return self.call(self.parse(line), *block)
+
+        start = default_timer()
+        parsed = None
+        try:
+            args = self.parse(line)
+            parsed = default_timer()
+            return self.call(args, *block)
+
+        except Exception:
+            if stats is not None:
+                stats.errors += 1
+            raise
+
+        finally:
+            end = default_timer()
+            if stats is not None:
+                stats.record(start, parsed, end)
+            if tracer is not None:
+                self.trace(tracer, start, parsed, end)
+
+    def trace(self, tracer, start, parsed, end):
+        """
+        Write the spans of a :meth:`.execute` call with `tracer`.
+
+        A span of the whole call, which contains a ``parse`` and, if parsing
+        succeeded, an ``execute`` span
+        """
+        tracer.record(self.creator.prog, 'magic', start, end)
+        if parsed is None:
+            tracer.record('parse', 'magic', start, end)
+        else:
+            tracer.record('parse', 'magic', start, parsed)
+            tracer.record('execute', 'magic', parsed, end)
+
+    def call(self, args, *block):
+        """
+        Call the ``%magic`` with parsed `args` and cell `block`.
+
+        Removes the options injected by the creator from `args` and then
+        either :meth:`.run` the ``%magic`` directly or submits it to the
+        shared :class:`moreshell.jobs.job_manager` for running in the
+        background, returning a :class:`moreshell.jobs.magic_job` handle
+
+        With ``--from-file PATH``, the cell `block` is replaced by a
+        :class:`moreshell.stream.file_block`
+
+        Calls with ``--profile`` or ``--memprofile`` flags are always run
+        directly with :func:`moreshell.profiling.run_profiled`
+
+        Results of direct calls are looked up in and added to the
+        :attr:`.result_cache` and the :attr:`.result_store`, if enabled. With
+        the ``--no-cache`` flag, the ``%magic`` is always run and the cached
+        result gets replaced
+
+        Calls with a :class:`moreshell.budget.budget` from the ``timeout=``,
+        ``max_cpu_seconds=``, and ``max_memory=`` options or flags are
+        cancelled when exceeding it, except for profiled calls
+        """
+        creator = self.creator
+        options = creator.pop_options(args)
+        budget = None
+        if 'timeout' in options:
+            from .budget import requested_budget
+
+            budget = requested_budget(creator, options)
+        if options.get('from_file') is not None:
+            block = (self.file_block(options['from_file'], *block), )
+        if creator.profile_flags and profiling_requested(options):
+            return run_profiled(self, args, block, options)
+
+        if creator.background or options.get('background'):
+            from .jobs import jobs
+
+            return jobs.submit(self, args, *block, budget=budget)
+
+        if self.result_cache is None and self.result_store is None:
+            return self.invoke(args, *block, budget=budget)
+
+        key = result_key(args, *block)
+        if key is None:
+            return self.invoke(args, *block, budget=budget)
+
+        return self.invoke_cached(
+            key, args, block, refresh=options.get('no_cache'), budget=budget)
+
+    def file_block(self, path, block):
+        """
+        Get the :class:`moreshell.stream.file_block` of ``--from-file``.
+
+        Raises ``ValueError`` if the cell `block` isn't empty
+        """
+        from .stream import file_block
+
+        if block.strip():
+            raise ValueError(
+                "{} got both a cell block and --from-file {!r}"
+                .format(self.creator.prog, path))
+
+        return file_block(path)
+
+    @property
+    def store_name(self):
+        """Get the qualified name of results in the :attr:`.result_store`."""
+        return '{}-{}.{}'.format(
+            self.kind_of_magic, self.__module__, self.__name__)
+
+    @property
+    def store_prefix(self):
+        """
+        Get the file name prefix of results in the :attr:`.result_store`.
+
+        The :attr:`.store_name` with a digest of the code of :attr:`.__func__`,
+        so that results of edited code are not used anymore
+        """
+        from .persist import code_digest
+
+        return '{}-{}'.format(
+            self.store_name, code_digest(self.__func__.__code__))
+
+    def invoke_cached(self, key, args, block, refresh=False, budget=None):
+        """
+        Get the result for cache `key` or :meth:`.invoke` with `args`.
+
+        Looks up the :attr:`.result_cache` first and then the
+        :attr:`.result_store`, unless a new result should be forced with
+        `refresh`. New results are added to both. Only new results are
+        limited by the optional `budget`
+        """
+        cache, store = self.result_cache, self.result_store
+        if not refresh:
+            if cache is not None:
+                result = cache.get(key, MISSING)
+                if result is not MISSING:
+                    return result
+
+            if store is not None:
+                result = store.get(self.store_prefix, key, MISSING)
+                if result is not MISSING:
+                    if cache is not None:
+                        cache[key] = result
+                    return result
+
+        result = self.invoke(args, *block, budget=budget)
+        if cache is not None:
+            cache[key] = result
+        if store is not None:
+            store.set(self.store_prefix, key, result)
+        return result
+
+    def cache_clear(self):
+        """
+        Remove all results from the :attr:`.result_cache`.
+
+        And those of this ``%magic`` from the :attr:`.result_store`, also
+        of previous versions of its code
+        """
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self.result_store is not None:
+            self.result_store.clear(self.store_name)
+
+    def invoke(self, args, *block, **kwargs):
+        """
+        Run the ``%magic`` with `args` and `block` on its executor.
+
+        Which is either the current thread, or, with the ``executor=``
+        option of the creator set to ``'process'``, a worker of the shared
+        :class:`moreshell.process.process_pool`. Waits for the result
+
+        The optional `budget=` keyword argument is a
+        :class:`moreshell.budget.budget` limiting the run
+        """
+        budget = kwargs.get('budget')
+        if self.creator.executor == 'process':
+            from .process import pool
+
+            return pool.run(self, args, *block, budget=budget)
+
+        if budget is not None:
+            return budget.run(self, args, *block)
+
+        return self.run(args, *block)
+
+    def run(self, args, *block, **kwargs):
+        """
+        Run the decorated function with parsed `args` and cell `block`.
+
+        The coroutines of ``async def`` functions are run with
+        :func:`moreshell.aio.run_coroutine`, according to the ``schedule=``
+        option of the creator, and with the optional `timeout=` keyword
+        argument
+
+        With the ``stream=`` option of the creator, the `block` is turned
+        into a lazy line iterator or reader with
+        :func:`moreshell.stream.open_block` first. Files memory-mapped for
+        ``--from-file`` are closed when the call, or the scheduled
+        coroutine, is done, with
+        :meth:`moreshell.stream.block_reader.close_after`, which keeps them
+        open for iterator results until exhausted
+        """
+        reader = None
+        if block and self.creator.stream:
+            from .stream import file_block, open_block
+
+            if isinstance(block[0], file_block):
+                reader = block[0].open()
+                block = (reader, )
+            block = (open_block(block[0], self.creator.stream), )
+        try:
+            result = self.__func__(self.shell, args, *block)
+            if self.is_coroutine:
+                from .aio import close_after, run_coroutine
+
+                if reader is not None:
+                    result, reader = close_after(result, reader), None
+                result = run_coroutine(
+                    result, schedule=self.creator.schedule,
+                    timeout=kwargs.get('timeout'))
+
+        except BaseException:
+            if reader is not None:
+                reader.release()
+            raise
+
+        if reader is not None:
+            result = reader.close_after(result)
+        return result
+
+
+class line_magic(magic_function):
+    """A line ``%magic`` created with :class:`moreshell.IPython_magic`."""
+
+    #: The slot-backed property instead of this class's module name.
+    __module__ = magic_function.__module__
+
+    __slots__ = ('creator', 'cell')
+
+    def __init__(self, creator, func):
+        """Initialize with the `creator` decorator and the decorated `func`."""
+        self.creator = creator
+        magic_function.__init__(self, func)
+
+    def __call__(self, line):
+        return self.execute(line)
+
+    def cell_magic(self, func):
+        """Create an accompanying cell ``%%magic`` from `func`."""
+        self.cell = self.creator.cell_magic(func)
+        return self
+
+
+class cell_magic(magic_function):
+    """A cell ``%%magic`` created with :class:`moreshell.IPython_magic`."""
+
+    #: The slot-backed property instead of this class's module name.
+    __module__ = magic_function.__module__
+
+    __slots__ = ('creator', )
+
+    kind_of_magic = 'cell'
+
+    def __init__(self, creator, func):
+        """Initialize with the `creator` decorator and the decorated `func`."""
+        self.creator = creator
+        magic_function.__init__(self, func)
+
+    def __call__(self, line, block):
+        return self.execute(line, block)
 
 
 class IPython_magic(zetup.program):
@@ -126,22 +590,361 @@ class IPython_magic(zetup.program):
 
     For only creating a cell ``%%magic``,
     :class:`moreshell.IPython_cell_magic` must be used for initial decoration
+
+    Parse results of argument lines can be cached per ``%magic``. The
+    maximum number of cached lines is set with the `parse_cache` option.
+    Caching is only safe for arguments whose ``type=`` and ``action=`` have
+    no side effects, so it is disabled by default:
+
+    >>> @IPython_magic(with_arguments('value'), parse_cache=128)
+    ... def cached_magic(parsed_args):
+    ...     do_something_with(parsed_args)
+
+    >>> cached_magic.parse_cache.maxsize
+    128
+
+    With the `compiled` option, simple argument definitions, consisting only
+    of flags, ``store_true``/``store_false`` options, single-value options,
+    and plain positionals, are compiled into a
+    :class:`moreshell.parser.compiled_parser` on decoration, which matches
+    argument lines much faster than ``argparse``:
+
+    >>> @IPython_magic(
+    ...     with_arguments
+    ...     ('value')
+    ...     ('-f', '--flag', action='store_true'),
+    ...     compiled=True)
+    ... def compiled_magic(parsed_args):
+    ...     do_something_with(parsed_args)
+
+    >>> compiled_magic.creator.compiled_parser
+    <moreshell.parser.compiled_parser at ...>
+
+    Anything not supported by the compiled parser, as well as errors and
+    ``--help``, is still handled by ``argparse``
+
+    The decorated function can also be an ``async def`` function, whose
+    coroutine is run on a dedicated event loop thread, and waited for::
+
+        @IPython_magic(with_arguments('url'))
+        async def fetch(shell, parsed_args):
+            return await fetch_somehow(parsed_args.url)
+
+    With the `schedule` option, the coroutine is only scheduled and the
+    ``%magic`` immediately returns an awaitable. See
+    :func:`moreshell.aio.run_coroutine`
+
+    Long-running ``%magic`` can be run in the background, on the thread
+    pool of the shared :class:`moreshell.jobs.job_manager`. Either always,
+    with the `background` option, or per call, with the ``--background``
+    flag added by the `background_flag` option:
+
+    >>> @IPython_magic(with_arguments('value'), background_flag=True)
+    ... def slow_magic(shell, parsed_args):
+    ...     do_something_slow_with(parsed_args)
+
+    >>> slow_magic.creator.injected_options
+    ['background']
+
+    Such calls immediately return a :class:`moreshell.jobs.magic_job`
+    handle. The jobs can be managed with the ``%moreshell_jobs`` magic from
+    ``%load_ext moreshell``. The ``--background`` flag can be added to all
+    ``%magic`` created afterwards by setting
+    ``IPython_magic.background_flag = True``
+
+    Call counts, parse and execution times, and latency percentiles of every
+    ``%magic`` are recorded in its ``.stats``, a
+    :class:`moreshell.stats.magic_stats` instance, and shown with the
+    ``%moreshell_stats`` magic from ``%load_ext moreshell``. The recording
+    is disabled with the `stats` option, or globally with
+    ``IPython_magic.stats = False``:
+
+    >>> @IPython_magic(with_arguments('value'), stats=False)
+    ... def unrecorded_magic(shell, parsed_args):
+    ...     do_something_with(parsed_args)
+
+    >>> unrecorded_magic.stats is None
+    True
+
+    The `profile_flags` option, or ``IPython_magic.profile_flags = True``
+    globally, adds ``--profile`` and ``--memprofile`` flags, which run only
+    the decorated function under ``cProfile`` or ``tracemalloc`` and print
+    a short report, as well as ``--profile-file PATH`` and
+    ``--memprofile-file PATH`` options for dumping the profile stats or
+    memory snapshot instead:
+
+    >>> @IPython_magic(with_arguments('value'), profile_flags=True)
+    ... def profiled_magic(shell, parsed_args):
+    ...     do_something_with(parsed_args)
+
+    >>> profiled_magic.creator.injected_options
+    ['profile', 'profile_file', 'memprofile', 'memprofile_file']
+
+    Results of pure ``%magic`` can be memoized with the `cache` option,
+    which is either ``True`` or the maximum number of cached results, and
+    the optional `cache_ttl` in seconds. Cache keys are the parsed arguments
+    and the hash of the cell block. A ``--no-cache`` flag is added for
+    forcing a new result, and ``.cache_clear()`` empties the cache:
+
+    >>> @IPython_magic(with_arguments('query'), cache=32, cache_ttl=3600)
+    ... def query_magic(shell, parsed_args):
+    ...     return run_slow_query(parsed_args.query)
+
+    >>> query_magic.result_cache.info()
+    cache_info(hits=0, misses=0, maxsize=32, currsize=0, hit_rate=0.0)
+
+    Results of long-running cell ``%%magic`` can also be persisted across
+    kernel restarts with the `persist` option, which is either ``True`` for
+    the shared :func:`moreshell.persist.default_store` in the user's cache
+    directory, or a :class:`moreshell.persist.result_store` instance. Stores
+    are bounded in size and can be shared by several kernels::
+
+        @IPython_cell_magic(with_arguments('table'), persist=True)
+        def train(shell, parsed_args, cell_block):
+            return train_somehow(parsed_args.table, cell_block)
+
+    Cell ``%%magic`` processing large pasted data can get the cell block
+    with the `stream` option as a lazy iterator of ``'lines'``, or as a
+    memoryview-backed :class:`moreshell.stream.block_reader` with
+    ``'reader'``, instead of a string. It also adds a ``--from-file PATH``
+    option for memory-mapping a file as cell block instead:
+
+    >>> @IPython_cell_magic(with_arguments('table'), stream='lines')
+    ... def load_csv(shell, parsed_args, cell_lines):
+    ...     for line in cell_lines:
+    ...         insert_somehow(parsed_args.table, line)
+
+    >>> load_csv.creator.injected_options
+    ['from_file']
+
+    CPU-bound ``%magic`` can use all cores without freezing the IPython
+    session, with the `executor` option set to ``'process'``, which runs
+    the decorated function in a warm worker of the shared
+    :class:`moreshell.process.process_pool`:
+
+    >>> @IPython_magic(with_arguments('value'), executor='process')
+    ... def heavy_magic(shell, parsed_args):
+    ...     return compute_something_heavy_with(parsed_args)
+
+    Runaway ``%magic`` in shared kernels are bounded per call with the
+    `timeout` and `max_cpu_seconds` options in seconds, and the `max_memory`
+    option in bytes. They add ``--timeout``, ``--max-cpu-seconds``, and
+    ``--max-memory`` flags for changing the limits per call, with ``0`` for
+    no limit. The flags can also be added without default limits with the
+    `budget_flags` option, or globally with
+    ``IPython_magic.budget_flags = True``:
+
+    >>> @IPython_magic(with_arguments('value'), timeout=60, max_memory=2**30)
+    ... def bounded_magic(shell, parsed_args):
+    ...     return compute_something_with(parsed_args)
+
+    >>> bounded_magic.creator.injected_options
+    ['timeout', 'max_cpu_seconds', 'max_memory']
+
+    Calls exceeding a limit are cancelled by raising
+    :exc:`moreshell.IPythonMagicBudgetExceeded` inside the running
+    decorated function, or, with ``executor='process'``, limited by
+    ``resource`` rlimits of the worker process. See
+    :class:`moreshell.budget.budget`
     """
 
     __package__ = moreshell
 
-    def __init__(self, arguments):
-        """Prepare decorator with a :class:`zetup.with_arguments` object."""
+    #: Add a ``--background`` flag to the ``%magic`` arguments?
+    #
+    #  The global default for the ``background_flag=`` option
+    background_flag = False
+
+    #: Record call statistics of the ``%magic``?
+    #
+    #  The global default for the ``stats=`` option
+    stats = True
+
+    #: Add ``--profile`` and ``--memprofile`` flags to the ``%magic``?
+    #
+    #  The global default for the ``profile_flags=`` option
+    profile_flags = False
+
+    #: Add ``--timeout``, ``--max-cpu-seconds``, and ``--max-memory`` flags?
+    #
+    #  The global default for the ``budget_flags=`` option. The flags are
+    #  always added to ``%magic`` with default limits
+    budget_flags = False
+
+    # the memoized format_help result with the spec it was rendered from
+    _help_cache = None
+
+    def __init__(
+            self, arguments, parse_cache=None, compiled=False,
+            schedule=False, background=False, background_flag=None,
+            executor=None, stats=None, profile_flags=None, cache=False,
+            cache_ttl=None, persist=None, stream=None, timeout=None,
+            max_cpu_seconds=None, max_memory=None, budget_flags=None):
+        """
+        Prepare decorator with a :class:`zetup.with_arguments` object.
+
+        The optional `parse_cache` size enables caching the parse results of
+        that many argument lines per ``%magic``. Caching is disabled with
+        ``0``, ``None``, or ``False``
+
+        The optional `compiled` flag enables the compiled fast-path parser
+
+        The optional `schedule` flag makes ``async def``-based ``%magic``
+        return awaitables instead of waiting for their results
+
+        The optional `background` flag makes all calls run in the
+        background, while the `background_flag` option adds a
+        ``--background`` flag for that, defaulting to the
+        :attr:`.background_flag` class attribute
+
+        The optional `executor` can be set to ``'process'`` for running the
+        decorated function in a worker process
+
+        The optional `stats` flag enables recording call statistics,
+        defaulting to the :attr:`.stats` class attribute
+
+        The optional `profile_flags` flag adds the profiling options,
+        defaulting to the :attr:`.profile_flags` class attribute
+
+        The optional `cache` flag or size enables memoizing results, which
+        optionally expire after `cache_ttl` seconds
+
+        The optional `persist` flag or :class:`moreshell.persist.result_store`
+        enables storing results on disk
+
+        The optional `stream` mode ``'lines'`` or ``'reader'`` changes how
+        cell ``%%magic`` get their cell block
+
+        The optional `timeout` and `max_cpu_seconds` in seconds and
+        `max_memory` in bytes limit every call, while the `budget_flags` flag
+        adds the flags for changing them per call, defaulting to the
+        :attr:`.budget_flags` class attribute
+        """
+        if executor not in (None, 'process'):
+            raise ValueError(
+                "executor of {!r} can be only None or 'process', not: {!r}"
+                .format(type(self), executor))
+
+        if stream not in (None, 'lines', 'reader'):
+            raise ValueError(
+                "stream of {!r} can be only None, 'lines', or 'reader', "
+                "not: {!r}".format(type(self), stream))
+
+        for name, value in [
+                ('timeout', timeout), ('max_cpu_seconds', max_cpu_seconds),
+                ('max_memory', max_memory)]:
+            if value is not None and value < 0:
+                raise ValueError(
+                    "{} of {!r} can't be negative, not: {!r}"
+                    .format(name, type(self), value))
+
         zetup.program.__init__(self, arguments)
-        self.cell_magic = IPython_cell_magic(arguments)
+        self.parse_cache_size = parse_cache
+        self.compiled = compiled
+        self.compiled_parser = None
+        self.schedule = schedule
+        self.background = background
+        self.executor = executor
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.persist = persist
+        self.stream = stream
+        self.timeout = timeout
+        self.max_cpu_seconds = max_cpu_seconds
+        self.max_memory = max_memory
+        if background_flag is not None:
+            self.background_flag = background_flag
+        if stats is not None:
+            self.stats = stats
+        if profile_flags is not None:
+            self.profile_flags = profile_flags
+        if budget_flags is not None:
+            self.budget_flags = budget_flags
+
+        #: The ``dest`` names of all options added by :meth:`.inject_option`
+        self.injected_options = []
+        if self.background_flag:
+            self.inject_option(
+                '--background', action='store_true',
+                help="Run in the background and return a job handle")
+        if self.profile_flags:
+            inject_profile_options(self)
+        if cache or persist:
+            self.inject_option(
+                '--no-cache', action='store_true',
+                help="Don't use a cached result, but run again and cache")
+        if stream and isinstance(self, IPython_cell_magic):
+            self.inject_option(
+                '--from-file', metavar='PATH',
+                help="Memory-map this file as cell block")
+        if self.budget_flags or timeout or max_cpu_seconds or max_memory:
+            from .budget import inject_budget_options
+
+            inject_budget_options(self)
+
+        if not isinstance(self, IPython_cell_magic):
+            self.cell_magic = IPython_cell_magic(
+                arguments, parse_cache=parse_cache, compiled=compiled,
+                schedule=schedule, background=background,
+                background_flag=background_flag, executor=executor,
+                stats=stats, profile_flags=profile_flags, cache=cache,
+                cache_ttl=cache_ttl, persist=persist, stream=stream,
+                timeout=timeout, max_cpu_seconds=max_cpu_seconds,
+                max_memory=max_memory, budget_flags=budget_flags)
+
+    def inject_option(self, *args, **kwargs):
+        """
+        Add an argument handled by moreshell instead of the ``%magic``.
+
+        Takes the same arguments as ``argparse.ArgumentParser.add_argument``.
+        The parsed value is removed again by :meth:`.pop_options` before the
+        decorated function gets the parsed arguments
+        """
+        action = self.add_argument(*args, **kwargs)
+        self.injected_options.append(action.dest)
+        return action
+
+    def pop_options(self, args):
+        """
+        Remove the injected options from parsed `args`.
+
+        Returns them as ``dict`` of ``dest`` names and values
+        """
+        if not self.injected_options:
+            return {}
+
+        namespace = vars(args)
+        return dict(
+            (dest, namespace.pop(dest)) for dest in self.injected_options)
+
+    def format_help(self):
+        """
+        Override ``argparse.ArgumentParser.format_help``.
+
+        Memoize the ``--help`` output, which is rendered again only if the
+        ``%magic`` name or the argument definitions change
+        """
+        spec = (self.prog, tuple(self._actions))
+        cached = self._help_cache
+        if cached is None or cached[0] != spec:
+            cached = self._help_cache = (
+                spec, super(IPython_magic, self).format_help())
+        return cached[1]
 
     def parse_args(self, line):
         """
         Override ``argparse.ArgumentParser.parse_args``.
 
+        Try the :attr:`.compiled_parser` first, if there is one
+
         Catch ``SystemExit`` and raise :exc:`moreshell.IPythonMagicExit`
         instead
         """
+        if self.compiled_parser is not None:
+            args = self.compiled_parser.parse(line)
+            if args is not None:
+                return args
+
         try:
             return super(IPython_magic, self).parse_args(line)
 
@@ -155,54 +958,16 @@ class IPython_magic(zetup.program):
         The `kind_of_magic` parameter is only for internal use and creates a
         cell ``%%magic`` when changed to ``'cell'``
         """
-        # to be used instead of self in the inner classes below
-        magic_deco = self
-
-        def cell_magic():
-            """Create a cell ``%%magic`` instead of a line ``%magic``."""
-            class cell_magic(magic_function):
-
-                __module__ = None
-
-                @property
-                def creator(self):
-                    return magic_deco
-
-                def __call__(self, line, block):
-                    return func(self.shell, self.parse(line), block)
-
-            self.prog = '%%{}'.format(func.__name__)
-            cell_magic.__name__ = cell_magic.__qualname__ = self.prog
-            cell_magic.kind_of_magic = 'cell'
-            return cell_magic(func)
-            # magic = magics['cell'][func.__name__] = cell_magic(func)
-            # return magic
+        if self.compiled:
+            self.compiled_parser = compiled_parser.compile(self)
 
         if kind_of_magic == 'line':
-            class line_magic(magic_function):
-
-                __module__ = None
-
-                @property
-                def creator(self):
-                    return magic_deco
-
-                def __call__(self, line):
-                    return func(self.shell, self.parse(line))
-
-                def cell_magic(self, func):
-                    """Create an accompanying cell ``%%magic`` from `func`."""
-                    self.cell = magic_deco.cell_magic(func)
-                    return self
-
             self.prog = '%{}'.format(func.__name__)
-            line_magic.__name__ = line_magic.__qualname__ = self.prog
-            return line_magic(func)
-            # magic = magics['line'][func.__name__] = line_magic(func)
-            # return magic
+            return line_magic(self, func)
 
-        elif kind_of_magic == 'cell':
-            return cell_magic()
+        if kind_of_magic == 'cell':
+            self.prog = '%%{}'.format(func.__name__)
+            return cell_magic(self, func)
 
         raise AssertionError(
             "kind_of_magic of {}.__call__ can be only two: 'line' or 'cell', "
@@ -227,14 +992,12 @@ class IPython_cell_magic(IPython_magic):
 
     >>> new_magic
     <%%new_magic at ...>
+
+    Takes the same options as :class:`moreshell.IPython_magic`
     """
 
     __package__ = moreshell
 
-    def __init__(self, arguments):
-        """Prepare decorator with a :class:`zetup.with_arguments` object."""
-        zetup.program.__init__(self, arguments)
-
     def __call__(self, func):
         """Decorate `func` to register as an IPython cell ``%magic``."""
         self.prog = '%%{}'.format(func.__name__)
@@ -0,0 +1,177 @@
+"""On-disk index of the ``%magic`` provided by magic modules."""
+
+import json
+import os
+import sys
+from collections import OrderedDict
+from hashlib import sha1
+
+import zetup
+from zetup import with_arguments
+
+from .lazy import find_module_file
+
+__all__ = ('magic_manifest', )
+
+#: Version of the manifest file format. Files of other versions are ignored.
+VERSION = 1
+
+#: Atomically replace files also on Windows, where available (PY3).
+replace = getattr(os, 'replace', os.rename)
+
+
+def default_manifest_path():
+    """Get the default manifest file path in the user's cache directory."""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'moreshell', 'manifest.json')
+
+
+def file_hash(filename):
+    """Get the SHA-1 hex digest of the content of `filename`."""
+    with open(filename, 'rb') as source:
+        return sha1(source.read()).hexdigest()
+
+
+class magic_manifest(zetup.object):
+    """
+    On-disk index of the ``%magic`` functions of magic modules.
+
+    Records the ``%magic`` names of every
+    :class:`moreshell.IPython_magic_module` together with their kinds of
+    magic and their ``--help`` output, so that
+    :func:`moreshell.load_magic_modules` can register lazy placeholders with
+    help texts without importing the modules. Entries are invalidated when
+    the modification time and the content hash of a module file change
+
+    Used via the ``manifest=`` option of :func:`moreshell.load_magic_modules`
+    or generated at build time with ``python -m moreshell.manifest``
+    """
+
+    def __init__(self, path=None):
+        """
+        Load the manifest from `path`.
+
+        Which defaults to ``moreshell/manifest.json`` in the user's cache
+        directory. A missing, broken, or outdated file gives an empty
+        manifest
+        """
+        self.path = path or default_manifest_path()
+        self.modules = {}
+
+        #: Are there changes not saved yet?
+        self.dirty = False
+        try:
+            with open(self.path) as manifest:
+                data = json.load(manifest)
+
+        except (IOError, OSError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get('version') == VERSION:
+            self.modules = data.get('modules', {})
+
+    def save(self):
+        """Write the manifest atomically to its :attr:`.path`."""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as manifest:
+            json.dump(
+                {'version': VERSION, 'modules': self.modules}, manifest,
+                indent=1, sort_keys=True)
+        replace(temp_path, self.path)
+        self.dirty = False
+
+    def get(self, name):
+        """
+        Get the up-to-date entry of the magic module `name`.
+
+        Or ``None`` if there is none. Never imports the module
+        """
+        entry = self.modules.get(name)
+        if entry is None:
+            return None
+
+        try:
+            stat = os.stat(entry['file'])
+
+        except OSError:
+            return None
+
+        if (stat.st_mtime, stat.st_size) != (entry['mtime'], entry['size']):
+            if file_hash(entry['file']) != entry['hash']:
+                return None
+
+            entry['mtime'], entry['size'] = stat.st_mtime, stat.st_size
+            self.dirty = True
+        return entry
+
+    def generate(self, name):
+        """
+        Import the magic module `name` and create its manifest entry.
+
+        Only marks the manifest as :attr:`.dirty` and doesn't :meth:`.save`
+        """
+        from .module import import_magic_modules
+
+        mod, = import_magic_modules([name])
+        filename = find_module_file(name)
+        stat = os.stat(filename)
+
+        magics = []
+        for kind in ['line', 'cell']:
+            for magic_name, magic in sorted(mod.magic_index[kind].items()):
+                magics.append({
+                    'name': magic_name,
+                    'kind': kind,
+                    'help': magic.creator.format_help(),
+                })
+
+        entry = self.modules[name] = {
+            'file': filename,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': file_hash(filename),
+            'magics': magics,
+        }
+        self.dirty = True
+        return entry
+
+    def magics(self, name):
+        """
+        Get the ``%magic`` names, kinds, and help texts of module `name`.
+
+        As ordered mapping of names to kinds of magic, like returned by
+        :func:`moreshell.lazy.scan_magic_module`, and a mapping of
+        ``(name, kind)`` pairs to help texts
+
+        The manifest entry is generated on first use or when outdated, which
+        imports the module
+        """
+        entry = self.get(name) or self.generate(name)
+        kinds = OrderedDict()
+        helps = {}
+        for magic in entry['magics']:
+            kinds.setdefault(magic['name'], []).append(magic['kind'])
+            helps[magic['name'], magic['kind']] = magic['help']
+        return kinds, helps
+
+
+@zetup.program(
+    with_arguments
+    ('names', nargs='+', metavar='MODULE')
+    ('--path', help="Manifest file, defaults to user's cache directory")
+)
+def main(args):
+    """Generate manifest entries for the given magic modules at build time."""
+    manifest = magic_manifest(args.path)
+    for name in args.names:
+        manifest.generate(name)
+    manifest.save()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
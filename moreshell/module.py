@@ -1,13 +1,17 @@
 """Wrap modules for creating ``%magic`` inside."""
 
 import sys
+from collections import OrderedDict
 from importlib import import_module
 from inspect import ismodule
+from timeit import default_timer
 
 import zetup
 from moretools import dictkeys
 
 import moreshell
+from . import trace
+from .lazy import lazy_magic_module, scan_magic_module
 from .magic import IPython_magic, IPython_cell_magic, magic_function
 
 zetup.module(__name__, [
@@ -15,6 +19,12 @@ zetup.module(__name__, [
     'load_magic_modules',
 ])
 
+#: The durations in seconds of all :func:`.import_magic_modules` imports.
+#
+#  By full module name, in order of import completion. Modules that were
+#  already imported before are recorded with their (negligible) lookup time
+import_timings = OrderedDict()
+
 
 class IPython_magic_module(zetup.module):
     """
@@ -46,17 +56,80 @@ class IPython_magic_module(zetup.module):
 
     __package__ = moreshell
 
+    @property
+    def magic_index(self):
+        """
+        Get all ``%magic`` and cell ``%%magic`` functions of this module.
+
+        Including the accompanying cell ``%%magic`` of line ``%magic``,
+        grouped by their :attr:`moreshell.magic.magic_function.kind_of_magic`
+        and mapped by their names, just like IPython's ``magics_manager``
+        organizes them
+
+        Built on first access and cached, since the wrapper is instantiated
+        before the module defines its ``%magic`` functions
+        """
+        index = self.__dict__.get('_magic_index')
+        if index is None:
+            index = {'line': {}, 'cell': {}}
+            for name in self.__all__:
+                obj = getattr(self, name)
+                if isinstance(obj, magic_function):
+                    index[obj.kind_of_magic][obj.__name__] = obj
+                    cell = getattr(obj, 'cell', None)
+                    if cell is not None:
+                        index['cell'][cell.__name__] = cell
+
+            self.__dict__['_magic_index'] = index
+        return index
+
+    @property
+    def loaded_shells(self):
+        """Get the list of IPython shells this module is loaded into."""
+        return self.__dict__.setdefault('_loaded_shells', [])
+
     def load(self, shell):
-        for name in self.__all__:
-            obj = getattr(self, name)
-            if isinstance(obj, magic_function):
-                obj.load(shell=shell)
+        """
+        Register all ``%magic`` of :attr:`.magic_index` in `shell`.
+
+        Does nothing if already loaded into `shell`
+        """
+        loaded = self.loaded_shells
+        if any(other is shell for other in loaded):
+            return
+
+        start = default_timer()
+        magics = shell.magics_manager.magics
+        for kind, index in self.magic_index.items():
+            magics[kind].update(index)
+            for magic in index.values():
+                magic.shell = shell
+        loaded.append(shell)
+        trace.record('load ' + self.__name__, 'module', start)
 
     def unload(self, shell):
-        for name in self.__all__:
-            obj = getattr(self, name)
-            if isinstance(obj, magic_function):
-                obj.unload(shell=shell)
+        """
+        Remove all ``%magic`` of :attr:`.magic_index` from `shell`.
+
+        Leaves alone any other ``%magic`` registered under the same names in
+        the meantime. Does nothing if not loaded into `shell`
+        """
+        loaded = self.loaded_shells
+        for index, other in enumerate(loaded):
+            if other is shell:
+                del loaded[index]
+                break
+        else:
+            return
+
+        start = default_timer()
+        magics = shell.magics_manager.magics
+        for kind, index in self.magic_index.items():
+            for name, magic in index.items():
+                if magics[kind].get(name) is magic:
+                    del magics[kind][name]
+                magic.shell = None
+        trace.record('unload ' + self.__name__, 'module', start)
 
 
 def load_magic_modules(*names, **kwargs):
@@ -73,42 +146,180 @@ def load_magic_modules(*names, **kwargs):
             The optional parent package name of the modules
         -   `shell=`
             The IPython shell instance given to ``load_ipython_extension``
+        -   `workers=`
+            The number of threads for importing the modules in parallel.
+            See :func:`moreshell.module.import_magic_modules`
+        -   `lazy=`
+            Don't import the modules yet, but only register
+            :class:`moreshell.lazy.lazy_magic` placeholders, which import
+            their module on first use. Modules whose ``%magic`` names can't
+            be found with :func:`moreshell.lazy.scan_magic_module` are still
+            imported immediately
+        -   `manifest=`
+            Implies `lazy=` mode and gets the ``%magic`` names, kinds, and
+            help texts of the modules from an on-disk
+            :class:`moreshell.manifest.magic_manifest`, instead of scanning
+            the module sources. Can be a manifest instance, a manifest file
+            path, or ``True`` for the default manifest file. Missing or
+            outdated manifest entries are generated by importing the modules
+        -   `watch=`
+            Reload changed modules before every cell execution in `shell`,
+            only updating their added, removed, or changed ``%magic``. Can
+            be a :class:`moreshell.watch.module_watcher` instance, or
+            ``True`` for the shared
+            :func:`moreshell.watch.default_watcher`
+
+    :return:
+        The list of loaded modules, which contains
+        :class:`moreshell.lazy.lazy_magic_module` stand-ins for modules not
+        yet imported in lazy mode
     """
     package = kwargs.pop('package', None)
     shell = kwargs.pop('shell', None)
+    workers = kwargs.pop('workers', None)
+    lazy = kwargs.pop('lazy', False)
+    manifest = kwargs.pop('manifest', None)
+    watch = kwargs.pop('watch', None)
     if kwargs:
         raise TypeError(
             "moreshell.load_magic_modules() "
             "got (an) unexpected keyword argument(s) {}"
             .format(', '.join(map(repr, dictkeys(kwargs)))))
 
-    modules = import_magic_modules(names, package=package)
+    if manifest is not None and manifest is not False:
+        from .manifest import magic_manifest
+
+        if not isinstance(manifest, magic_manifest):
+            manifest = magic_manifest(
+                None if manifest is True else manifest)
+        modules = lazy_import_magic_modules(
+            names, package=package, manifest=manifest)
+    elif lazy:
+        modules = lazy_import_magic_modules(names, package=package)
+    else:
+        modules = import_magic_modules(
+            names, package=package, workers=workers)
     for mod in modules:
         mod.load(shell=shell)
+    if watch is not None and watch is not False:
+        from .watch import default_watcher
+
+        watcher = default_watcher() if watch is True else watch
+        for mod in modules:
+            watcher.watch(mod.__name__)
+        watcher.start(shell)
     return modules
 
 
-def import_magic_modules(names, package=None):
+def magic_module_names(names, package=None):
     """
-    Import modules wrapped with :class:`moreshell.IPython_magic_module`.
+    Get the full names of the given magic module `names`.
 
     :param names:
-        The names of the magic modules to load
+        The names of the magic modules
     :param package:
-        The optional parent package name of the modules
+        The optional parent package name or object of the modules
     """
     if package is not None:
         if ismodule(package):
             package = package.__name__
-        names = ('.'.join((package, name)) for name in names)
+        return ['.'.join((package, name)) for name in names]
 
-    modules = []
+    return list(names)
+
+
+def import_magic_modules(names, package=None, workers=None):
+    """
+    Import modules wrapped with :class:`moreshell.IPython_magic_module`.
+
+    The duration of every import is recorded in
+    :data:`moreshell.module.import_timings`
+
+    :param names:
+        The names of the magic modules to load
+    :param package:
+        The optional parent package name of the modules
+    :param workers:
+        The optional number of threads for importing the modules in
+        parallel, which speeds up loading independent modules that import
+        slow third-party packages. Python's per-module import locks take
+        care of modules being imported by several threads at once. The
+        returned modules are always in the order of the given `names`
+    """
+    names = magic_module_names(names, package=package)
+    if not workers or len(names) < 2:
+        return [import_magic_module(name) for name in names]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # import shared parent packages up front instead of letting all worker
+    # threads wait for the same package import lock
     for name in names:
-        mod = import_module(name)
-        if not isinstance(mod, IPython_magic_module):
-            raise TypeError(
-                "{!r} is not wrapped with {!r}".format(
-                    mod, IPython_magic_module))
+        package = name.rpartition('.')[0]
+        if package:
+            import_module(package)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(import_magic_module, names))
+
+
+def import_magic_module(name):
+    """
+    Import a module wrapped with :class:`moreshell.IPython_magic_module`.
+
+    And record the import duration in :data:`moreshell.module.import_timings`
+
+    :param name:
+        The full name of the magic module
+    """
+    start = default_timer()
+    mod = import_module(name)
+    end = default_timer()
+    import_timings[name] = end - start
+    trace.record('import ' + name, 'import', start, end)
+
+    if not isinstance(mod, IPython_magic_module):
+        raise TypeError(
+            "{!r} is not wrapped with {!r}".format(
+                mod, IPython_magic_module))
+
+    return mod
+
+
+def lazy_import_magic_modules(names, package=None, manifest=None):
+    """
+    Prepare lazy loading of :class:`moreshell.IPython_magic_module`.
+
+    Creates :class:`moreshell.lazy.lazy_magic_module` stand-ins for all
+    modules that aren't imported yet and whose ``%magic`` names can be found
+    with :func:`moreshell.lazy.scan_magic_module` or in the optional
+    :class:`moreshell.manifest.magic_manifest`. All other modules are
+    imported immediately
+
+    :param names:
+        The names of the magic modules to load
+    :param package:
+        The optional parent package name of the modules
+    :param manifest:
+        The optional :class:`moreshell.manifest.magic_manifest`, which gets
+        saved if new entries were generated
+    """
+    modules = []
+    for name in magic_module_names(names, package=package):
+        magics = helps = None
+        if not isinstance(sys.modules.get(name), IPython_magic_module):
+            if manifest is not None:
+                magics, helps = manifest.magics(name)
+            else:
+                magics = scan_magic_module(name)
+        # the module might have just been imported for generating its
+        # manifest entry
+        if magics is None or isinstance(
+                sys.modules.get(name), IPython_magic_module):
+            modules.extend(import_magic_modules([name]))
+        else:
+            modules.append(lazy_magic_module(name, magics, helps=helps))
 
-        modules.append(mod)
+    if manifest is not None and manifest.dirty:
+        manifest.save()
     return modules
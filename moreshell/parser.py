@@ -0,0 +1,156 @@
+"""Compiled fast-path argument matching for simple ``%magic`` signatures."""
+
+import argparse
+from argparse import Namespace
+
+import zetup
+
+__all__ = ('compiled_parser', )
+
+#: Marks option actions consuming the following argument as their value.
+STORE = object()
+
+
+class compiled_parser(zetup.object):
+    """
+    Specialized matcher for ``argparse.ArgumentParser`` argument lists.
+
+    Compiled by :meth:`.compile` from the actions of a parser that only uses
+    flags, ``store_true``/``store_false`` options, single-value options, and
+    plain positionals. It only handles argument lists that it can match
+    unambiguously and returns ``None`` for all others, like option
+    abbreviations, combined short flags, ``--help``, or invalid input, which
+    must then be handled by the full ``argparse`` machinery:
+
+    >>> from zetup import program, with_arguments
+
+    >>> parser = program(
+    ...     with_arguments
+    ...     ('value')
+    ...     ('-f', '--flag', action='store_true')
+    ...     ('-o', '--option', default='default')
+    ... )
+    >>> compiled = compiled_parser.compile(parser)
+
+    >>> compiled.parse(['value', '-f'])
+    Namespace(flag=True, option='default', value='value')
+
+    >>> compiled.parse(['value', '--opt', 'other']) is None
+    True
+    """
+
+    def __init__(self, options, positionals, defaults, required):
+        """
+        Initialize with the matching tables created by :meth:`.compile`.
+
+        :param options:
+            Mapping of option strings to ``(dest, const)`` pairs, with
+            :data:`STORE` as `const` for single-value options
+        :param positionals:
+            The ``dest`` names of the positional arguments in order
+        :param defaults:
+            Mapping of ``dest`` names to default values
+        :param required:
+            The ``dest`` names of required options
+        """
+        self.options = options
+        self.positionals = tuple(positionals)
+        self.defaults = defaults
+        self.required = frozenset(required)
+
+    @classmethod
+    def compile(cls, parser):
+        """
+        Compile the actions of an ``argparse.ArgumentParser``.
+
+        Returns ``None`` if any of the `parser` settings or argument
+        definitions is not supported
+        """
+        if parser.prefix_chars != '-' or parser.fromfile_prefix_chars or (
+                parser._has_negative_number_optionals):
+            return None
+
+        options = {}
+        positionals = []
+        defaults = {}
+        required = []
+        for action in parser._actions:
+            if isinstance(action, argparse._HelpAction):
+                # --help is always left to argparse
+                continue
+
+            if action.default is argparse.SUPPRESS or (
+                    action.type is not None or action.choices is not None):
+                return None
+
+            if not action.option_strings:
+                if type(action) is not argparse._StoreAction or (
+                        action.nargs is not None):
+                    return None
+
+                positionals.append(action.dest)
+                continue
+
+            if type(action) is argparse._StoreAction:
+                if action.nargs is not None:
+                    return None
+
+                const = STORE
+            elif type(action) in (
+                    argparse._StoreTrueAction, argparse._StoreFalseAction):
+                const = action.const
+            else:
+                return None
+
+            for option_string in action.option_strings:
+                if '=' in option_string:
+                    return None
+
+                options[option_string] = (action.dest, const)
+            # like argparse, the default of the first action for a dest wins
+            defaults.setdefault(action.dest, action.default)
+            if action.required:
+                required.append(action.dest)
+
+        return cls(options, positionals, defaults, required)
+
+    def parse(self, argv):
+        """
+        Match the argument list `argv`.
+
+        Returns an ``argparse.Namespace`` like ``parse_args`` would, or
+        ``None`` if `argv` must be handled by ``argparse`` instead
+        """
+        values = dict(self.defaults)
+        given = set()
+        positionals = self.positionals
+        count = 0
+
+        argv = iter(argv)
+        for arg in argv:
+            if arg[:1] == '-' and arg != '-':
+                option = self.options.get(arg)
+                if option is None:
+                    return None
+
+                dest, const = option
+                if const is STORE:
+                    arg = next(argv, None)
+                    if arg is None or arg[:1] == '-':
+                        return None
+
+                    const = arg
+                values[dest] = const
+                given.add(dest)
+
+            elif count < len(positionals):
+                values[positionals[count]] = arg
+                count += 1
+
+            else:
+                return None
+
+        if count < len(positionals) or not self.required <= given:
+            return None
+
+        return Namespace(**values)
@@ -0,0 +1,286 @@
+"""Persistent on-disk store of ``%magic`` results, shared across kernels."""
+
+import mmap
+import os
+import pickle
+from contextlib import contextmanager
+from hashlib import sha1
+from threading import Lock
+
+import zetup
+from six import binary_type, integer_types, text_type
+
+from .manifest import replace
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # no advisory file locks on Windows
+    fcntl = None
+
+__all__ = ('result_store', 'default_store')
+
+#: Leaf value types of result keys whose ``repr`` is stable across processes.
+STABLE_TYPES = (
+    (type(None), bool, float, complex, binary_type, text_type) +
+    integer_types)
+
+#: File name suffix of stored results.
+SUFFIX = '.pickle'
+
+
+def default_store_path():
+    """Get the default result store directory in the user's cache directory."""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'moreshell', 'results')
+
+
+def stable_repr(value):
+    """
+    Get a ``repr`` of result key `value`, which is equal in every process.
+
+    Unlike the ``hash`` of strings and the iteration order of sets, which
+    depend on the per-process hash seed. Raises ``TypeError`` for any other
+    values than tuples and frozensets of :data:`.STABLE_TYPES`, since their
+    ``repr`` may contain memory addresses
+    """
+    if isinstance(value, tuple):
+        return '({},)'.format(', '.join(stable_repr(item) for item in value))
+
+    if isinstance(value, frozenset):
+        return 'frozenset([{}])'.format(
+            ', '.join(sorted(stable_repr(item) for item in value)))
+
+    if not isinstance(value, STABLE_TYPES):
+        raise TypeError(
+            "{!r} has no stable repr for a result store key".format(value))
+
+    return repr(value)
+
+
+def code_fingerprint(code):
+    """
+    Get what identifies the behavior of the `code` object.
+
+    Unlike comparing code objects, line numbers are left out, so that
+    editing other parts of the module doesn't change it
+    """
+    return (
+        code.co_code, code.co_names, code.co_varnames, code.co_freevars,
+        tuple(
+            code_fingerprint(const) if hasattr(const, 'co_code') else const
+            for const in code.co_consts))
+
+
+def code_digest(code):
+    """
+    Get a short hex digest of :func:`.code_fingerprint`.
+
+    Which is equal in every process, so that stored results of edited
+    ``%magic`` code are not used anymore
+    """
+    fingerprint = code_fingerprint(code)
+    try:
+        text = stable_repr(fingerprint)
+
+    except TypeError:  # constants like Ellipsis
+        text = repr(fingerprint)
+    return sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class result_store(zetup.object):
+    """
+    Size-bounded directory of pickled ``%magic`` results.
+
+    Results are stored per magic name and
+    :func:`moreshell.cache.result_key`, in one file per result, named after
+    the SHA-1 digest of the key, which makes the store content-addressed by
+    the parsed arguments and the cell block hash. Files are written
+    atomically via renaming, and results of at least `mmap_threshold` bytes
+    are unpickled from memory-mapped files instead of full reads
+
+    When the total size exceeds `max_bytes`, the least recently used files
+    are evicted. Writes and evictions hold an exclusive ``flock`` on the
+    store's lock file, so that several kernels on one host can share a
+    store directory
+    """
+
+    def __init__(self, path=None, max_bytes=2 ** 30, mmap_threshold=2 ** 20):
+        """
+        Use the directory `path`, which is created if missing.
+
+        And defaults to ``moreshell/results`` in the user's cache directory
+        """
+        if max_bytes < 1:
+            raise ValueError(
+                "max_bytes of {!r} must be positive, not: {!r}"
+                .format(type(self), max_bytes))
+
+        self.path = path or default_store_path()
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def __repr__(self):
+        return "<{} {!r} at {}>".format(
+            type(self).__name__, self.path, hex(id(self)).rstrip('L'))
+
+    def filename(self, prefix, key):
+        """
+        Get the file path of the result of magic `prefix` for `key`.
+
+        Or ``None`` if `key` contains values without a :func:`.stable_repr`
+        """
+        try:
+            text = stable_repr(key)
+
+        except TypeError:
+            return None
+
+        return os.path.join(self.path, '{}-{}{}'.format(
+            prefix, sha1(text.encode('utf-8')).hexdigest(), SUFFIX))
+
+    @contextmanager
+    def locked(self):
+        """Hold the exclusive ``flock`` of the store directory."""
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.path, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, prefix, key, default=None):
+        """
+        Get the result of magic `prefix` stored for `key`, or `default`.
+
+        Marks a found result as most recently used. Unreadable files are
+        removed and count as missing
+        """
+        filename = self.filename(prefix, key)
+        if filename is None:
+            return default
+
+        try:
+            with open(filename, 'rb') as stored:
+                size = os.fstat(stored.fileno()).st_size
+                if size >= self.mmap_threshold:
+                    mapped = mmap.mmap(
+                        stored.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        value = pickle.load(mapped)
+
+                    finally:
+                        mapped.close()
+                else:
+                    value = pickle.load(stored)
+
+        except (IOError, OSError):
+            return default
+
+        except Exception:  # unpickling raises all kinds of exceptions
+            self.discard(filename)
+            return default
+
+        try:
+            os.utime(filename, None)
+
+        except OSError:  # pragma: no cover
+            pass  # evicted meanwhile by another kernel
+        return value
+
+    def set(self, prefix, key, value):
+        """
+        Store `value` as result of magic `prefix` for `key`.
+
+        And evict least recently used results exceeding :attr:`.max_bytes`.
+        Returns ``False`` if `key` or `value` can't be stored
+        """
+        filename = self.filename(prefix, key)
+        if filename is None:
+            return False
+
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        except Exception:  # pickle raises all kinds of exceptions
+            return False
+
+        temp_path = '{}.{}.{}.tmp'.format(filename, os.getpid(), id(data))
+        with open(temp_path, 'wb') as stored:
+            stored.write(data)
+        with self.locked():
+            replace(temp_path, filename)
+            self.evict()
+        return True
+
+    def entries(self):
+        """Get ``(mtime, size, filename)`` of stored results, oldest first."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(SUFFIX):
+                continue
+
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+
+            except OSError:  # pragma: no cover
+                continue  # evicted meanwhile by another kernel
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        return sorted(entries)
+
+    def size(self):
+        """Get the total bytes of all stored results."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used results exceeding :attr:`.max_bytes`."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total <= self.max_bytes:
+                break
+
+            self.discard(filename)
+            total -= size
+
+    def discard(self, filename):
+        """Remove the stored result `filename`, if still existing."""
+        try:
+            os.remove(filename)
+
+        except OSError:
+            pass
+
+    def clear(self, prefix=None):
+        """Remove all stored results, or only those of magic `prefix`."""
+        start = prefix and prefix + '-'
+        with self.locked():
+            for _, _, filename in self.entries():
+                if start is None or os.path.basename(filename).startswith(
+                        start):
+                    self.discard(filename)
+
+
+#: The store used for ``persist=True``, created by :func:`.default_store`.
+_default_store = None
+
+_default_store_lock = Lock()
+
+
+def default_store():
+    """Get the shared :class:`.result_store` in the default directory."""
+    global _default_store
+
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = result_store()
+        return _default_store
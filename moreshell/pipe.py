@@ -0,0 +1,263 @@
+"""Compose ``%magic`` into pipelines of concurrently running stages."""
+
+import sys
+from argparse import REMAINDER
+from threading import Event, Thread
+from types import GeneratorType
+
+import zetup
+from six import binary_type, reraise, text_type
+from six.moves.queue import Empty, Full, Queue
+
+from moreshell import IPython_magic_module, IPython_cell_magic, with_arguments
+
+IPython_magic_module(__name__, [
+    'pipeline',
+    'pipeline_stage',
+    'moreshell_pipe',
+])
+
+#: Marks the end of a stage's output in the queue to the next stage.
+END = object()
+
+#: Seconds between checks for cancelled pipelines while waiting on queues.
+POLL_INTERVAL = 0.05
+
+
+class failure(zetup.object):
+    """Carries the exception of a stage to the next stage."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def iterate(result):
+    """
+    Get the items that the `result` of a stage passes to the next stage.
+
+    Strings, ``bytes``, and ``dict`` are single items, and ``None`` is none
+    """
+    if result is None:
+        return ()
+
+    if isinstance(result, (text_type, binary_type, dict)):
+        return (result, )
+
+    try:
+        return iter(result)
+
+    except TypeError:
+        return (result, )
+
+
+def put(queue, item, cancelled):
+    """Put `item` into `queue` unless the pipeline gets `cancelled`."""
+    while not cancelled.is_set():
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return True
+
+        except Full:
+            continue
+
+    return False
+
+
+def consume(queue, cancelled):
+    """
+    Iterate the items put into `queue` by the previous stage.
+
+    Re-raises any exception of the previous stage, and stops if the
+    pipeline gets `cancelled`
+    """
+    while not cancelled.is_set():
+        try:
+            item = queue.get(timeout=POLL_INTERVAL)
+
+        except Empty:
+            continue
+
+        if item is END:
+            return
+
+        if isinstance(item, failure):
+            cancelled.set()
+            reraise(*item.exc_info)
+
+        yield item
+
+
+def produce(stage, block, queue, cancelled):
+    """Run `stage` with input `block` and put its items into `queue`."""
+    try:
+        for item in iterate(stage(*block)):
+            if not put(queue, item, cancelled):
+                return
+
+    except Exception:
+        put(queue, failure(sys.exc_info()), cancelled)
+        return
+
+    put(queue, END, cancelled)
+
+
+def finish(results, cancelled):
+    """Iterate the `results` of the last stage and then stop the others."""
+    try:
+        for item in results:
+            yield item
+
+    finally:
+        cancelled.set()
+
+
+class pipeline_stage(zetup.object):
+    """
+    A ``%magic`` call with its argument line as part of a pipeline.
+
+    Created with :meth:`moreshell.magic.magic_function.stage` and combined
+    into a :class:`moreshell.pipe.pipeline` with ``|``
+    """
+
+    def __init__(self, magic, line=''):
+        """Call `magic` with argument `line`."""
+        self.magic = magic
+        self.line = line
+
+    def __repr__(self):
+        return "<{} {!r} {!r}>".format(
+            type(self).__name__, self.magic, self.line)
+
+    def __or__(self, other):
+        return pipeline([self]) | other
+
+    def __call__(self, *block):
+        """
+        Call the ``%magic`` with the optional input `block`.
+
+        Line ``%magic`` use their accompanying cell ``%%magic`` for input
+        """
+        magic = self.magic
+        if block and getattr(magic, 'kind_of_magic', None) == 'line':
+            try:
+                magic = magic.cell
+
+            except AttributeError:
+                raise TypeError(
+                    "{!r} has no cell magic for consuming pipeline input"
+                    .format(magic))
+
+        return magic(self.line, *block)
+
+
+class pipeline(zetup.object):
+    """
+    Chain of ``%magic`` stages, each consuming the output of the previous.
+
+    Every stage but the last runs in its own thread. The items of its
+    result are passed to the next stage as cell block iterator, through a
+    queue of at most `queue_size` items, so that all stages run
+    concurrently with bounded memory::
+
+        result = (
+            source.stage('table') | clean.stage('--strict') | sink.stage()
+        )()
+
+    Results of stages are iterated, except for strings, ``bytes``, and
+    ``dict``, which are single items, and ``None``, which is none. Stages
+    can return generators for streaming their output
+    """
+
+    def __init__(self, stages, queue_size=64):
+        """Chain the :class:`moreshell.pipe.pipeline_stage` `stages`."""
+        self.stages = list(stages)
+        self.queue_size = queue_size
+
+    def __repr__(self):
+        return "<{} {}>".format(
+            type(self).__name__,
+            ' | '.join(repr(stage) for stage in self.stages))
+
+    def __or__(self, other):
+        stages = other.stages if isinstance(other, pipeline) else [other]
+        return pipeline(self.stages + stages, queue_size=self.queue_size)
+
+    def __call__(self, *block):
+        """
+        Run all stages and get the result of the last one.
+
+        The optional `block` is the input of the first stage. Exceptions of
+        any stage are re-raised. If the last stage returns a generator, the
+        other stages are stopped when it is exhausted or closed
+        """
+        cancelled = Event()
+        for index, stage in enumerate(self.stages[:-1]):
+            queue = Queue(self.queue_size)
+            thread = Thread(
+                target=produce, args=(stage, block, queue, cancelled),
+                name='moreshell-pipe-{}'.format(index))
+            thread.daemon = True
+            thread.start()
+            block = (consume(queue, cancelled), )
+        try:
+            result = self.stages[-1](*block)
+
+        except BaseException:
+            cancelled.set()
+            raise
+
+        if isinstance(result, GeneratorType):
+            return finish(result, cancelled)
+
+        cancelled.set()
+        return result
+
+
+def parse_pipeline(shell, text, has_input=False):
+    """
+    Get the :class:`moreshell.pipe.pipeline_stage` list of pipeline `text`.
+
+    Looks up the ``%magic`` of the ``|``-separated stages in the `shell`.
+    The first stage is a line ``%magic``, unless it `has_input`, and all
+    others are cell ``%%magic``
+    """
+    stages = []
+    for index, part in enumerate(text.split('|')):
+        words = part.split(None, 1)
+        if not words:
+            raise ValueError("Empty stage in pipeline: {!r}".format(text))
+
+        name = words[0].lstrip('%')
+        kind = 'cell' if index or has_input else 'line'
+        try:
+            magic = shell.magics_manager.magics[kind][name]
+
+        except KeyError:
+            raise ValueError("No {} magic {}{} for pipeline: {!r}".format(
+                kind, '%%' if kind == 'cell' else '%', name, text))
+
+        stages.append(pipeline_stage(magic, ''.join(words[1:])))
+    return stages
+
+
+@IPython_cell_magic(
+    with_arguments
+    ('-q', '--queue-size', type=int, default=64,
+     help="Maximum number of items waiting between two stages")
+    ('pipeline', nargs=REMAINDER, metavar='%magic ARGS | %magic ARGS',
+     help="The stages, of which all but the first must be cell magic"),
+    stats=False)
+def moreshell_pipe(shell, args, block):
+    """
+    Run a pipeline of ``%magic``.
+
+    With the cell block, if not empty, as input of the first stage.
+    Generator results of the last stage are collected in a list
+    """
+    block = (block, ) if block.strip() else ()
+    result = pipeline(
+        parse_pipeline(shell, ' '.join(args.pipeline), has_input=bool(block)),
+        queue_size=args.queue_size)(*block)
+    if isinstance(result, GeneratorType):
+        result = list(result)
+    return result
@@ -0,0 +1,131 @@
+"""Run CPU-bound ``%magic`` in a pool of warm worker processes."""
+
+import pickle
+import sys
+from importlib import import_module
+from threading import Lock
+
+import zetup
+from six import reraise
+
+__all__ = ('process_pool', 'pool')
+
+
+class process_pool(zetup.object):
+    """
+    Pool of worker processes for ``%magic`` created with ``executor=``.
+
+    The ``concurrent.futures.ProcessPoolExecutor`` is created on first use
+    and its worker processes are kept running across calls, so that they
+    stay warm with all their imports
+
+    The ``%magic`` are identified in the workers by module and name, so
+    they must be defined at the top level of importable modules. Only the
+    parsed arguments and the cell block are sent to the workers, which call
+    the decorated functions with ``None`` as IPython shell
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Prepare a pool of `max_workers`, which is created on demand.
+
+        The default number of workers is the number of CPUs
+        """
+        self.max_workers = max_workers
+        self.executor = None
+        self._lock = Lock()
+
+    def resize(self, max_workers):
+        """Change the number of workers, which restarts the pool."""
+        self.shutdown()
+        self.max_workers = max_workers
+
+    def submit(self, magic, args, *block, **kwargs):
+        """
+        Run `magic` with parsed `args` and cell `block` in a worker.
+
+        Returns a ``concurrent.futures.Future``, whose errors include those
+        of pickling `args` and `block` for sending them to the worker
+
+        The optional `budget=` keyword argument is a
+        :class:`moreshell.budget.budget` enforced in the worker
+        """
+        with self._lock:
+            if self.executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers)
+            return self.executor.submit(
+                run_in_worker, magic.__module__, magic.__name__,
+                magic.kind_of_magic, args, *block,
+                budget=kwargs.get('budget'))
+
+    def run(self, magic, args, *block, **kwargs):
+        """
+        Run `magic` like :meth:`.submit` and wait for the result.
+
+        Raises ``TypeError`` naming the first argument that can't be
+        pickled, if the run fails for that reason. The arguments are only
+        checked after a failure, to not pickle them twice on every call
+        """
+        try:
+            return self.submit(magic, args, *block, **kwargs).result()
+
+        except Exception:
+            exc_info = sys.exc_info()
+            check_picklable(magic, args, *block)
+            reraise(*exc_info)
+
+    def shutdown(self, wait=True):
+        """Shut down the worker processes, which are restarted on demand."""
+        with self._lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def check_picklable(magic, args, *block):
+    """
+    Check that parsed `args` and cell `block` of `magic` can be pickled.
+
+    Raises ``TypeError`` naming the first argument that can't be pickled
+    """
+    try:
+        pickle.dumps((args, block), pickle.HIGHEST_PROTOCOL)
+        return
+
+    except Exception:  # pickle raises all kinds of exceptions
+        pass
+
+    items = list(vars(args).items()) + [('block', value) for value in block]
+    for name, value in items:
+        try:
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        except Exception as exc:
+            raise TypeError(
+                "Can't send argument {!r} of {!r} to worker process: {!r} "
+                "can't be pickled ({})".format(name, magic, value, exc))
+
+
+def run_in_worker(modname, name, kind_of_magic, args, *block, **kwargs):
+    """
+    Run a ``%magic`` inside a worker process.
+
+    Finds the ``%magic`` by module and function `name` and runs it with
+    parsed `args` and cell `block`, limited by the optional `budget=`
+    keyword argument
+    """
+    magic = getattr(import_module(modname), name)
+    if magic.kind_of_magic != kind_of_magic:
+        magic = magic.cell
+    budget = kwargs.get('budget')
+    if budget is not None:
+        return budget.run_in_worker(magic, args, *block)
+
+    return magic.run(args, *block)
+
+
+#: The shared :class:`moreshell.process.process_pool` of all ``%magic``.
+pool = process_pool()
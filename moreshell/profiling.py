@@ -0,0 +1,117 @@
+"""Profile single ``%magic`` calls with ``cProfile`` and ``tracemalloc``."""
+
+from __future__ import print_function
+
+import sys
+
+__all__ = ('run_profiled', )
+
+#: The ``dest`` names of the options added by the ``profile_flags=`` option.
+PROFILE_OPTIONS = ('profile', 'profile_file', 'memprofile', 'memprofile_file')
+
+#: The number of functions in printed ``--profile`` reports.
+PROFILE_LIMIT = 25
+
+#: The number of source lines in printed ``--memprofile`` reports.
+MEMPROFILE_LIMIT = 10
+
+
+def inject_profile_options(magic_deco):
+    """Add the ``--profile`` and ``--memprofile`` options to `magic_deco`."""
+    magic_deco.inject_option(
+        '--profile', action='store_true',
+        help="Run under cProfile and print the top functions")
+    magic_deco.inject_option(
+        '--profile-file', metavar='PATH',
+        help="Run under cProfile and dump the stats to PATH, like .prof")
+    magic_deco.inject_option(
+        '--memprofile', action='store_true',
+        help="Run under tracemalloc and print the top allocating lines")
+    magic_deco.inject_option(
+        '--memprofile-file', metavar='PATH',
+        help="Run under tracemalloc and dump the snapshot to PATH")
+
+
+def profiling_requested(options):
+    """Check if popped injected `options` request any profiling."""
+    return any(options.get(dest) for dest in PROFILE_OPTIONS)
+
+
+def run_profiled(magic, args, block, options):
+    """
+    Run `magic` with parsed `args` and cell `block` as requested.
+
+    Under ``cProfile`` and/or ``tracemalloc``, according to the popped
+    injected `options`. Profiling covers only the decorated function and
+    always happens in the current thread
+
+    Reports are printed after the call, also if it fails, while snapshots
+    are dumped to the given files
+    """
+    def run():
+        return magic.run(args, *block)
+
+    if options.get('profile') or options.get('profile_file'):
+        run = profiled(run, options.get('profile_file'))
+    if options.get('memprofile') or options.get('memprofile_file'):
+        run = memprofiled(run, options.get('memprofile_file'))
+    return run()
+
+
+def profiled(func, filename=None, limit=PROFILE_LIMIT):
+    """
+    Wrap `func` for being called under ``cProfile``.
+
+    Dumps the stats to `filename`, if given. Otherwise prints the `limit`
+    top functions sorted by cumulative time
+    """
+    def call():
+        from cProfile import Profile
+
+        profiler = Profile()
+        try:
+            return profiler.runcall(func)
+
+        finally:
+            if filename:
+                profiler.dump_stats(filename)
+            else:
+                from pstats import Stats
+
+                stats = Stats(profiler, stream=sys.stdout)
+                stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+
+    return call
+
+
+def memprofiled(func, filename=None, limit=MEMPROFILE_LIMIT):
+    """
+    Wrap `func` for being called under ``tracemalloc``.
+
+    Dumps the snapshot taken after the call to `filename`, if given.
+    Otherwise prints the `limit` source lines which allocated the most new
+    memory during the call. Requires Python 3.4+
+    """
+    def call():
+        import tracemalloc
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        ignored = (tracemalloc.Filter(False, tracemalloc.__file__), )
+        before = tracemalloc.take_snapshot().filter_traces(ignored)
+        try:
+            return func()
+
+        finally:
+            snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+            if started:
+                tracemalloc.stop()
+            if filename:
+                snapshot.dump(filename)
+            else:
+                print("Top {} lines allocating memory:".format(limit))
+                for diff in snapshot.compare_to(before, 'lineno')[:limit]:
+                    print(diff)
+
+    return call
@@ -0,0 +1,224 @@
+"""Per-``%magic`` call statistics and latency percentiles."""
+
+from __future__ import division, print_function
+
+from math import log
+from weakref import WeakSet
+
+import zetup
+
+from moreshell import IPython_magic_module, IPython_magic, with_arguments
+
+IPython_magic_module(__name__, [
+    'latency_histogram',
+    'magic_stats',
+    'collect',
+    'reset',
+    'moreshell_stats',
+])
+
+
+class latency_histogram(zetup.object):
+    """
+    Streaming histogram of latencies with logarithmic buckets.
+
+    Takes constant memory per order of magnitude of the recorded values and
+    estimates percentiles with a relative error of at most `growth` - 1
+    """
+
+    def __init__(self, growth=1.05, resolution=1e-6):
+        """
+        Create an empty histogram.
+
+        Bucket boundaries grow by factor `growth`, starting at `resolution`
+        seconds, below which all values share the first bucket
+        """
+        self.growth = growth
+        self.resolution = resolution
+        self._log_growth = log(growth)
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, value):
+        """Record a latency `value` in seconds."""
+        index = 0
+        if value > self.resolution:
+            index = int(log(value / self.resolution) / self._log_growth) + 1
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + 1
+        self.count += 1
+
+    def percentile(self, percent):
+        """
+        Estimate the latency below which `percent` of the values are.
+
+        Returns the upper bound of the bucket containing that value, or
+        ``None`` for an empty histogram
+        """
+        if not self.count:
+            return None
+
+        rank = percent / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        return self.resolution * self.growth ** index
+
+    def clear(self):
+        """Forget all recorded values."""
+        self.buckets = {}
+        self.count = 0
+
+
+#: All :class:`moreshell.stats.magic_stats` of existing ``%magic``.
+registry = WeakSet()
+
+
+class magic_stats(zetup.object):
+    """
+    Call statistics of a single ``%magic``.
+
+    Created for every ``%magic`` as its ``.stats`` attribute, unless
+    disabled with the ``stats=`` option of :class:`moreshell.IPython_magic`.
+    Counters are plain attributes updated without locking, to keep the
+    overhead per call in the range of a few microseconds
+    """
+
+    def __init__(self, name):
+        """Initialize empty statistics for the ``%magic`` `name`."""
+        self.name = name
+        self.histogram = latency_histogram()
+        self.reset()
+        registry.add(self)
+
+    def __repr__(self):
+        return "<{} of {} at {}>".format(
+            type(self).__name__, self.name, hex(id(self)).rstrip('L'))
+
+    def reset(self):
+        """Set all counters back to zero."""
+        self.calls = 0
+        self.errors = 0
+        self.parse_time = 0.0
+        self.exec_time = 0.0
+        self.histogram.clear()
+
+    def record(self, start, parsed, end):
+        """
+        Record a call, which started parsing its arguments at `start`.
+
+        Execution started at `parsed`, which is ``None`` if parsing failed,
+        and everything finished at `end`
+        """
+        self.calls += 1
+        if parsed is None:
+            self.parse_time += end - start
+        else:
+            self.parse_time += parsed - start
+            self.exec_time += end - parsed
+        self.histogram.add(end - start)
+
+    @property
+    def total_time(self):
+        """Get the summed up parse and execution seconds of all calls."""
+        return self.parse_time + self.exec_time
+
+    @property
+    def mean_time(self):
+        """Get the mean seconds per call, or ``None`` if never called."""
+        return self.total_time / self.calls if self.calls else None
+
+    def percentile(self, percent):
+        """Estimate a latency percentile in seconds. See histogram."""
+        return self.histogram.percentile(percent)
+
+    def as_dict(self):
+        """Get all statistics as ``dict``, with latencies in seconds."""
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'parse_time': self.parse_time,
+            'exec_time': self.exec_time,
+            'total_time': self.total_time,
+            'mean_time': self.mean_time,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+def collect(names=None):
+    """
+    Get the :class:`moreshell.stats.magic_stats` of all called ``%magic``.
+
+    Optionally only those with the given ``%magic`` `names`, including
+    their leading ``%`` or ``%%``. Sorted by name
+    """
+    return sorted(
+        (stats for stats in list(registry)
+         if stats.calls and (not names or stats.name in names)),
+        key=lambda stats: stats.name)
+
+
+def reset(names=None):
+    """Reset the statistics of all or the given ``%magic`` `names`."""
+    for stats in list(registry):
+        if not names or stats.name in names:
+            stats.reset()
+
+
+#: The sort keys of ``%moreshell_stats --sort``, all descending but name.
+SORT_KEYS = {
+    'name': lambda stats: stats.name,
+    'calls': lambda stats: -stats.calls,
+    'errors': lambda stats: -stats.errors,
+    'total': lambda stats: -stats.total_time,
+    'mean': lambda stats: -stats.mean_time,
+    'parse': lambda stats: -stats.parse_time,
+    'exec': lambda stats: -stats.exec_time,
+    'p95': lambda stats: -stats.percentile(95),
+    'p99': lambda stats: -stats.percentile(99),
+}
+
+
+def milliseconds(seconds):
+    """Format `seconds` as milliseconds for the stats table."""
+    return '{:.3f}'.format(seconds * 1000)
+
+
+@IPython_magic(
+    with_arguments
+    ('names', nargs='*', metavar='MAGIC',
+     help="Names of %magic or %%magic, defaulting to all called ones")
+    ('-s', '--sort', choices=sorted(SORT_KEYS), default='total',
+     help="Sort by this column, defaulting to total time")
+    ('--reset', action='store_true', help="Reset the statistics")
+    ('-r', '--result', action='store_true',
+     help="Return the statistics as list of dicts instead of printing"),
+    stats=False)
+def moreshell_stats(shell, args):
+    """
+    Show the call counts and latencies of all ``%magic``.
+
+    Doesn't record its own statistics
+    """
+    if args.reset:
+        reset(args.names)
+        return
+
+    selected = sorted(collect(args.names), key=SORT_KEYS[args.sort])
+    if args.result:
+        return [stats.as_dict() for stats in selected]
+
+    print("{:<32} {:>8} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        'magic', 'calls', 'errors', 'parse ms', 'exec ms', 'p50 ms',
+        'p95 ms', 'p99 ms'))
+    for stats in selected:
+        print("{:<32} {:>8} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+            stats.name, stats.calls, stats.errors,
+            milliseconds(stats.parse_time / stats.calls),
+            milliseconds(stats.exec_time / stats.calls),
+            *(milliseconds(stats.percentile(p)) for p in (50, 95, 99))))
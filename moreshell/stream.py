@@ -0,0 +1,209 @@
+"""Lazy delivery of large cell ``%%magic`` blocks."""
+
+import mmap
+import os
+
+import zetup
+from six import binary_type, text_type
+
+try:
+    from collections.abc import Iterator
+except ImportError:  # pragma: no cover
+    # PY2
+    from collections import Iterator
+
+__all__ = ('block_reader', 'file_block', 'iter_lines', 'open_block')
+
+#: The values of the ``stream=`` option of :class:`moreshell.IPython_magic`.
+STREAM_MODES = ('lines', 'reader')
+
+
+def iter_lines(text):
+    """
+    Iterate the lines of `text` lazily, including their line endings.
+
+    Like iterating a file, but without copying `text` into a buffer first
+
+    >>> list(iter_lines('first\\nsecond'))
+    ['first\\n', 'second']
+    """
+    start = 0
+    end = len(text)
+    while start < end:
+        stop = text.find('\n', start) + 1 or end
+        yield text[start:stop]
+        start = stop
+
+
+class block_reader(zetup.object):
+    """
+    Read-only binary file-like view of a cell block, backed by a memoryview.
+
+    Reading never copies the underlying `buffer`, which is the UTF-8 encoded
+    cell block or a memory-mapped file, but returns memoryview slices of it:
+
+    >>> reader = block_reader(b'first\\nsecond')
+    >>> reader.readline().tobytes()
+    b'first\\n'
+    >>> reader.read().tobytes()
+    b'second'
+
+    Text lines are decoded one at a time with :meth:`.lines`
+    """
+
+    def __init__(self, buffer, encoding='utf-8'):
+        """Wrap `buffer` containing text of the given `encoding`."""
+        self._source = buffer
+        self.buffer = memoryview(buffer)
+        self.encoding = encoding
+        self.position = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tell(self):
+        """Get the current read position."""
+        return self.position
+
+    def seek(self, position):
+        """Move the read position to the absolute byte `position`."""
+        self.position = max(0, min(position, len(self)))
+        return self.position
+
+    def read(self, size=-1):
+        """Get up to `size` or all remaining bytes as memoryview."""
+        start = self.position
+        stop = len(self) if size < 0 else min(start + size, len(self))
+        self.position = stop
+        return self.buffer[start:stop]
+
+    def readline(self):
+        """Get the next line including its ending as memoryview."""
+        start = self.position
+        stop = self._source.find(b'\n', start) + 1 or len(self)
+        self.position = stop
+        return self.buffer[start:stop]
+
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+    def lines(self):
+        """Iterate the remaining lines, decoded one at a time."""
+        for line in self:
+            yield line.tobytes().decode(self.encoding)
+
+    def close(self):
+        """Release the memoryview and close a memory-mapped buffer."""
+        release = getattr(self.buffer, 'release', None)
+        if release is not None:  # pragma: no branch
+            # no memoryview.release on PY2
+            release()
+        close = getattr(self._source, 'close', None)
+        if close is not None:
+            close()
+
+    def release(self):
+        """
+        Close, unless memoryview slices of the buffer are still in use.
+
+        Then closing is left to garbage collection
+        """
+        try:
+            self.close()
+
+        except BufferError:  # cannot close exported pointers exist
+            pass
+
+    def close_after(self, result):
+        """
+        Close this reader once the `result` of a ``%%magic`` call is done.
+
+        Iterator results, like generators over the block, are wrapped for
+        closing it when exhausted. Any other `result` may still refer to
+        the buffer, so the reader is only :meth:`.release`-d
+        """
+        if isinstance(result, Iterator):
+            return self.closing(result)
+
+        self.release()
+        return result
+
+    def closing(self, iterator):
+        """Iterate `iterator` and :meth:`.release` this reader afterwards."""
+        try:
+            for item in iterator:
+                yield item
+        finally:
+            self.release()
+
+
+class file_block(zetup.object):
+    """
+    Placeholder for a cell block read from a file.
+
+    Created for the ``--from-file PATH`` option of streaming cell ``%%magic``
+    and only memory-mapped with :meth:`.map` right before running the
+    decorated function, so that it can be sent to worker processes
+    """
+
+    def __init__(self, path):
+        """Refer to the file at `path`."""
+        self.path = path
+
+    def __repr__(self):
+        return "<{} {!r}>".format(type(self).__name__, self.path)
+
+    def map(self):
+        """
+        Memory-map the file read-only.
+
+        Returns an empty ``bytes`` for empty files, which can't be mapped
+        """
+        with open(self.path, 'rb') as source:
+            if not os.fstat(source.fileno()).st_size:
+                return b''
+
+            return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open(self):
+        """
+        Get a :class:`moreshell.stream.block_reader` of the mapped file.
+
+        Closing the reader also closes the memory map
+        """
+        return block_reader(self.map())
+
+
+def open_block(block, stream):
+    """
+    Turn the cell `block` into what a ``stream=`` ``%%magic`` gets.
+
+    A lazy iterator of text lines for ``'lines'``, or a
+    :class:`moreshell.stream.block_reader` for ``'reader'``. The `block` is
+    either the cell text, a :class:`moreshell.stream.file_block`, or an
+    already opened :class:`moreshell.stream.block_reader`. Any other `block`
+    is returned unchanged
+    """
+    if isinstance(block, file_block):
+        block = block.open()
+    if isinstance(block, block_reader):
+        return block.lines() if stream == 'lines' else block
+
+    if not isinstance(block, (text_type, binary_type)):
+        return block  # like an iterator of items from a pipeline stage
+
+    if stream == 'lines':
+        return iter_lines(block)
+
+    if isinstance(block, text_type):
+        block = block.encode('utf-8')
+    return block_reader(block)
@@ -0,0 +1,31 @@
+"""Harmless ``%magic`` for testing, which just echo their input."""
+
+from moreshell import (
+    IPython_magic_module, IPython_magic, IPython_cell_magic, with_arguments)
+
+IPython_magic_module(__name__, [
+    'test_moreshell_echo',
+    'test_moreshell_cell_echo',
+])
+
+
+@IPython_magic(
+    with_arguments
+    ('value')
+    ('-u', '--upper', action='store_true')
+)
+def test_moreshell_echo(shell, args):
+    """Return the given value."""
+    return args.value.upper() if args.upper else args.value
+
+
+@test_moreshell_echo.cell_magic
+def test_moreshell_echo(shell, args, block):
+    """Return the given value and cell block."""
+    return args.value, block
+
+
+@IPython_cell_magic(with_arguments('-u', '--upper', action='store_true'))
+def test_moreshell_cell_echo(shell, args, block):
+    """Return the given cell block."""
+    return block.upper() if args.upper else block
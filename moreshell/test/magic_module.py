@@ -1,33 +1,148 @@
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
 import sys
+import tempfile
+from threading import Lock, Thread
+from timeit import default_timer
 
 from path import Path
-from zetup import call
 
 import moreshell
 from moreshell import IPython_magic_module, IPython_magic, with_arguments
+from moreshell.forkserver import forkserver
+
+from .sharding import FAILED_ENV, SELECT_ENV, SHARD_ENV
 
 IPython_magic_module(__name__, [
     'test_moreshell',
 ])
 
 
+#: Forks the pytest processes of ``%test_moreshell --fork``. Only preloads
+#  third-party modules, so that coverage of :mod:`moreshell` is complete.
+pytest_forkserver = forkserver(preload=['pytest', 'IPython'])
+
+
+def last_failed_path():  # pragma: no cover
+    """Get the file of failed test node IDs in the user's cache directory."""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'moreshell', 'test_moreshell_failed.json')
+
+
+def stream_output(process, prefix, lock):  # pragma: no cover
+    """Print the output lines of a pytest worker `process` as they come."""
+    for line in iter(process.stdout.readline, ''):
+        with lock:
+            sys.stdout.write(prefix + line)
+            sys.stdout.flush()
+    process.stdout.close()
+
+
 @IPython_magic(
     with_arguments
     ('-c', '--coverage', action='store_true')
     ('-v', '--verbose', action='store_true')
+    ('-n', '--workers', type=int, default=1,
+     help="Shard the tests across this number of pytest processes")
+    ('--lf', '--last-failed', dest='last_failed', action='store_true',
+     help="Only rerun the tests that failed last time, if any")
+    ('-f', '--fork', action='store_true',
+     help="Fork the pytest processes from a warm server with pytest and "
+     "IPython already imported")
 )
 def test_moreshell(shell, args):  # pragma: no cover
-    """Run the :mod:`moreshell` unit tests with ``pytest``."""
+    """
+    Run the :mod:`moreshell` unit tests with ``pytest``.
+
+    Optionally sharded across several worker processes, whose output lines
+    are printed live, prefixed with their shard, and whose coverage data is
+    combined into one report. With ``--fork``, the processes are forked
+    from the warm :data:`.pytest_forkserver` instead of being started fresh
+    """
     moreshell_dir = Path(  # pylint: disable=no-value-for-parameter
         moreshell.__file__
     ).dirname().realpath()
 
-    call_args = [
-        sys.executable, '-m', 'pytest', '--doctest-modules', moreshell_dir]
-    if args.coverage:
-        call_args.extend([
-            '--cov', moreshell_dir, '--cov-report', 'term-missing'])
-    if args.verbose:
-        call_args.append('-vv')
+    workers = max(1, args.workers)
+    temp_dir = tempfile.mkdtemp(prefix='moreshell-test-')
+    start = default_timer()
+    try:
+        # like zetup.call, for finding what the kernel found via sys.path
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        if args.last_failed and os.path.exists(last_failed_path()):
+            env[SELECT_ENV] = last_failed_path()
+
+        processes = []
+        for shard in range(workers):
+            call_args = [
+                sys.executable, '-m', 'pytest', '--doctest-modules',
+                moreshell_dir]
+            shard_env = dict(env, **{
+                FAILED_ENV: os.path.join(temp_dir, 'failed.{}'.format(shard)),
+            })
+            if workers > 1:
+                shard_env[SHARD_ENV] = '{}/{}'.format(shard, workers)
+            if args.coverage:
+                call_args.extend(['--cov', moreshell_dir])
+                if workers > 1:
+                    call_args.append('--cov-report=')
+                    shard_env['COVERAGE_FILE'] = os.path.join(
+                        temp_dir, '.coverage.{}'.format(shard))
+                else:
+                    call_args.extend(['--cov-report', 'term-missing'])
+            if args.verbose:
+                call_args.append('-vv')
+            if args.fork:
+                processes.append(pytest_forkserver.spawn_module(
+                    'pytest', [str(arg) for arg in call_args[3:]],
+                    env=shard_env))
+                continue
+
+            processes.append(subprocess.Popen(
+                call_args, env=shard_env, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True))
+
+        lock = Lock()
+        threads = []
+        for shard, process in enumerate(processes):
+            prefix = '[{}/{}] '.format(shard, workers) if workers > 1 else ''
+            thread = Thread(
+                target=stream_output, args=(process, prefix, lock))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        codes = [process.wait() for process in processes]
+
+        failed = []
+        for shard in range(workers):
+            path = os.path.join(temp_dir, 'failed.{}'.format(shard))
+            if os.path.exists(path):
+                with open(path) as failed_file:
+                    failed.extend(failed_file.read().splitlines())
+        if not os.path.isdir(os.path.dirname(last_failed_path())):
+            os.makedirs(os.path.dirname(last_failed_path()))
+        with open(last_failed_path(), 'w') as failed_file:
+            json.dump(sorted(set(failed)), failed_file)
+
+        if args.coverage and workers > 1:
+            from coverage import Coverage
+
+            coverage = Coverage(data_file=os.path.join(temp_dir, '.coverage'))
+            coverage.combine([
+                os.path.join(temp_dir, '.coverage.{}'.format(shard))
+                for shard in range(workers)])
+            coverage.save()
+            coverage.report(show_missing=True)
 
-    call(call_args)
+        if workers > 1:
+            print("{} shards finished in {:.2f}s with exit codes {}".format(
+                workers, default_timer() - start, codes))
+    finally:
+        shutil.rmtree(temp_dir)
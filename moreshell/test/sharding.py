@@ -0,0 +1,78 @@
+"""
+Pytest hooks for the sharded and last-failed runs of ``%test_moreshell``.
+
+Imported into the ``conftest.py`` of :mod:`moreshell`, so that they are
+measured by ``--coverage``, and controlled by the environment variables
+below, which are set per pytest worker process
+"""
+
+import json
+import os
+
+#: Run only every N-th collected test, starting at index I, given as ``I/N``.
+SHARD_ENV = 'MORESHELL_TEST_SHARD'
+
+#: Path of a JSON list of the test node IDs to run, if collected.
+SELECT_ENV = 'MORESHELL_TEST_SELECT'
+
+#: Path of a file to which the node IDs of failed tests are appended.
+FAILED_ENV = 'MORESHELL_TEST_FAILED'
+
+
+def parse_shard(text):
+    """
+    Get the ``(index, count)`` of a ``I/N`` shard `text`.
+
+    >>> parse_shard('1/4')
+    (1, 4)
+    """
+    index, count = map(int, text.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(
+            "Shard index must be in range 0 to {}, not: {!r}"
+            .format(count - 1, text))
+
+    return index, count
+
+
+def select(items, shard=None, nodeids=None):
+    """
+    Split collected test `items` into selected and deselected ones.
+
+    Only items with one of the given `nodeids` are selected, if any, and
+    of those only the ones of the ``(index, count)`` `shard`, if given
+    """
+    selected = list(items)
+    if nodeids:
+        selected = [item for item in selected if item.nodeid in nodeids]
+    if shard is not None:
+        index, count = shard
+        selected = selected[index::count]
+    chosen = set(id(item) for item in selected)
+    return selected, [item for item in items if id(item) not in chosen]
+
+
+def pytest_collection_modifyitems(config, items):
+    """Deselect the tests not belonging to this worker's run."""
+    shard = os.environ.get(SHARD_ENV)
+    select_path = os.environ.get(SELECT_ENV)
+    if not shard and not select_path:
+        return
+
+    nodeids = None
+    if select_path:
+        with open(select_path) as select_file:
+            nodeids = set(json.load(select_file))
+    selected, deselected = select(
+        items, shard=shard and parse_shard(shard), nodeids=nodeids)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def pytest_runtest_logreport(report):
+    """Record the node IDs of failed tests for ``--last-failed`` runs."""
+    path = os.environ.get(FAILED_ENV)
+    if path and report.failed:
+        with open(path, 'a') as failed:
+            failed.write(report.nodeid + '\n')
@@ -0,0 +1,187 @@
+"""Test :mod:`moreshell.aio` and ``async def``-based ``%magic``."""
+
+import asyncio
+from threading import Event
+from timeit import default_timer
+
+import pytest
+
+from moreshell import (
+    IPython_magic, IPython_cell_magic, IPythonMagicBudgetExceeded,
+    with_arguments)
+from moreshell.aio import (
+    loop_thread, run_coroutine, running_loop, thread_future)
+
+
+def test_async_magic():
+    """Test that the coroutine result of a ``%magic`` is waited for."""
+    @IPython_magic(with_arguments('value'))
+    async def magic(shell, args):
+        await asyncio.sleep(0)
+        return args.value
+
+    assert magic.is_coroutine
+    assert magic('value') == 'value'
+
+
+def test_async_cell_magic():
+    """Test an ``async def``-based cell ``%%magic``."""
+    @IPython_cell_magic(with_arguments('value'))
+    async def magic(shell, args, block):
+        await asyncio.sleep(0)
+        return args.value, block
+
+    assert magic('value', 'block') == ('value', 'block')
+
+
+def test_async_magic_scheduled():
+    """Test that scheduled ``%magic`` overlap their I/O."""
+    @IPython_magic(with_arguments('value'), schedule=True)
+    async def magic(shell, args):
+        await asyncio.sleep(0.2)
+        return args.value
+
+    futures = [magic(str(value)) for value in range(10)]
+    assert all(isinstance(future, thread_future) for future in futures)
+    # all sleeping in parallel, so a lot less than 10 * 0.2 seconds
+    assert [future.result(timeout=1) for future in futures] == [
+        str(value) for value in range(10)]
+    assert all(future.done() for future in futures)
+
+
+def test_async_magic_scheduled__await():
+    """Test awaiting ``%magic`` scheduled outside of a running loop."""
+    @IPython_magic(with_arguments('value'), schedule=True)
+    async def magic(shell, args):
+        await asyncio.sleep(0.1)
+        return args.value
+
+    async def cell(futures):
+        return [await future for future in futures]
+
+    futures = [magic(str(value)) for value in range(3)]
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(cell(futures)) == ['0', '1', '2']
+    finally:
+        loop.close()
+
+
+def test_async_magic_scheduled__from_file(tmpdir):
+    """Test that mapped files are closed when scheduled calls are done."""
+    @IPython_cell_magic(
+        with_arguments('value'), schedule=True, stream='reader')
+    async def magic(shell, args, block):
+        await asyncio.sleep(0)
+        return block.read().tobytes(), block
+
+    path = tmpdir.join('data.txt')
+    path.write_binary(b"data")
+    future = magic('value --from-file {}'.format(path), "")
+    data, reader = future.result(timeout=1)
+    assert data == b"data"
+    assert reader._source.closed
+
+    readers = []
+
+    @IPython_cell_magic(
+        with_arguments('value'), schedule=True, stream='reader')
+    async def failing(shell, args, block):
+        readers.append(block)
+        await asyncio.sleep(0)
+        raise RuntimeError("failed")
+
+    future = failing('value --from-file {}'.format(path), "")
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    assert readers[0]._source.closed
+
+
+def test_async_magic_in_running_loop():
+    """
+    Test ``async def``-based ``%magic`` called inside a running loop.
+
+    Like with IPython's ``autoawait``. Waiting for the result must not
+    deadlock and scheduling must create a task on the running loop
+    """
+    @IPython_magic(with_arguments('value'))
+    async def magic(shell, args):
+        await asyncio.sleep(0)
+        return args.value
+
+    @IPython_magic(with_arguments('value'), schedule=True)
+    async def scheduled_magic(shell, args):
+        await asyncio.sleep(0)
+        return args.value
+
+    async def cell():
+        assert running_loop() is asyncio.get_event_loop()
+        assert magic('value') == 'value'
+
+        task = scheduled_magic('value')
+        assert isinstance(task, asyncio.Task)
+        return await task
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(cell()) == 'value'
+    finally:
+        loop.close()
+
+
+def test_loop_thread_shared():
+    """Test that there is only one shared :class:`.loop_thread`."""
+    async def thread():
+        return running_loop()
+
+    assert loop_thread.get() is loop_thread.get()
+    assert run_coroutine(thread()) is loop_thread.get().loop
+
+
+def test_async_magic_timeout():
+    """Test cancelling ``async def``-based ``%magic`` exceeding a timeout."""
+    cancelled = Event()
+
+    @IPython_magic(with_arguments('value'), timeout=0.2, stats=False)
+    async def magic(shell, args):
+        try:
+            await asyncio.sleep(float(args.value))
+
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+        return args.value
+
+    assert magic('0') == '0'
+    start = default_timer()
+    with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+        magic('2')
+    assert 0.2 <= exc.value.usage['wall'] <= default_timer() - start < 1
+    assert str(exc.value).startswith(
+        "%magic exceeded its wall time budget of 0.20s (wall 0.2")
+    # on the loop thread
+    assert cancelled.wait(1)
+
+
+def test_async_magic_timeout__own_timeout_error():
+    """Test that timeouts raised by the coroutine itself pass through."""
+    @IPython_magic(with_arguments('value'), timeout=10, stats=False)
+    async def magic(shell, args):
+        raise asyncio.TimeoutError(args.value)
+
+    with pytest.raises(asyncio.TimeoutError, match=r"^own$"):
+        magic('own')
+
+
+def test_async_magic_timeout__scheduled():
+    """Test that scheduled ``%magic`` are limited with ``wait_for``."""
+    @IPython_magic(
+        with_arguments('value'), timeout=0.1, schedule=True, stats=False)
+    async def magic(shell, args):
+        await asyncio.sleep(float(args.value))
+        return args.value
+
+    assert magic('0').result(timeout=1) == '0'
+    with pytest.raises(asyncio.TimeoutError):
+        magic('2').result(timeout=1)
@@ -0,0 +1,86 @@
+"""Test :mod:`moreshell.batch`."""
+
+import sys
+import threading
+
+import pytest
+
+from moreshell import (
+    IPython_cell_magic, IPython_magic, IPythonMagicExit, load_magic_modules,
+    with_arguments)
+from moreshell.batch import batch_result, moreshell_batch
+
+
+@IPython_magic(with_arguments('value', type=int))
+def inverse(shell, args):
+    """Get the inverse of the value and the running thread."""
+    return 1.0 / args.value, threading.current_thread().name
+
+
+class Test_magic_function_map(object):
+    """Test :meth:`moreshell.magic.magic_function.map`."""
+
+    def test_map(self, capsys):
+        """Test that errors of single lines are collected in order."""
+        inverse.stats.reset()
+        batch = inverse.map(['1', 'x', '0', '4'])
+        assert isinstance(batch, batch_result)
+        assert repr(batch) == "<batch_result of {!r}: 4 lines, 2 errors>" \
+            .format(inverse)
+        assert not batch.ok
+        assert len(batch) == 4
+        assert [result and result[0] for result in batch] == [
+            1.0, None, None, 0.25]
+        assert batch[3][0] == 0.25
+        assert list(batch.errors) == [1, 2]
+        assert isinstance(batch.errors[1], IPythonMagicExit)
+        with pytest.raises(ZeroDivisionError):
+            batch[2]
+
+        assert (inverse.stats.calls, inverse.stats.errors) == (4, 2)
+        assert "invalid int value: 'x'" in capsys.readouterr().err
+
+    def test_map__workers(self):
+        """Test that lines are run in parallel threads."""
+        batch = inverse.map([str(value) for value in range(1, 9)], workers=4)
+        assert batch.ok
+        assert [result[0] for result in batch] == [
+            1.0 / value for value in range(1, 9)]
+        assert all(
+            name != threading.current_thread().name for _, name in batch)
+
+    def test_map__cell(self):
+        """Test that cell magic get the same block for every line."""
+        @IPython_cell_magic(with_arguments('value'), stats=False)
+        def magic(shell, args, block):
+            return args.value + block
+
+        assert list(magic.map(['a', 'b'], block="!")) == ['a!', 'b!']
+
+
+class Test_moreshell_batch(object):
+    """Test the ``%%moreshell_batch`` magic."""
+
+    def test_magic(self, shell):
+        """Test running a registered line magic for each cell line."""
+        inverse.load(shell)
+        moreshell_batch.shell = shell
+
+        batch = moreshell_batch('%inverse -w 2', block="1\n\n2\n")
+        assert [result[0] for result in batch] == [1.0, 0.5]
+
+        with pytest.raises(ZeroDivisionError):
+            moreshell_batch('inverse --raise', block="1\n0\n")
+
+        with pytest.raises(ValueError, match=r"^%missing is no line magic "):
+            moreshell_batch('missing', block="1")
+
+    def test_magic__lazy(self, echo_magic_module__name__, shell):
+        """Test running a not yet imported line magic of a lazy module."""
+        load_magic_modules(echo_magic_module__name__, shell=shell, lazy=True)
+        moreshell_batch.shell = shell
+        assert echo_magic_module__name__ not in sys.modules
+
+        batch = moreshell_batch('test_moreshell_echo', block="-u a\nb\n")
+        assert list(batch) == ['A', 'b']
+        assert echo_magic_module__name__ in sys.modules
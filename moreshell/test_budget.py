@@ -0,0 +1,231 @@
+"""Test :mod:`moreshell.budget` and ``%magic`` with resource budgets."""
+
+import pickle
+import resource
+import time
+
+import pytest
+
+from moreshell import (
+    IPython_magic, IPythonMagicBudgetExceeded, IPythonMagicExit,
+    with_arguments)
+from moreshell.budget import (
+    budget, budget_interrupt, parse_size, requested_budget, set_soft_rlimit)
+from moreshell.process import pool, run_in_worker
+
+
+def spin_loops(loops):
+    """Count up to `loops`, or forever if ``0``."""
+    count = 0
+    while not loops or count < loops:
+        count += 1
+    return count
+
+
+@IPython_magic(
+    with_arguments('-n', '--loops', type=int, default=0),
+    timeout=0.1, background_flag=True, stats=False)
+def spin(shell, args):
+    """Spin `loops` times, or forever, which also catching all errors."""
+    try:
+        return spin_loops(args.loops)
+
+    except Exception:  # pragma: no cover
+        return 'caught'
+
+
+@IPython_magic(
+    with_arguments('-n', '--loops', type=int, default=0), budget_flags=True,
+    executor='process', stats=False)
+def process_spin(shell, args):
+    """Spin `loops` times, or forever, in a worker process."""
+    return spin_loops(args.loops)
+
+
+@IPython_magic(
+    with_arguments('-s', '--size', type=parse_size), budget_flags=True,
+    stats=False)
+def allocate(shell, args):
+    """Allocate `size` bytes at once, or 1 MiB chunks forever."""
+    if args.size:
+        return len(bytearray(args.size))
+
+    chunks = []
+    while True:
+        chunks.append(bytearray(2 ** 20))
+        time.sleep(0.001)
+
+
+@IPython_magic(with_arguments('-v', '--value'), timeout=0.1, stats=False)
+def swallow(shell, args):
+    """Spin forever, but swallow the cancellation."""
+    try:
+        spin_loops(0)
+
+    except BaseException:
+        return 'swallowed'
+
+
+@IPython_magic(
+    with_arguments('value'), timeout=10, cache=True, stats=False)
+def cached(shell, args):
+    """Return the value."""
+    return args.value
+
+
+@pytest.fixture
+def small_pool():
+    """Use a small shared process pool and shut it down afterwards."""
+    pool.resize(1)
+    yield pool
+    pool.shutdown()
+
+
+class Test_budget(object):
+    """Test :class:`moreshell.budget.budget` via ``%magic`` options."""
+
+    def test_timeout(self):
+        """Test cancelling calls exceeding their wall time."""
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            spin('')
+        assert exc.value.resource == 'wall'
+        assert exc.value.limit == 0.1
+        assert exc.value.usage['wall'] >= 0.1
+        assert str(exc.value).startswith(
+            "%spin exceeded its wall time budget of 0.10s (wall ")
+
+        assert spin('-n 10') == 10
+        assert spin('--timeout 0 -n 1000') == 1000
+
+    def test_max_cpu_seconds(self):
+        """Test cancelling calls exceeding their CPU time."""
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            spin('--timeout 0 --max-cpu-seconds 0.05')
+        assert exc.value.resource == 'cpu'
+        assert exc.value.usage['cpu'] >= 0.05
+
+    def test_max_memory(self):
+        """Test cancelling calls growing memory too much."""
+        assert allocate('--size 1K') == 1024
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            allocate('--max-memory 16M')
+        assert exc.value.resource == 'memory'
+        assert exc.value.usage['memory'] >= 16 * 2 ** 20
+        assert str(exc.value).startswith(
+            "%allocate exceeded its memory budget of 16.0 MiB (wall ")
+
+        with pytest.raises(IPythonMagicExit):
+            allocate('--max-memory lots')
+
+    def test_swallowed(self):
+        """Test that cancellations swallowed by the ``%magic`` still raise."""
+        with pytest.raises(IPythonMagicBudgetExceeded):
+            swallow('')
+
+    def test_background(self):
+        """Test that budgets also limit background jobs."""
+        job = spin('--background')
+        with pytest.raises(IPythonMagicBudgetExceeded):
+            job.result(timeout=10)
+
+    def test_cached(self):
+        """Test that only new results of cached ``%magic`` are limited."""
+        assert cached('value') == 'value'
+        assert cached('value') == 'value'
+        assert cached('--no-cache value') == 'value'
+
+    def test_budget_flags(self):
+        """Test that ``budget_flags=`` adds the flags without limits."""
+        assert process_spin.creator.injected_options == [
+            'timeout', 'max_cpu_seconds', 'max_memory']
+        assert requested_budget(process_spin.creator, {}) is None
+        limits = requested_budget(
+            process_spin.creator, {'timeout': 1, 'max_memory': 0})
+        assert repr(limits) == (
+            "<budget timeout=1, max_cpu_seconds=None, max_memory=None>")
+
+    def test_negative(self):
+        """Test that negative limits raise ``ValueError``."""
+        with pytest.raises(ValueError, match=(
+                r"^max_memory of .* can't be negative, not: -1$")):
+            IPython_magic(with_arguments('value'), max_memory=-1)
+
+    def test_run__interrupt(self):
+        """Test that other interrupts are passed through."""
+        @IPython_magic(with_arguments('-v', '--value'), stats=False)
+        def interrupted(shell, args):
+            raise budget_interrupt()
+
+        with pytest.raises(budget_interrupt):
+            budget(timeout=10).run(interrupted, interrupted.parse(''))
+
+
+class Test_budget_run_in_worker(object):
+    """Test :meth:`moreshell.budget.budget.run_in_worker`."""
+
+    def test_max_cpu_seconds(self):
+        """Test limiting the CPU time with ``RLIMIT_CPU``."""
+        limits = budget(max_cpu_seconds=0.1)
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            limits.run_in_worker(spin, spin.parse(''))
+        assert exc.value.resource == 'cpu'
+        assert exc.value.usage['cpu'] >= 0.1
+        assert limits.run_in_worker(spin, spin.parse('-n 10')) == 10
+
+    def test_max_memory(self):
+        """Test limiting the memory with ``RLIMIT_AS``."""
+        limits = budget(max_memory=64 * 2 ** 20)
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            limits.run_in_worker(allocate, allocate.parse('--size 256M'))
+        assert exc.value.resource == 'memory'
+        assert limits.run_in_worker(
+            allocate, allocate.parse('--size 1M')) == 2 ** 20
+
+    def test_timeout(self):
+        """Test that the timeout is checked by a watchdog thread."""
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            budget(timeout=0.1).run_in_worker(spin, spin.parse(''))
+        assert exc.value.resource == 'wall'
+
+    def test_run_in_worker(self):
+        """Test that workers get the budget of the call."""
+        with pytest.raises(IPythonMagicBudgetExceeded):
+            run_in_worker(
+                __name__, 'process_spin', 'line', process_spin.parse(''),
+                budget=budget(timeout=0.1))
+
+    def test_process_magic(self, small_pool):
+        """Test that budgets are sent to the worker processes."""
+        assert process_spin('-n 10') == 10
+        with pytest.raises(IPythonMagicBudgetExceeded) as exc:
+            process_spin('--max-cpu-seconds 0.1')
+        assert exc.value.resource == 'cpu'
+
+
+def test_budget_exceeded__pickle():
+    """Test that errors from worker processes keep their usage figures."""
+    exc = pickle.loads(pickle.dumps(IPythonMagicBudgetExceeded(
+        '%magic', 'cpu', 1.0, {'wall': 2.0, 'cpu': 1.01, 'memory': None})))
+    assert (exc.prog, exc.resource, exc.limit) == ('%magic', 'cpu', 1.0)
+    assert str(exc) == (
+        "%magic exceeded its CPU time budget of 1.00s (wall 2.00s, cpu 1.01s)")
+
+
+def test_parse_size__invalid():
+    """Test that invalid sizes raise ``ValueError``."""
+    with pytest.raises(ValueError, match=r"^Invalid size: 'lots'$"):
+        parse_size('lots')
+
+
+def test_set_soft_rlimit():
+    """Test that soft limits are kept below finite hard limits."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY:  # pragma: no cover
+        pytest.skip("Requires a finite hard limit of open files")
+
+    assert set_soft_rlimit(resource.RLIMIT_NOFILE, hard + 1) == (
+        resource.RLIMIT_NOFILE, soft)
+    try:
+        assert resource.getrlimit(resource.RLIMIT_NOFILE) == (hard, hard)
+    finally:
+        set_soft_rlimit(resource.RLIMIT_NOFILE, soft)
@@ -0,0 +1,96 @@
+"""Test :mod:`moreshell.cache`."""
+
+from argparse import Namespace
+
+import pytest
+
+from moreshell.cache import bounded_cache, copy_namespace, freeze, result_key
+
+
+class Test_bounded_cache(object):
+    """Test :class:`moreshell.cache.bounded_cache`."""
+
+    def test__init__with_invalid_maxsize(self):
+        """Test that a non-positive ``maxsize`` raises ``ValueError``."""
+        with pytest.raises(ValueError, match=r" must be positive, not: 0$"):
+            bounded_cache(maxsize=0)
+
+    def test__init__with_invalid_ttl(self):
+        """Test that a non-positive ``ttl`` raises ``ValueError``."""
+        with pytest.raises(
+                ValueError, match=r" must be positive or None, not: 0$"):
+            bounded_cache(ttl=0)
+
+    def test_ttl(self, monkeypatch):
+        """Test that entries expire ``ttl`` seconds after being cached."""
+        now = [100.0]
+        monkeypatch.setattr(
+            'moreshell.cache.default_timer', lambda: now[0])
+
+        cache = bounded_cache(ttl=10)
+        cache['key'] = 'value'
+        now[0] += 9
+        assert 'key' in cache
+        assert cache.get('key') == 'value'
+
+        now[0] += 1
+        assert 'key' not in cache
+        assert cache.get('key') is None
+        assert len(cache) == 0
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_clear(self):
+        """Test that :meth:`.clear` also resets the counters."""
+        cache = bounded_cache()
+        assert cache.hit_rate == 0.0
+
+        cache['key'] = 'value'
+        assert cache.get('key') == 'value'
+        assert cache.get('other') is None
+
+        cache.clear()
+        assert len(cache) == 0
+        assert (cache.hits, cache.misses) == (0, 0)
+
+    def test__setitem__existing(self):
+        """Test that overwriting an entry marks it most recently used."""
+        cache = bounded_cache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+        assert 'b' not in cache
+        assert cache.get('a') == 3
+
+
+def test_copy_namespace():
+    """Test that only mutable values get copied."""
+    value = ('tuple', )
+    args = Namespace(items=['a'], value=value, flag=True)
+    copied = copy_namespace(args)
+    assert copied == args
+    assert copied.items is not args.items
+    assert copied.value is value
+
+
+def test_freeze():
+    """Test that containers become hashable equivalents."""
+    frozen = freeze({'b': [1, {2}], 'a': (3, )})
+    assert frozen == (('a', (3, )), ('b', (1, frozenset([2]))))
+    hash(frozen)
+
+
+def test_result_key():
+    """Test the keys of parsed arguments and cell blocks."""
+    args = Namespace(items=['a'], value='value')
+    key = result_key(args)
+    assert key == result_key(Namespace(value='value', items=['a']))
+    assert key != result_key(Namespace(items=['b'], value='value'))
+
+    block_key = result_key(args, u"cell")
+    assert block_key[:-1] == key
+    assert block_key == result_key(args, b"cell")
+    assert block_key != result_key(args, u"other")
+
+    assert result_key(Namespace(value=object)) is not None
+    assert result_key(Namespace(value=[bytearray()])) is None
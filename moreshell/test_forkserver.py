@@ -0,0 +1,184 @@
+"""Test :mod:`moreshell.forkserver`."""
+
+import os
+import socket
+import sys
+from textwrap import dedent
+
+import pytest
+
+from moreshell.forkserver import (
+    forked_process, forkserver, run_request, send_message, send_outcome)
+
+MAIN = dedent("""
+    import os
+    import sys
+
+    print("argv: {}".format(sys.argv[1:]))
+    print("env: {}".format(os.environ.get('MORESHELL_FORKED')))
+    print("preloaded: {}".format(
+        [name for name in ['decimal', 'json'] if name in sys.modules]))
+    sys.exit(int(sys.argv[1]))
+    """)
+
+
+@pytest.fixture
+def main_dir(tmpdir, monkeypatch):
+    """Get the current working directory with a ``forked_main`` module."""
+    tmpdir.join('forked_main.py').write(MAIN)
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+@pytest.fixture
+def server():
+    """Get a :class:`moreshell.forkserver.forkserver` stopped after use."""
+    server = forkserver(preload=['json'])
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def connection():
+    """Get the client and child ends of a request connection."""
+    client, child = socket.socketpair()
+    yield client, child
+    client.close()
+    child.close()
+
+
+def fail(exc):  # pragma: no cover
+    """Raise `exc`, for calling it in a forked child."""
+    raise exc
+
+
+class Test_forkserver(object):
+    """Test :class:`moreshell.forkserver.forkserver`."""
+
+    def test_run_module(self, server, main_dir, capsys):
+        """Test running modules in forked children like ``python -m``."""
+        env = dict(os.environ, MORESHELL_FORKED='yes')
+        assert server.run_module('forked_main', ['3', 'x'], env=env) == 3
+        pid = server.process.pid
+        assert server.run_module('forked_main', ['0']) == 0
+        assert server.process.pid == pid
+        assert capsys.readouterr().out == (
+            "argv: ['3', 'x']\nenv: yes\npreloaded: ['json']\n"
+            "argv: ['0']\nenv: None\npreloaded: ['json']\n")
+
+        process = server.spawn_module('forked_main', ['1'])
+        assert process.stdout.readline() == "argv: ['1']\n"
+        process.stdout.close()
+        assert process.wait() == 1
+
+    def test_call(self, server, capsys):
+        """Test calling functions in forked children."""
+        pid = server.call(os.getpid)
+        assert pid not in (os.getpid(), server.process.pid)
+        assert server.call(os.system, 'echo forked') == 0
+        assert capsys.readouterr().out == "forked\n"
+
+        with pytest.raises(ZeroDivisionError):
+            server.call(divmod, 1, 0)
+        with pytest.raises(RuntimeError, match=r"^forked$"):
+            server.call(fail, RuntimeError("forked"))
+        with pytest.raises(TypeError, match=r"^Can't send .* pickled "):
+            server.call(lambda: None)
+        assert server.call(divmod, 7, 2) == (3, 1)
+
+    def test_restart(self, server, main_dir, capsys):
+        """Test restarting the server if stopped or dead."""
+        server.start()
+        process = server.process
+        server.process.kill()
+        server.process.wait()
+        assert server.call(divmod, 7, 2) == (3, 1)
+        assert server.process is not process
+        socket_dir = server.socket_dir
+
+        server.set_preload(['json', 'decimal'])
+        assert server.process is None
+        assert not os.path.exists(socket_dir)
+        assert server.run_module('forked_main', ['0']) == 0
+        assert "preloaded: ['decimal', 'json']" in capsys.readouterr().out
+
+    def test_start__sys_path(self, server, tmpdir, monkeypatch):
+        """Test that children find modules via this process's sys.path."""
+        lib_dir = tmpdir.mkdir('lib')
+        lib_dir.join('forked_lib_main.py').write("import sys; sys.exit(4)")
+        monkeypatch.syspath_prepend(str(lib_dir))
+        monkeypatch.chdir(tmpdir.mkdir('cwd'))
+        assert server.run_module('forked_lib_main') == 4
+
+    def test_start__failed(self, capfd):
+        """Test that failing preload imports raise ``RuntimeError``."""
+        server = forkserver(preload=['moreshell_missing'])
+        with pytest.raises(RuntimeError, match=r" \['moreshell_missing'\]$"):
+            server.start()
+        assert server.process is None
+        assert "No module named 'moreshell_missing'" in capfd.readouterr().err
+
+
+class Test_run_request(object):
+    """Test the forked children's side of the protocol, in-process."""
+
+    def test_call(self, connection):
+        """Test replying with return values and raised exceptions."""
+        client, child = connection
+        send_message(client, ('call', divmod, (7, 2), {}))
+        outcome = run_request(child)
+        assert outcome == ('return', (3, 1))
+        send_message(child, ('output', u'mä'.encode('utf-8')[:2]))
+        send_message(child, ('output', u'mä'.encode('utf-8')[2:]))
+        send_message(child, ('output', b'\nrest'))
+        send_outcome(child, outcome)
+        process = forked_process(client)
+        assert process.readline() == u'mä\n'
+        assert process.readline() == u'rest'
+        assert process.readline() == u''
+        assert process.result() == (3, 1)
+
+    def test_call__exit(self, connection):
+        """Test that ``SystemExit`` of called functions is sent back."""
+        client, child = connection
+        send_message(client, ('call', sys.exit, (2, ), {}))
+        outcome = run_request(child)
+        assert outcome[0] == 'raise'
+        assert isinstance(outcome[1], SystemExit)
+
+    def test_unpicklable_result(self, connection):
+        """Test replying with ``TypeError`` for unpicklable results."""
+        client, child = connection
+        send_outcome(child, ('return', lambda: None))
+        with pytest.raises(TypeError, match=r"^Can't send .* pickled "):
+            forked_process(client).result()
+
+    def test_closed(self, connection):
+        """Test that closed connections raise ``EOFError``."""
+        client, child = connection
+        child.close()
+        with pytest.raises(EOFError, match=r" closed unexpectedly$"):
+            forked_process(client).result()
+
+    def test_module(self, connection, main_dir, monkeypatch, capsys):
+        """Test running a module with argv, environment, and cwd."""
+        client, child = connection
+        monkeypatch.setattr(os, 'environ', dict(os.environ))
+        monkeypatch.setattr(sys, 'argv', list(sys.argv))
+        monkeypatch.syspath_prepend(str(main_dir))
+        env = {'MORESHELL_FORKED': 'yes'}
+        send_message(client, (
+            'module', 'forked_main', ['5'], env, str(main_dir)))
+        assert run_request(child) == ('return', 5)
+        assert os.environ == env
+        assert capsys.readouterr().out.startswith(
+            "argv: ['5']\nenv: yes\n")
+
+        main_dir.join('forked_main.py').write("import sys; sys.exit('no')")
+        send_message(client, ('module', 'forked_main', [], env, '.'))
+        assert run_request(child) == ('return', 1)
+        assert capsys.readouterr().err == "no\n"
+
+        main_dir.join('forked_main.py').write("")
+        send_message(client, ('module', 'forked_main', [], env, '.'))
+        assert run_request(child) == ('return', 0)
@@ -0,0 +1,99 @@
+"""Test the API and the deferred imports of :mod:`moreshell`."""
+
+import subprocess
+import sys
+
+import pytest
+
+import moreshell
+
+#: The submodules defining the API, imported on first access.
+API_SUBMODULES = ('moreshell.magic', 'moreshell.module')
+
+#: The budget in seconds for the self import times of all submodules.
+SUBMODULE_IMPORT_BUDGET = 0.05
+
+
+def run(code, options=()):
+    """
+    Run `code` in a fresh interpreter with optional Python `options`.
+
+    Returns the last line of ``stdout`` and all of ``stderr``
+    """
+    process = subprocess.Popen(
+        [sys.executable] + list(options) + ['-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    out, err = process.communicate()
+    assert process.returncode == 0, err
+    return out.splitlines()[-1] if out.strip() else '', err
+
+
+def submodule_import_time(code):
+    """
+    Run `code` with ``-X importtime``.
+
+    Returns the summed self import times of the imported ``moreshell``
+    submodules in seconds
+    """
+    _, err = run(code, ['-X', 'importtime'])
+    total = 0
+    for line in err.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        self_time, _, name = line[len('import time:'):].split('|')
+        if name.strip().startswith('moreshell.'):
+            total += int(self_time)
+    return total / 1e6
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="Requires PEP 562")
+def test_import_deferred():
+    """Test that ``import moreshell`` imports none of its submodules."""
+    imported, _ = run(
+        "import sys, moreshell; "
+        "print(sorted(name for name in sys.modules "
+        "if name.startswith('moreshell.')))")
+    assert imported == '[]'
+
+    imported, _ = run(
+        "import sys; "
+        "from moreshell import IPython_magic, load_magic_modules; "
+        "print(sorted(set({!r}) & set(sys.modules)))".format(API_SUBMODULES))
+    assert imported == repr(sorted(API_SUBMODULES))
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="Requires PEP 562")
+def test_import_time():
+    """Test the submodule import times under ``-X importtime``."""
+    assert submodule_import_time("import moreshell") == 0
+    # explicitly, since imports on first access bypass -X importtime
+    assert 0 < submodule_import_time(
+        "import " + ", ".join(API_SUBMODULES)) < SUBMODULE_IMPORT_BUDGET
+
+
+def test_api():
+    """Test that the API is available from the package."""
+    from moreshell.magic import IPython_magic
+    from moreshell.module import load_magic_modules
+
+    assert moreshell.IPython_magic is IPython_magic
+    assert moreshell.load_magic_modules is load_magic_modules
+    with pytest.raises(AttributeError, match=r" has no attribute 'missing'"):
+        moreshell.__module__.__getattr__('missing')
+
+
+def test_load_ipython_extension(shell):
+    """Test that ``%load_ext moreshell`` loads the built-in magic."""
+    from moreshell.batch import moreshell_batch
+    from moreshell.jobs import moreshell_jobs
+    from moreshell.pipe import moreshell_pipe
+    from moreshell.stats import moreshell_stats
+
+    moreshell.load_ipython_extension(shell)
+    magics = shell.magics_manager.magics
+    assert magics['line'] == {
+        'moreshell_jobs': moreshell_jobs, 'moreshell_stats': moreshell_stats}
+    assert magics['cell'] == {
+        'moreshell_batch': moreshell_batch, 'moreshell_pipe': moreshell_pipe}
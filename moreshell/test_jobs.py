@@ -0,0 +1,124 @@
+"""Test :mod:`moreshell.jobs` and background ``%magic``."""
+
+from threading import Event
+
+import pytest
+
+from moreshell import IPython_magic, IPython_cell_magic, with_arguments
+from moreshell.jobs import job_manager, jobs, magic_job, moreshell_jobs
+
+
+@pytest.fixture
+def released():
+    """Provide an ``Event`` for releasing blocked background jobs."""
+    event = Event()
+    yield event
+    event.set()
+
+
+def test_background_magic(released):
+    """Test that ``background=True`` makes every call a job."""
+    @IPython_magic(with_arguments('value'), background=True)
+    def magic(shell, args):
+        released.wait(5)
+        return args.value
+
+    job = magic('value')
+    assert isinstance(job, magic_job)
+    assert jobs[job.id] is job
+    assert job.status in ('pending', 'running')
+    assert not job.done()
+    assert repr(job).startswith("<job {} <%magic at ".format(job.id))
+
+    released.set()
+    assert job.result(timeout=5) == 'value'
+    assert job.status == 'done'
+    assert job.elapsed == job.elapsed
+
+
+def test_background_flag():
+    """Test the ``--background`` flag of the ``background_flag=`` option."""
+    @IPython_magic(with_arguments('value'), background_flag=True)
+    def magic(shell, args):
+        assert not hasattr(args, 'background')
+        return args.value
+
+    @magic.cell_magic
+    def magic(shell, args, block):
+        return args.value, block
+
+    assert magic('value') == 'value'
+    assert magic('value --background').result(timeout=5) == 'value'
+    assert magic.cell('--background value', 'block').result(timeout=5) == (
+        'value', 'block')
+
+
+def test_background_flag_class_default(monkeypatch):
+    """Test the global ``IPython_magic.background_flag`` default."""
+    monkeypatch.setattr(IPython_magic, 'background_flag', True)
+
+    @IPython_cell_magic(with_arguments('value'))
+    def magic(shell, args, block):  # pragma: no cover
+        pass
+
+    assert magic.creator.injected_options == ['background']
+
+
+class Test_job_manager(object):
+    """Test :class:`moreshell.jobs.job_manager`."""
+
+    def test_cancel_and_clear(self, released):
+        """Test cancelling pending jobs and forgetting finished ones."""
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):
+            released.wait(5)
+            if args.value == 'fail':
+                raise ValueError(args.value)
+
+        manager = job_manager(max_workers=1)
+        running = manager.submit(magic, magic.parse('run'))
+        failing = manager.submit(magic, magic.parse('fail'))
+        pending = manager.submit(magic, magic.parse('pending'))
+        assert len(manager) == 3
+
+        assert pending.cancel()
+        assert pending.status == 'cancelled'
+
+        released.set()
+        assert running.wait(timeout=5).status == 'done'
+        assert isinstance(failing.wait(timeout=5).exception(), ValueError)
+        assert failing.status == 'failed'
+
+        manager.clear()
+        assert len(manager) == 0
+        with pytest.raises(KeyError, match=r"No moreshell job with ID 1"):
+            manager[running.id]
+
+        manager.shutdown()
+        assert manager.executor is None
+        manager.shutdown()
+
+
+def test_moreshell_jobs(capsys, released):
+    """Test the ``%moreshell_jobs`` magic."""
+    @IPython_magic(with_arguments('value'), background=True)
+    def magic(shell, args):
+        released.wait(5)
+        return args.value
+
+    first = magic('first')
+    second = magic('second')
+
+    moreshell_jobs('{} {}'.format(first.id, second.id))
+    out = capsys.readouterr().out.splitlines()
+    assert [line.split()[:1] for line in out] == [
+        ['[{}]'.format(first.id)], ['[{}]'.format(second.id)]]
+
+    released.set()
+    assert moreshell_jobs('-r {}'.format(first.id)) == 'first'
+    assert moreshell_jobs('-r {} {}'.format(first.id, second.id)) == [
+        'first', 'second']
+
+    moreshell_jobs('--wait --cancel --clear')
+    assert "done" in capsys.readouterr().out
+    assert first.id not in jobs.jobs and second.id not in jobs.jobs
@@ -0,0 +1,111 @@
+"""Test :mod:`moreshell.lazy`."""
+
+import ast
+import sys
+
+from moreshell import IPython_magic_module, load_magic_modules
+from moreshell.lazy import (
+    lazy_magic, lazy_magic_module, scan_magic_module, string_value)
+
+
+def test_scan_magic_module(echo_magic_module__name__):
+    """Test that magic names and kinds are found without importing."""
+    magics = scan_magic_module(echo_magic_module__name__)
+    assert list(magics.items()) == [
+        ('test_moreshell_echo', ['line', 'cell']),
+        ('test_moreshell_cell_echo', ['cell']),
+    ]
+    assert echo_magic_module__name__ not in sys.modules
+
+
+def test_scan_magic_module_without_magic():
+    """Test that ``None`` is returned for modules without found magic."""
+    assert scan_magic_module(__name__) is None
+    assert scan_magic_module('sys') is None
+
+
+def test_string_value():
+    """Test that only string literal nodes have string values."""
+    assert string_value(ast.parse("'name'").body[0].value) == 'name'
+    assert string_value(ast.parse("name").body[0].value) is None
+    assert string_value(ast.parse("42").body[0].value) is None
+
+
+def test_load_magic_modules_lazy(echo_magic_module__name__, shell):
+    """
+    Test :func:`moreshell.load_magic_modules` with ``lazy=True``.
+
+    Placeholders should be registered without importing the module. The
+    first call should import the module, replace all placeholders, and
+    forward the call
+    """
+    modules = load_magic_modules(
+        echo_magic_module__name__, shell=shell, lazy=True)
+    assert echo_magic_module__name__ not in sys.modules
+
+    module, = modules
+    assert isinstance(module, lazy_magic_module)
+    assert repr(module).startswith(
+        "<lazy magic module {!r} at ".format(echo_magic_module__name__))
+
+    magics = shell.magics_manager.magics
+    placeholder = magics['cell']['test_moreshell_echo']
+    assert isinstance(placeholder, lazy_magic)
+    assert repr(placeholder).startswith(
+        "<lazy %%test_moreshell_echo from {!r} at ".format(
+            echo_magic_module__name__))
+    assert isinstance(magics['line']['test_moreshell_echo'], lazy_magic)
+    assert isinstance(magics['cell']['test_moreshell_cell_echo'], lazy_magic)
+
+    assert placeholder('value', 'block') == ('value', 'block')
+    assert magics['line']['test_moreshell_echo']('-u value') == 'VALUE'
+    assert magics['cell']['test_moreshell_cell_echo']('-u', 'x') == 'X'
+
+    real = sys.modules[echo_magic_module__name__]
+    assert isinstance(real, IPython_magic_module)
+    assert magics['line']['test_moreshell_echo'] is real.test_moreshell_echo
+    assert magics['cell']['test_moreshell_echo'] is (
+        real.test_moreshell_echo.cell)
+    assert magics['cell']['test_moreshell_cell_echo'] is (
+        real.test_moreshell_cell_echo)
+    assert real.test_moreshell_echo.cell.shell is shell
+
+    # a held placeholder still works after the replacement
+    assert placeholder('value', 'block') == ('value', 'block')
+
+
+def test_load_magic_modules_lazy_already_imported(
+        magic_module__name__, shell):
+    """Test that already imported modules are loaded directly."""
+    from moreshell.test import magic_module
+
+    modules = load_magic_modules(magic_module__name__, shell=shell, lazy=True)
+    assert modules == [magic_module]
+    assert shell.magics_manager.magics['line']['test_moreshell'] is (
+        magic_module.test_moreshell)
+
+
+def test_lazy_magic_module_unload(echo_magic_module__name__, shell):
+    """Test that unloading only removes the module's own placeholders."""
+    module, = load_magic_modules(
+        echo_magic_module__name__, shell=shell, lazy=True)
+    magics = shell.magics_manager.magics
+    magics['line']['test_moreshell_echo'] = other = object()
+
+    module.unload(shell)
+    assert magics['line'] == {'test_moreshell_echo': other}
+    assert magics['cell'] == {}
+
+
+def test_lazy_magic_module_unload__resolved(echo_magic_module__name__, shell):
+    """Test that unloading also removes the real ``%magic`` once resolved."""
+    module, = load_magic_modules(
+        echo_magic_module__name__, shell=shell, lazy=True)
+    magics = shell.magics_manager.magics
+    assert magics['line']['test_moreshell_echo']('value') == 'value'
+    assert not isinstance(magics['line']['test_moreshell_echo'], lazy_magic)
+
+    module.unload(shell)
+    assert magics['line'] == {}
+    assert magics['cell'] == {}
+    assert sys.modules[echo_magic_module__name__].loaded_shells == []
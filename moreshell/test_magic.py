@@ -1,12 +1,13 @@
 """Test :mod:`moreshell.magic`."""
 
+import argparse
 from textwrap import dedent
 
 import pytest
 
 from moreshell import (
     IPython_magic, IPython_cell_magic, IPythonMagicExit, with_arguments)
-from moreshell.magic import magic_function
+from moreshell.magic import cell_magic, line_magic, magic_function
 
 
 class Test_magic_function(object):
@@ -26,6 +27,47 @@ class Test_magic_function(object):
         # Also check that func doesn't get called
         assert func.was_not_called
 
+    def test_load_and_unload(self, shell):
+        """Test registering a single ``%magic`` in an IPython shell."""
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        magic.load(shell)
+        assert shell.magics_manager.magics['line'] == {'magic': magic}
+        assert magic.shell is shell
+
+        magic.unload(shell)
+        assert shell.magics_manager.magics['line'] == {}
+        assert magic.shell is None
+
+    def test_shared_classes(self):
+        """Test that all ``%magic`` share their slotted classes."""
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        @magic.cell_magic
+        def magic(shell, args, block):  # pragma: no cover
+            pass
+
+        @IPython_cell_magic(with_arguments('value'))
+        def other(shell, args, block):  # pragma: no cover
+            pass
+
+        assert type(magic) is line_magic
+        assert type(magic.cell) is type(other) is cell_magic
+        assert 'shell' in magic_function.__slots__
+        assert 'creator' in line_magic.__slots__
+        for instance in (magic, magic.cell, other):
+            assert not hasattr(instance, '__dict__')
+            assert instance.__module__ == __name__
+        assert repr(magic).startswith('<%magic at ')
+        assert repr(magic.cell).startswith('<%%magic at ')
+        assert repr(other).startswith('<%%other at ')
+        assert magic.__doc__.startswith('usage: %magic ')
+        assert other.__doc__.startswith('usage: %%other ')
+
 
 class TestIPython_magic(object):
     """
@@ -58,9 +100,9 @@ class TestIPython_magic(object):
         """
         @IPython_magic(with_arguments('value')('-f', '--flag'))
         def magic(shell, args):  # pragma: no cover
-            magic.was_not_called = False
+            calls.append(args)
 
-        magic.was_not_called = True
+        calls = []
 
         with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
             magic('--help')  # pylint: disable=no-value-for-parameter
@@ -68,7 +110,7 @@ class TestIPython_magic(object):
 
         # Also, due to the exception, the decorated function should not get
         # called
-        assert magic.was_not_called
+        assert not calls
 
         std = capsys.readouterr()
         assert std.out == dedent("""
@@ -87,26 +129,24 @@ class TestIPython_magic(object):
         """
         Test the ``.__doc__`` property of a created ``%magic``.
 
-        The ``--help`` output of the ``%magic`` should be printed
-
-        And test that a :exc:`moreshell.MagicExit` with code ``0`` is raised
+        It should return the ``--help`` output of the ``%magic`` without
+        printing it or raising :exc:`moreshell.IPythonMagicExit`
         """
         @IPython_magic(with_arguments('value')('-f', '--flag'))
         def magic(shell, args):  # pragma: no cover
-            magic.was_not_called = False
+            calls.append(args)
 
-        magic.was_not_called = True
+        calls = []
 
-        with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
-            assert magic.__doc__ is None
-        assert exc.value.code == 0
+        doc = magic.__doc__
+        assert magic.__doc__ is doc
 
-        # Also, due to the exception, the decorated function should not get
-        # called
-        assert magic.was_not_called
+        # the decorated function should not get called
+        assert not calls
 
         std = capsys.readouterr()
-        assert std.out == dedent("""
+        assert std.out == std.err == ""
+        assert doc == dedent("""
         usage: %magic [-h] [-f FLAG] value
 
         positional arguments:
@@ -116,7 +156,6 @@ class TestIPython_magic(object):
           -h, --help            show this help message and exit
           -f FLAG, --flag FLAG
         """).lstrip()
-        assert std.err == ""
 
     def test_cell_magic__help(self, capsys):
         """
@@ -130,9 +169,9 @@ class TestIPython_magic(object):
 
         @magic.cell_magic
         def magic(shell, args, block):  # pragma: no cover
-            magic.cell.was_not_called = False
+            calls.append(args)
 
-        magic.cell.was_not_called = True
+        calls = []
 
         with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
             magic.cell('--help', block="")
@@ -140,7 +179,7 @@ class TestIPython_magic(object):
 
         # Also, due to the exception, the decorated function should not get
         # called
-        assert magic.cell.was_not_called
+        assert not calls
 
         std = capsys.readouterr()
         assert std.out == dedent("""
@@ -159,9 +198,8 @@ class TestIPython_magic(object):
         """
         Test the ``.__doc__`` property of a accompanying cell ``%%magic``.
 
-        The ``--help`` output of the cell ``%%magic`` should be printed
-
-        And test that a :exc:`moreshell.MagicExit` with code ``0`` is raised
+        It should return the ``--help`` output of the cell ``%%magic``
+        without printing it or raising :exc:`moreshell.IPythonMagicExit`
         """
         @IPython_magic(with_arguments('value')('-f', '--flag'))
         def magic(shell, args):  # pragma: no cover
@@ -169,20 +207,19 @@ class TestIPython_magic(object):
 
         @magic.cell_magic
         def magic(shell, args, block):  # pragma: no cover
-            magic.cell.was_not_called = False
+            calls.append(args)
 
-        magic.cell.was_not_called = True
+        calls = []
 
-        with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
-            assert magic.cell.__doc__ is None
-        assert exc.value.code == 0
+        doc = magic.cell.__doc__
+        assert magic.cell.__doc__ is doc
 
-        # Also, due to the exception, the decorated function should not get
-        # called
-        assert magic.cell.was_not_called
+        # the decorated function should not get called
+        assert not calls
 
         std = capsys.readouterr()
-        assert std.out == dedent("""
+        assert std.out == std.err == ""
+        assert doc == dedent("""
         usage: %%magic [-h] [-f FLAG] value
 
         positional arguments:
@@ -192,7 +229,24 @@ class TestIPython_magic(object):
           -h, --help            show this help message and exit
           -f FLAG, --flag FLAG
         """).lstrip()
-        assert std.err == ""
+
+    def test_magic__doc__invalidation(self):
+        """
+        Test that the memoized ``.__doc__`` follows argument changes.
+
+        Of the ``%magic`` created with :class:`moreshell.IPython_magic`
+        """
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        doc = magic.__doc__
+        assert '--added' not in doc
+        assert magic.__doc__ is doc
+
+        magic.creator.add_argument('--added')
+        assert '--added' in magic.__doc__
+        assert magic.creator.format_help() is magic.__doc__
 
 
 class TestIPython_cell_magic(object):
@@ -210,9 +264,9 @@ class TestIPython_cell_magic(object):
         """
         @IPython_cell_magic(with_arguments('-f', '--flag'))
         def magic(shell, args, block):  # pragma: no cover
-            magic.was_not_called = False
+            calls.append(args)
 
-        magic.was_not_called = True
+        calls = []
 
         with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
             magic('--help', block="")  # pylint: disable=no-value-for-parameter
@@ -220,7 +274,7 @@ class TestIPython_cell_magic(object):
 
         # Also, due to the exception, the decorated function should not get
         # called
-        assert magic.was_not_called
+        assert not calls
 
         std = capsys.readouterr()
         assert std.out == dedent("""
@@ -236,30 +290,186 @@ class TestIPython_cell_magic(object):
         """
         Test the ``.__doc__`` property of a created cell ``%%magic``.
 
-        The ``--help`` output of the cell ``%%magic`` should be printed
-
-        And test that a :exc:`moreshell.MagicExit` with code ``0`` is raised
+        It should return the ``--help`` output of the cell ``%%magic``
+        without printing it or raising :exc:`moreshell.IPythonMagicExit`
         """
         @IPython_cell_magic(with_arguments('-f', '--flag'))
         def magic(shell, args):  # pragma: no cover
-            magic.was_not_called = False
+            calls.append(args)
 
-        magic.was_not_called = True
+        calls = []
 
-        with pytest.raises(IPythonMagicExit, match=r'^0$') as exc:
-            assert magic.__doc__ is None
-        assert exc.value.code == 0
+        doc = magic.__doc__
+        assert magic.__doc__ is doc
 
-        # Also, due to the exception, the decorated function should not get
-        # called
-        assert magic.was_not_called
+        # the decorated function should not get called
+        assert not calls
 
         std = capsys.readouterr()
-        assert std.out == dedent("""
+        assert std.out == std.err == ""
+        assert doc == dedent("""
         usage: %%magic [-h] [-f FLAG]
 
         optional arguments:
           -h, --help            show this help message and exit
           -f FLAG, --flag FLAG
         """).lstrip()
-        assert std.err == ""
+
+
+class Test_magic_function_parse_cache(object):
+    """Test the argument parse cache of ``%magic`` functions."""
+
+    def test_parse__cached(self):
+        """Test that repeated argument lines are parsed only once."""
+        @IPython_magic(with_arguments('value')('-f', '--flag'), parse_cache=8)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        first = magic.parse('value -f flag')
+        second = magic.parse('value -f flag')
+        assert first == second
+        assert first is not second
+        assert first.value == 'value' and first.flag == 'flag'
+
+        info = magic.parse_cache.info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+        assert info.hit_rate == 0.5
+
+    def test_parse__cached_mutable_default(self):
+        """Test that mutating parse results doesn't change the cache."""
+        @IPython_magic(
+            with_arguments('-i', '--item', action='append'), parse_cache=8)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        magic.parse('-i a').item.append('b')
+        assert magic.parse('-i a').item == ['a']
+
+    def test_parse__cache_bounded(self):
+        """Test that the least recently used lines get evicted."""
+        @IPython_magic(with_arguments('value'), parse_cache=2)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        for value in ['a', 'b', 'a', 'c']:
+            magic.parse(value)
+        assert 'a' in magic.parse_cache and 'c' in magic.parse_cache
+        assert 'b' not in magic.parse_cache
+
+    def test_parse__cache_disabled(self):
+        """Test that line and cell magic don't cache by default."""
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        @magic.cell_magic
+        def magic(shell, args, block):  # pragma: no cover
+            pass
+
+        assert magic.parse_cache is None
+        assert magic.cell.parse_cache is None
+        assert magic.parse('value').value == 'value'
+
+    def test_parse__uncopyable(self, tmpdir):
+        """Test parsing again if cached values can't be copied."""
+        @IPython_magic(
+            with_arguments('file', type=argparse.FileType('r')),
+            parse_cache=8)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        path = tmpdir.join('file')
+        path.write('content')
+        first = magic.parse(str(path)).file
+        second = magic.parse(str(path)).file
+        try:
+            assert second is not first
+            assert second.read() == 'content'
+        finally:
+            first.close()
+            second.close()
+
+    def test_parse__error_not_cached(self, capsys):
+        """Test that failing argument lines are not cached."""
+        @IPython_magic(with_arguments('value'), parse_cache=8)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        for _ in range(2):
+            with pytest.raises(IPythonMagicExit):
+                magic.parse('')
+        assert len(magic.parse_cache) == 0
+        assert magic.parse_cache.misses == 2
+        capsys.readouterr()
+
+
+class Test_magic_function_result_cache(object):
+    """Test the result memoization of ``%magic`` functions."""
+
+    def test_call__cached(self):
+        """Test that repeated calls with equal arguments run only once."""
+        calls = []
+
+        @IPython_magic(with_arguments('value'), cache=True)
+        def magic(shell, args):
+            calls.append(args.value)
+            return args.value.upper()
+
+        assert magic.result_cache.maxsize == 128
+        assert magic('a') == magic('a') == 'A'
+        assert magic('b') == 'B'
+        assert calls == ['a', 'b']
+
+        assert magic('a --no-cache') == 'A'
+        assert calls == ['a', 'b', 'a']
+        assert magic.result_cache.info()[:2] == (1, 2)
+
+        magic.cache_clear()
+        assert len(magic.result_cache) == 0
+        magic('a')
+        assert calls == ['a', 'b', 'a', 'a']
+
+    def test_call__cached_cell(self):
+        """Test that cell ``%%magic`` results are keyed by block hash."""
+        calls = []
+
+        @IPython_magic(with_arguments('value'), cache=2, cache_ttl=60)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        @magic.cell_magic
+        def magic(shell, args, block):
+            calls.append(block)
+            return len(block)
+
+        cache = magic.cell.result_cache
+        assert (cache.maxsize, cache.ttl) == (2, 60)
+        assert magic.cell('v', block="one") == magic.cell('v', block="one")
+        assert magic.cell('v', block="three") == 5
+        assert calls == ["one", "three"]
+
+    def test_call__unhashable(self):
+        """Test that calls with unhashable arguments are not cached."""
+        calls = []
+
+        def to_bytearray(value):
+            return bytearray(value, 'ascii')
+
+        @IPython_magic(with_arguments('value', type=to_bytearray), cache=True)
+        def magic(shell, args):
+            calls.append(args.value)
+
+        magic('a')
+        magic('a')
+        assert len(calls) == 2
+        assert len(magic.result_cache) == 0
+
+    def test_cache_disabled(self):
+        """Test that results are not cached by default."""
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        assert magic.result_cache is None
+        assert 'no_cache' not in magic.creator.injected_options
+        magic.cache_clear()
@@ -0,0 +1,96 @@
+"""Test :mod:`moreshell.manifest`."""
+
+import json
+import sys
+
+from moreshell import IPython_magic_module, load_magic_modules
+from moreshell.lazy import lazy_magic, lazy_magic_module
+from moreshell.manifest import magic_manifest, main
+
+
+def test_load_magic_modules_with_manifest(
+        echo_magic_module__name__, shell, tmpdir):
+    """
+    Test :func:`moreshell.load_magic_modules` with ``manifest=``.
+
+    The first run should import the module for generating the manifest
+    entry. Later runs should register placeholders with help texts without
+    importing
+    """
+    path = str(tmpdir.join('manifest.json'))
+    modules = load_magic_modules(
+        echo_magic_module__name__, shell=shell, manifest=path)
+    assert isinstance(modules[0], IPython_magic_module)
+
+    manifest = magic_manifest(path)
+    assert not manifest.dirty
+    entry = manifest.get(echo_magic_module__name__)
+    assert [(magic['name'], magic['kind']) for magic in entry['magics']] == [
+        ('test_moreshell_echo', 'line'),
+        ('test_moreshell_cell_echo', 'cell'),
+        ('test_moreshell_echo', 'cell'),
+    ]
+
+    sys.modules.pop(echo_magic_module__name__)
+    shell.magics_manager.magics['line'].clear()
+    shell.magics_manager.magics['cell'].clear()
+
+    modules = load_magic_modules(
+        echo_magic_module__name__, shell=shell, manifest=manifest)
+    assert isinstance(modules[0], lazy_magic_module)
+    assert echo_magic_module__name__ not in sys.modules
+
+    magic = shell.magics_manager.magics['cell']['test_moreshell_echo']
+    assert isinstance(magic, lazy_magic)
+    assert magic.__doc__.startswith(
+        "usage: %%test_moreshell_echo [-h] [-u] value\n")
+    assert magic('value', 'block') == ('value', 'block')
+
+
+def test_load_magic_modules_with_default_manifest(
+        echo_magic_module__name__, shell, tmpdir, monkeypatch):
+    """Test that ``manifest=True`` uses the user's cache directory."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    load_magic_modules(echo_magic_module__name__, shell=shell, manifest=True)
+    assert tmpdir.join('moreshell', 'manifest.json').check(file=True)
+    assert magic_manifest().get(echo_magic_module__name__) is not None
+
+
+class Test_magic_manifest(object):
+    """Test :class:`moreshell.manifest.magic_manifest`."""
+
+    def test__init__with_broken_file(self, tmpdir):
+        """Test that broken or outdated manifest files are ignored."""
+        path = tmpdir.join('manifest.json')
+        path.write('{')
+        assert magic_manifest(str(path)).modules == {}
+
+        path.write(json.dumps({'version': 0, 'modules': {'mod': {}}}))
+        assert magic_manifest(str(path)).modules == {}
+
+    def test_get_invalidation(self, echo_magic_module__name__, tmpdir):
+        """Test that entries are only invalidated on content changes."""
+        manifest = magic_manifest(str(tmpdir.join('manifest.json')))
+        assert manifest.get(echo_magic_module__name__) is None
+
+        entry = manifest.generate(echo_magic_module__name__)
+        manifest.save()
+
+        # touching the file keeps the entry valid
+        entry['mtime'] -= 1
+        assert manifest.get(echo_magic_module__name__) is entry
+        assert manifest.dirty
+
+        entry['size'] += 1
+        entry['hash'] = 'outdated'
+        assert manifest.get(echo_magic_module__name__) is None
+
+        entry['file'] = str(tmpdir.join('missing.py'))
+        assert manifest.get(echo_magic_module__name__) is None
+
+
+def test_main(echo_magic_module__name__, tmpdir):
+    """Test generating manifest entries at build time."""
+    path = str(tmpdir.join('sub', 'manifest.json'))
+    main([echo_magic_module__name__, '--path', path])
+    assert magic_manifest(path).get(echo_magic_module__name__) is not None
@@ -6,7 +6,7 @@ import sys
 import pytest
 
 from moreshell import load_magic_modules
-from moreshell.module import import_magic_modules
+from moreshell.module import import_magic_modules, import_timings
 
 
 def test_load_magic_modules(magic_module__name__, shell):
@@ -133,3 +133,83 @@ class TestIPython_magic_module(object):
         from moreshell.test import magic_module
         magic_module.unload(shell)  # pylint: disable=no-member
         assert 'test_moreshell' not in shell.magics_manager.magics['line']
+
+
+def test_import_magic_modules_with_workers(
+        magic_module__name__, echo_magic_module__name__):
+    """
+    Test :func:`moreshell.module.import_magic_modules` with ``workers=``.
+
+    The modules should be returned in the given order and their import
+    durations should be recorded
+    """
+    names = [echo_magic_module__name__, magic_module__name__]
+    modules = import_magic_modules(names, workers=2)
+    assert modules == [sys.modules[name] for name in names]
+    for name in names:
+        assert import_timings[name] >= 0
+
+
+def test_import_magic_modules_with_workers_and_non_magic_module(
+        magic_module__name__):
+    """Test that the ``TypeError`` is also raised with ``workers=``."""
+    with pytest.raises(TypeError, match=r" is not wrapped with "):
+        import_magic_modules([magic_module__name__, __name__], workers=2)
+
+
+def test_load_magic_modules_with_workers(
+        echo_magic_module__name__, shell):
+    """Test :func:`moreshell.load_magic_modules` with ``workers=``."""
+    pkgname, modname = echo_magic_module__name__.rsplit('.', 1)
+    modules = load_magic_modules(
+        modname, 'magic_module', package=pkgname, shell=shell, workers=2)
+    assert [mod.__name__ for mod in modules] == [
+        echo_magic_module__name__, '.'.join((pkgname, 'magic_module'))]
+    assert set(shell.magics_manager.magics['line']) == {
+        'test_moreshell', 'test_moreshell_echo'}
+
+
+class TestIPython_magic_module_index(object):
+    """Test the ``%magic`` index of :class:`moreshell.IPython_magic_module`."""
+
+    def test_magic_index(self, echo_magic_module__name__):
+        """Test that the index contains all ``%magic`` grouped by kind."""
+        mod, = import_magic_modules([echo_magic_module__name__])
+        index = mod.magic_index
+        assert index == {
+            'line': {'test_moreshell_echo': mod.test_moreshell_echo},
+            'cell': {
+                'test_moreshell_echo': mod.test_moreshell_echo.cell,
+                'test_moreshell_cell_echo': mod.test_moreshell_cell_echo,
+            },
+        }
+        assert mod.magic_index is index
+
+    def test_load_idempotent(self, echo_magic_module__name__, shell):
+        """Test that loading into the same shell twice does nothing."""
+        mod, = import_magic_modules([echo_magic_module__name__])
+        mod.load(shell)
+        assert mod.loaded_shells == [shell]
+        assert mod.test_moreshell_echo.cell.shell is shell
+
+        magics = shell.magics_manager.magics
+        magics['line']['test_moreshell_echo'] = other = object()
+        mod.load(shell)
+        assert magics['line']['test_moreshell_echo'] is other
+        assert mod.loaded_shells == [shell]
+
+    def test_unload_keeps_others(self, echo_magic_module__name__, shell):
+        """Test that unloading leaves other ``%magic`` alone."""
+        mod, = import_magic_modules([echo_magic_module__name__])
+        mod.load(shell)
+
+        magics = shell.magics_manager.magics
+        magics['line']['test_moreshell_echo'] = other = object()
+        mod.unload(shell)
+        assert magics == {'line': {'test_moreshell_echo': other}, 'cell': {}}
+        assert mod.loaded_shells == []
+        assert mod.test_moreshell_echo.shell is None
+
+        # unloading again does nothing
+        mod.unload(shell)
+        assert magics['line']['test_moreshell_echo'] is other
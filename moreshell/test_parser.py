@@ -0,0 +1,99 @@
+"""Test :mod:`moreshell.parser`."""
+
+from argparse import SUPPRESS
+
+import pytest
+from zetup import program, with_arguments
+
+from moreshell import IPython_magic, IPythonMagicExit
+from moreshell.parser import compiled_parser
+
+#: Argument definitions supported by the compiled parser.
+SPECS = {
+    'flag': lambda: (
+        with_arguments
+        ('-f', '--flag')),
+    'store_true': lambda: (
+        with_arguments
+        ('-v', '--verbose', action='store_true')
+        ('-q', action='store_false', dest='loud')),
+    'positionals': lambda: (
+        with_arguments
+        ('first')
+        ('second', metavar='SECOND', help="The second one")),
+    'mixed': lambda: (
+        with_arguments
+        ('value')
+        ('-f', '--flag', default='default')
+        ('-o', '--other-flag', required=True)
+        ('-c', '--coverage', action='store_true')
+        ('--shared', dest='flag')),
+}
+
+#: Argument lines covering fast-path matches and argparse fallbacks.
+LINES = [
+    "", "-", "value", "value other", "value other third",
+    "-f", "-f x", "--flag x", "--flag=x", "--fl x", "-fx", "-f -x",
+    "-v", "--verbose -q", "-vq", "--verb", "-q -q",
+    "-o x value", "value -o x -c", "-o x -- value", "value -o",
+    "-c value -f y -o z --shared w", "-o x -1", "-h", "--help",
+    "-x value", "first -f second",
+]
+
+
+@pytest.mark.parametrize('spec', sorted(SPECS))
+@pytest.mark.parametrize('line', LINES)
+def test_compiled_like_argparse(spec, line, capsys):
+    """
+    Test that compiled and ``argparse`` parsing have identical results.
+
+    When the compiled parser handles an argument line, its
+    ``argparse.Namespace`` must equal the one from ``argparse``. And the
+    ``%magic`` results must always be the same, including
+    :exc:`moreshell.IPythonMagicExit` codes and output
+    """
+    def magic(shell, args):  # pragma: no cover
+        pass
+
+    magics = [
+        IPython_magic(SPECS[spec](), compiled=compiled, parse_cache=False)(
+            magic)
+        for compiled in [False, True]]
+    assert magics[0].creator.compiled_parser is None
+    assert magics[1].creator.compiled_parser is not None
+
+    results = []
+    for magic in magics:
+        try:
+            results.append(magic.parse(line))
+        except IPythonMagicExit as exc:
+            results.append(('exit', exc.code, capsys.readouterr()))
+    assert results[0] == results[1]
+
+    compiled = magics[1].creator.compiled_parser.parse(line.split())
+    if compiled is not None:
+        assert compiled == results[0]
+
+
+@pytest.mark.parametrize('arguments', [
+    with_arguments('-f', '--flag', type=int),
+    with_arguments('-f', '--flag', choices=['a', 'b']),
+    with_arguments('-f', '--flag', nargs='?'),
+    with_arguments('-f', '--flag', action='append'),
+    with_arguments('-f', '--flag', action='count'),
+    with_arguments('-f', '--flag', default=SUPPRESS),
+    with_arguments('value', nargs='*'),
+    with_arguments('value', action='store_const', const=1),
+    with_arguments('-1', action='store_true'),
+    with_arguments('--flag=', action='store_true'),
+])
+def test_compile_unsupported(arguments):
+    """Test that unsupported argument definitions are not compiled."""
+    assert compiled_parser.compile(program(arguments)) is None
+
+
+def test_compile_unsupported_parser():
+    """Test that parsers with non-default prefix chars are not compiled."""
+    parser = program(with_arguments('+f'), prefix_chars='+')
+    assert compiled_parser.compile(parser) is None
+
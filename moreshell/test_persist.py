@@ -0,0 +1,216 @@
+"""Test :mod:`moreshell.persist`."""
+
+import os
+from argparse import Namespace
+
+import pytest
+
+import moreshell.persist
+from moreshell import IPython_cell_magic, IPython_magic, with_arguments
+from moreshell.cache import result_key
+from moreshell.persist import (
+    code_digest, default_store, result_store, stable_repr)
+
+KEY = result_key(Namespace(value='value'), u"cell")
+
+
+def test_stable_repr():
+    """Test that only tuples and sets of plain values are represented."""
+    assert stable_repr((1, frozenset(['b', 'a']))) == (
+        "(1, frozenset(['a', 'b']),)")
+    with pytest.raises(TypeError, match=r" has no stable repr "):
+        stable_repr((object(), ))
+
+
+def test_code_digest():
+    """Test that code digests only depend on the behavior of the code."""
+    def first():  # pragma: no cover
+        return [1]
+
+    def second():  # pragma: no cover
+
+        return [1]
+
+    assert code_digest(first.__code__) == code_digest(second.__code__)
+    assert len(code_digest(first.__code__)) == 12
+    assert code_digest((lambda: [2]).__code__) != code_digest(first.__code__)
+    # the Ellipsis constant has no stable repr, but a fixed one
+    code = compile('value[...]', '<digest>', 'eval')
+    assert Ellipsis in code.co_consts
+    assert code_digest(code) == code_digest(code)
+
+
+def test_default_store(monkeypatch, tmpdir):
+    """Test that the default store is shared and in the cache directory."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    monkeypatch.setattr(moreshell.persist, '_default_store', None)
+    store = default_store()
+    assert default_store() is store
+    assert store.path == str(tmpdir.join('moreshell', 'results'))
+    assert os.path.isdir(store.path)
+    assert repr(store).startswith("<result_store {!r} at ".format(
+        store.path))
+
+
+class Test_result_store(object):
+    """Test :class:`moreshell.persist.result_store`."""
+
+    def test__init__with_invalid_max_bytes(self, tmpdir):
+        """Test that a non-positive ``max_bytes`` raises ``ValueError``."""
+        with pytest.raises(ValueError, match=r" must be positive, not: 0$"):
+            result_store(str(tmpdir), max_bytes=0)
+
+    @pytest.mark.parametrize('mmap_threshold', [0, 2 ** 20])
+    def test_get_and_set(self, tmpdir, mmap_threshold):
+        """Test results read back with and without memory mapping."""
+        store = result_store(str(tmpdir), mmap_threshold=mmap_threshold)
+        assert store.get('cell-magic', KEY) is None
+        assert store.set('cell-magic', KEY, {'result': [1, 2]})
+        assert store.get('cell-magic', KEY) == {'result': [1, 2]}
+        assert store.get('line-magic', KEY, 'default') == 'default'
+
+        # like from another kernel
+        other = result_store(str(tmpdir), mmap_threshold=mmap_threshold)
+        assert other.get('cell-magic', KEY) == {'result': [1, 2]}
+
+    def test_unstorable(self, tmpdir):
+        """Test that unstable keys and unpicklable values are skipped."""
+        store = result_store(str(tmpdir))
+        assert not store.set('cell-magic', (object(), ), 'value')
+        assert store.get('cell-magic', (object(), ), 'default') == 'default'
+        assert not store.set('cell-magic', KEY, lambda: None)
+        assert store.size() == 0
+
+    def test_get__broken(self, tmpdir):
+        """Test that unreadable result files get removed."""
+        store = result_store(str(tmpdir))
+        filename = store.filename('cell-magic', KEY)
+        with open(filename, 'wb') as broken:
+            broken.write(b'broken')
+        assert store.get('cell-magic', KEY, 'default') == 'default'
+        assert not os.path.exists(filename)
+        store.discard(filename)
+
+    def test_evict(self, tmpdir):
+        """Test that least recently used results exceeding the size go."""
+        store = result_store(str(tmpdir))
+        for index, key in enumerate([('a', ), ('b', ), ('c', )]):
+            store.set('line-magic', key, 'x' * 100)
+            os.utime(store.filename('line-magic', key), (index, index))
+        assert store.get('line-magic', ('a', )) is not None
+
+        size = store.size()
+        store.max_bytes = size - 1
+        store.evict()
+        assert store.get('line-magic', ('b', )) is None
+        assert store.get('line-magic', ('a', )) is not None
+        assert store.get('line-magic', ('c', )) is not None
+
+    def test_clear(self, tmpdir):
+        """Test removing all results or only those of one magic."""
+        store = result_store(str(tmpdir))
+        store.set('line-magic', KEY, 1)
+        store.set('line-other', KEY, 2)
+        store.clear('line-magic')
+        assert store.get('line-magic', KEY) is None
+        assert store.get('line-other', KEY) == 2
+
+        store.clear()
+        assert store.size() == 0
+        assert os.listdir(store.path) == ['.lock']
+
+    def test_locked__without_fcntl(self, monkeypatch, tmpdir):
+        """Test that the store still works without advisory file locks."""
+        monkeypatch.setattr(moreshell.persist, 'fcntl', None)
+        store = result_store(str(tmpdir))
+        assert store.set('line-magic', KEY, 1)
+        assert not os.path.exists(os.path.join(store.path, '.lock'))
+
+
+class Test_magic_function_result_store(object):
+    """Test the ``persist=`` option of ``%magic`` functions."""
+
+    def test_call__persisted(self, tmpdir):
+        """Test that results survive recreating the cell ``%%magic``."""
+        store = result_store(str(tmpdir))
+        calls = []
+
+        def create():
+            @IPython_cell_magic(with_arguments('value'), persist=store)
+            def magic(shell, args, block):
+                calls.append(block)
+                return args.value + block
+
+            return magic
+
+        assert create()('a', block="cell") == 'acell'
+        assert create()('a', block="cell") == 'acell'
+        assert calls == ["cell"]
+
+        magic = create()
+        assert magic.result_store is store
+        assert magic('a --no-cache', block="cell") == 'acell'
+        assert calls == ["cell", "cell"]
+
+        magic.cache_clear()
+        assert store.size() == 0
+
+    def test_call__cached_and_persisted(self, tmpdir):
+        """Test that stored results are added to the in-memory cache."""
+        store = result_store(str(tmpdir))
+
+        @IPython_magic(with_arguments('value'), cache=True, persist=store)
+        def magic(shell, args):  # pragma: no cover
+            return args.value
+
+        store.set(
+            magic.store_prefix, result_key(Namespace(value='a')), 'stored')
+        assert magic('a') == magic('a') == 'stored'
+        assert magic.result_cache.info()[:2] == (1, 1)
+
+    def test_call__code_and_module(self, tmpdir):
+        """Test that edited code and other modules don't share results."""
+        store = result_store(str(tmpdir))
+
+        def original():
+            @IPython_magic(with_arguments('value'), persist=store)
+            def magic(shell, args):
+                return args.value
+
+            return magic
+
+        def edited():
+            @IPython_magic(with_arguments('value'), persist=store)
+            def magic(shell, args):
+                return args.value * 2
+
+            return magic
+
+        def magic(shell, args):
+            return 'other'
+
+        magic.__module__ = 'moreshell_other_module'
+        other = IPython_magic(with_arguments('value'), persist=store)(magic)
+
+        assert original()('a') == 'a'
+        assert edited()('a') == 'aa'
+        assert other('a') == 'other'
+        assert original()('a') == 'a'
+        assert other.store_name == 'line-moreshell_other_module.magic'
+        assert len(list(store.entries())) == 3
+
+        original().cache_clear()
+        assert len(list(store.entries())) == 1
+        assert other('a') == 'other'
+
+    def test_persist_true(self, monkeypatch, tmpdir):
+        """Test that ``persist=True`` uses the default store."""
+        monkeypatch.setattr(
+            moreshell.persist, '_default_store', result_store(str(tmpdir)))
+
+        @IPython_magic(with_arguments('value'), persist=True)
+        def magic(shell, args):  # pragma: no cover
+            pass
+
+        assert magic.result_store is default_store()
+        assert 'no_cache' in magic.creator.injected_options
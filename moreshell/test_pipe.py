@@ -0,0 +1,148 @@
+"""Test :mod:`moreshell.pipe`."""
+
+import threading
+from time import sleep
+
+import pytest
+
+from moreshell import IPython_cell_magic, IPython_magic, with_arguments
+from moreshell.pipe import (
+    iterate, moreshell_pipe, parse_pipeline, pipeline, pipeline_stage)
+
+
+@IPython_magic(with_arguments('count', type=int))
+def numbers(shell, args):
+    """Generate the numbers up to the given count."""
+    for number in range(args.count):
+        yield number
+
+
+@numbers.cell_magic
+def numbers(shell, args, block):
+    """Generate the numbers up to the given count, for each input item."""
+    for _ in block:
+        for number in range(args.count):
+            yield number
+
+
+@IPython_cell_magic(with_arguments('factor', type=int))
+def scale(shell, args, block):
+    """Multiply every input item with the given factor."""
+    return (item * args.factor for item in block)
+
+
+@IPython_cell_magic(with_arguments('-s', '--start', type=int, default=0))
+def total(shell, args, block):
+    """Sum all input items."""
+    return sum(block, args.start)
+
+
+@IPython_cell_magic(with_arguments('-n', '--number', type=int, default=1))
+def head(shell, args, block):
+    """Take only the first input items."""
+    return [item for _, item in zip(range(args.number), block)]
+
+
+@IPython_cell_magic(with_arguments('seconds', type=float), stream='lines')
+def delay(shell, args, block):
+    """Pass on the input items after waiting before each."""
+    for item in block:
+        sleep(args.seconds)
+        yield item
+
+
+@IPython_cell_magic(with_arguments('-m', '--message', default='failed'))
+def fail(shell, args, block):
+    """Raise an error after consuming the input."""
+    list(block)
+    raise ValueError(args.message)
+
+
+def test_iterate():
+    """Test which stage results are iterated."""
+    assert list(iterate(None)) == []
+    assert list(iterate(u"text")) == [u"text"]
+    assert list(iterate({'key': 'value'})) == [{'key': 'value'}]
+    assert list(iterate(1)) == [1]
+    assert list(iterate([1, 2])) == [1, 2]
+
+
+class Test_pipeline(object):
+    """Test :class:`moreshell.pipe.pipeline`."""
+
+    def test__call__(self):
+        """Test that every stage consumes the output of the previous."""
+        pipe = numbers.stage('4') | scale.stage('10') | total.stage('-s 1')
+        assert isinstance(pipe, pipeline)
+        assert repr(pipe).startswith("<pipeline <pipeline_stage <%numbers ")
+        assert pipe() == 61
+
+    def test__call__with_input(self):
+        """Test that a line magic stage uses its cell magic for input."""
+        pipe = numbers.stage('2') | (scale.stage('2') | total.stage())
+        assert pipe(["a", "b"]) == 4
+
+    def test__call__generator(self):
+        """Test that a generator result stops the other stages when done."""
+        result = (numbers.stage('1000000') | scale.stage('2'))()
+        assert next(result) == 0
+        assert next(result) == 2
+        result.close()
+
+    def test__call__bounded(self):
+        """Test that stages are stopped when the last stage is done early."""
+        pipe = pipeline(
+            [numbers.stage('1000000'), head.stage('-n 3')], queue_size=2)
+        assert pipe() == [0, 1, 2]
+        for thread in threading.enumerate():
+            if thread.name.startswith('moreshell-pipe-'):
+                thread.join(1)
+                assert not thread.is_alive()
+
+    def test__call__waiting(self):
+        """Test stages waiting for slower previous and next stages."""
+        pipe = pipeline(
+            [numbers.stage('3'), delay.stage('0.1'), delay.stage('0.1'),
+             total.stage()], queue_size=1)
+        assert pipe() == 3
+
+    def test__call__error(self):
+        """Test that errors of stages are re-raised."""
+        with pytest.raises(ValueError, match=r"^first$"):
+            (numbers.stage('3') | fail.stage('-m first') | total.stage())()
+        with pytest.raises(ValueError, match=r"^last$"):
+            (numbers.stage('3') | fail.stage('-m last'))()
+
+    def test__call__without_cell_magic(self):
+        """Test that line magic without cell magic can't consume input."""
+        @IPython_magic(with_arguments('value'))
+        def line_only(shell, args):  # pragma: no cover
+            pass
+
+        with pytest.raises(TypeError, match=r" has no cell magic "):
+            pipeline_stage(line_only)("input")
+
+
+class Test_moreshell_pipe(object):
+    """Test the ``%%moreshell_pipe`` magic."""
+
+    def test_magic(self, shell):
+        """Test running pipelines of magic registered in the shell."""
+        for magic in [numbers, numbers.cell, scale, total]:
+            magic.load(shell)
+        moreshell_pipe.shell = shell
+
+        assert moreshell_pipe(
+            '%numbers 3 | %%scale 2 | %%total', block="") == 6
+        assert moreshell_pipe(
+            '-q 1 %numbers 2 | %%scale 3', block="ab") == [0, 3, 0, 3]
+        assert moreshell_pipe('%numbers 3 | %%scale 1', block=" ") == [
+            0, 1, 2]
+
+    def test_parse_pipeline__errors(self, shell):
+        """Test that empty stages and unknown magic raise ``ValueError``."""
+        numbers.load(shell)
+        with pytest.raises(ValueError, match=r"^Empty stage in pipeline: "):
+            parse_pipeline(shell, '%numbers 1 | ')
+        with pytest.raises(ValueError, match=r"^No cell magic %%missing "):
+            parse_pipeline(shell, '%numbers 1 | %%missing')
@@ -0,0 +1,96 @@
+"""Test :mod:`moreshell.process` and ``%magic`` run in worker processes."""
+
+import os
+from threading import Lock
+
+import pytest
+
+from moreshell import IPython_magic, with_arguments
+from moreshell.process import pool, process_pool, run_in_worker
+
+
+@IPython_magic(with_arguments('value'), executor='process')
+def process_magic(shell, args):
+    """Return the worker process ID, the IPython shell, and the value."""
+    return os.getpid(), shell, args.value
+
+
+@process_magic.cell_magic
+def process_magic(shell, args, block):
+    """Return the worker process ID and the cell block."""
+    return os.getpid(), block
+
+
+@IPython_magic(with_arguments('value'), executor='process')
+def int_magic(shell, args):
+    """Return the value converted to an integer."""
+    return int(args.value)
+
+
+@pytest.fixture
+def small_pool():
+    """Use a small shared process pool and shut it down afterwards."""
+    pool.resize(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_process_magic(small_pool):
+    """Test that the ``%magic`` runs in warm worker processes."""
+    pid, shell, value = process_magic('value')
+    assert pid != os.getpid()
+    assert shell is None
+    assert value == 'value'
+
+    pids = set(process_magic(str(value))[0] for value in range(10))
+    assert len(pids) <= 2
+
+    pid, block = process_magic.cell('value', 'block')
+    assert pid != os.getpid()
+    assert block == 'block'
+
+
+def test_process_magic_unpicklable(small_pool):
+    """Test that unpicklable arguments give a clear ``TypeError``."""
+    args = process_magic.parse('value')
+    args.lock = Lock()
+    with pytest.raises(TypeError, match=(
+            r"^Can't send argument 'lock' of <%process_magic at .+> to "
+            r"worker process: <.*lock.*> can't be pickled")):
+        small_pool.run(process_magic, args)
+
+    with pytest.raises(TypeError, match=r"^Can't send argument 'block' "):
+        small_pool.run(
+            process_magic.cell, process_magic.cell.parse('value'), Lock())
+
+    # other errors are not touched
+    with pytest.raises(ValueError, match=r"^invalid literal for int"):
+        small_pool.run(int_magic, int_magic.parse('value'))
+
+
+def test_run_in_worker():
+    """Test that workers find the ``%magic`` by module and name."""
+    pid, shell, value = run_in_worker(
+        __name__, 'process_magic', 'line', process_magic.parse('value'))
+    assert (pid, shell, value) == (os.getpid(), None, 'value')
+
+    pid, block = run_in_worker(
+        __name__, 'process_magic', 'cell',
+        process_magic.cell.parse('value'), 'block')
+    assert (pid, block) == (os.getpid(), 'block')
+    assert run_in_worker(
+        __name__, 'int_magic', 'line', int_magic.parse('1')) == 1
+
+
+def test_invalid_executor():
+    """Test that unknown executors raise ``ValueError``."""
+    with pytest.raises(ValueError, match=(
+            r" can be only None or 'process', not: 'thread'$")):
+        IPython_magic(with_arguments('value'), executor='thread')
+
+
+def test_process_pool_shutdown():
+    """Test that shutting down an unused pool does nothing."""
+    unused = process_pool(max_workers=1)
+    unused.shutdown()
+    assert unused.executor is None
@@ -0,0 +1,95 @@
+"""Test :mod:`moreshell.profiling` and the ``--profile`` flags."""
+
+import pstats
+import sys
+
+import pytest
+
+from moreshell import IPython_magic, with_arguments
+
+
+@pytest.fixture
+def magic():
+    """Create a ``%profiled_magic`` with profiling flags."""
+    @IPython_magic(with_arguments('value'), profile_flags=True)
+    def profiled_magic(shell, args):
+        assert sorted(vars(args)) == ['value']
+        if args.value == 'fail':
+            raise ValueError(args.value)
+
+        return [args.value] * 100000
+
+    @profiled_magic.cell_magic
+    def profiled_magic(shell, args, block):
+        assert sorted(vars(args)) == ['value']
+        return block
+
+    return profiled_magic
+
+
+def test_no_profiling(magic, capsys):
+    """Test that calls without profiling flags are unaffected."""
+    assert len(magic('value')) == 100000
+    assert magic.cell('value', 'block') == 'block'
+    assert capsys.readouterr().out == ''
+
+
+def test_profile(magic, capsys):
+    """Test that ``--profile`` prints the top functions."""
+    assert len(magic('--profile value')) == 100000
+    out = capsys.readouterr().out
+    assert "Ordered by: cumulative time" in out
+    assert "(profiled_magic)" in out
+
+    assert magic.cell('value --profile', 'block') == 'block'
+    assert "(profiled_magic)" in capsys.readouterr().out
+
+    with pytest.raises(ValueError):
+        magic('--profile fail')
+    assert "(profiled_magic)" in capsys.readouterr().out
+
+
+def test_profile_file(magic, tmpdir, capsys):
+    """Test that ``--profile-file`` dumps the stats."""
+    path = str(tmpdir.join('magic.prof'))
+    assert len(magic('--profile-file {} value'.format(path))) == 100000
+    assert capsys.readouterr().out == ''
+    assert any(
+        name == 'profiled_magic'
+        for _, _, name in pstats.Stats(path).stats)
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 4), reason="tracemalloc requires Python 3.4+")
+class TestMemprofile(object):
+    """Test the ``--memprofile`` flags."""
+
+    def test_memprofile(self, magic, capsys):
+        """Test that ``--memprofile`` prints the top allocating lines."""
+        import tracemalloc
+
+        assert len(magic('--memprofile value')) == 100000
+        out = capsys.readouterr().out
+        assert out.startswith("Top 10 lines allocating memory:\n")
+        assert "test_profiling.py:" in out
+        assert not tracemalloc.is_tracing()
+
+    def test_memprofile_file(self, magic, tmpdir, capsys):
+        """Test ``--memprofile-file`` with ``tracemalloc`` already running."""
+        import tracemalloc
+
+        path = str(tmpdir.join('magic.snapshot'))
+        tracemalloc.start()
+        try:
+            assert len(magic(
+                '--profile --memprofile-file {} value'.format(path))) == (
+                    100000)
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+        assert "(profiled_magic)" in capsys.readouterr().out
+        snapshot = tracemalloc.Snapshot.load(path)
+        assert any(
+            trace.traceback[0].filename == __file__.rstrip('c')
+            for trace in snapshot.traces)
@@ -0,0 +1,95 @@
+"""Test :mod:`moreshell.test.sharding`."""
+
+import json
+
+import pytest
+
+from moreshell.test.sharding import (
+    FAILED_ENV, SELECT_ENV, SHARD_ENV, parse_shard,
+    pytest_collection_modifyitems, pytest_runtest_logreport, select)
+
+
+class item(object):
+    """Stand-in for a collected ``pytest.Item``."""
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+
+
+class config(object):
+    """Stand-in for ``pytest.Config`` recording deselected items."""
+
+    def __init__(self):
+        self.deselected = []
+        self.hook = self
+
+    def pytest_deselected(self, items):
+        self.deselected.extend(items)
+
+
+class report(object):
+    """Stand-in for a ``pytest.TestReport``."""
+
+    def __init__(self, nodeid, failed):
+        self.nodeid = nodeid
+        self.failed = failed
+
+
+ITEMS = [item('test_{}'.format(index)) for index in range(5)]
+
+
+def test_parse_shard__invalid():
+    """Test that shard indices out of range raise ``ValueError``."""
+    with pytest.raises(ValueError, match=r" 0 to 1, not: '2/2'$"):
+        parse_shard('2/2')
+
+
+def test_select():
+    """Test selecting shards of the tests with the given node IDs."""
+    assert select(ITEMS) == (ITEMS, [])
+    assert select(ITEMS, shard=(1, 2)) == (
+        [ITEMS[1], ITEMS[3]], [ITEMS[0], ITEMS[2], ITEMS[4]])
+    assert select(ITEMS, shard=(0, 2), nodeids={'test_1', 'test_2'}) == (
+        [ITEMS[1]], [ITEMS[0], ITEMS[2], ITEMS[3], ITEMS[4]])
+
+
+def test_pytest_collection_modifyitems(monkeypatch, tmpdir):
+    """Test the deselection according to the environment variables."""
+    monkeypatch.delenv(SHARD_ENV, raising=False)
+    monkeypatch.delenv(SELECT_ENV, raising=False)
+    items = list(ITEMS)
+    pytest_collection_modifyitems(config(), items)
+    assert items == ITEMS
+
+    monkeypatch.setenv(SHARD_ENV, '0/2')
+    items, deselecting = list(ITEMS), config()
+    pytest_collection_modifyitems(deselecting, items)
+    assert items == [ITEMS[0], ITEMS[2], ITEMS[4]]
+    assert deselecting.deselected == [ITEMS[1], ITEMS[3]]
+
+    monkeypatch.delenv(SHARD_ENV)
+    path = tmpdir.join('select.json')
+    path.write(json.dumps(['test_3']))
+    monkeypatch.setenv(SELECT_ENV, str(path))
+    items = list(ITEMS)
+    pytest_collection_modifyitems(config(), items)
+    assert items == [ITEMS[3]]
+
+    path.write(json.dumps([]))
+    items = list(ITEMS)
+    pytest_collection_modifyitems(config(), items)
+    assert items == ITEMS
+
+
+def test_pytest_runtest_logreport(monkeypatch, tmpdir):
+    """Test that the node IDs of failed tests are recorded."""
+    path = tmpdir.join('failed')
+    monkeypatch.delenv(FAILED_ENV, raising=False)
+    pytest_runtest_logreport(report('test_0', failed=True))
+    assert not path.exists()
+
+    monkeypatch.setenv(FAILED_ENV, str(path))
+    pytest_runtest_logreport(report('test_1', failed=False))
+    pytest_runtest_logreport(report('test_2 [a b]', failed=True))
+    pytest_runtest_logreport(report('test_3', failed=True))
+    assert path.read().splitlines() == ['test_2 [a b]', 'test_3']
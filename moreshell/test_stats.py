@@ -0,0 +1,141 @@
+"""Test :mod:`moreshell.stats` and the recorded ``%magic`` statistics."""
+
+import pytest
+
+from moreshell import IPython_magic, IPythonMagicExit, with_arguments
+from moreshell.stats import (
+    collect, latency_histogram, magic_stats, moreshell_stats, reset)
+
+
+@pytest.fixture
+def magic():
+    """Create a fresh ``%stats_magic`` with accompanying cell magic."""
+    @IPython_magic(with_arguments('value'))
+    def stats_magic(shell, args):
+        if args.value == 'fail':
+            raise ValueError(args.value)
+
+        return args.value
+
+    @stats_magic.cell_magic
+    def stats_magic(shell, args, block):
+        return block
+
+    return stats_magic
+
+
+class TestLatency_histogram(object):
+    """Test :class:`moreshell.stats.latency_histogram`."""
+
+    def test_percentile(self):
+        """Test that percentiles are estimated within the bucket growth."""
+        histogram = latency_histogram()
+        assert histogram.percentile(50) is None
+
+        for value in range(1, 1001):
+            histogram.add(value / 1000.0)
+        histogram.add(0)
+        assert histogram.count == 1001
+        for percent in (50, 95, 99):
+            expected = percent / 100.0
+            assert expected <= histogram.percentile(percent) <= (
+                expected * histogram.growth ** 2)
+        assert histogram.percentile(0) == histogram.resolution
+
+        histogram.clear()
+        assert histogram.count == 0
+        assert histogram.percentile(99) is None
+
+
+class TestMagic_stats(object):
+    """Test :class:`moreshell.stats.magic_stats` of ``%magic``."""
+
+    def test_record(self, magic):
+        """Test that calls, errors, and times are recorded."""
+        stats = magic.stats
+        assert isinstance(stats, magic_stats)
+        assert stats.name == '%stats_magic'
+        assert magic.cell.stats.name == '%%stats_magic'
+        assert repr(stats).startswith('<magic_stats of %stats_magic at ')
+        assert stats.mean_time is None
+
+        assert magic('value') == 'value'
+        assert magic.cell('value', 'block') == 'block'
+        with pytest.raises(ValueError):
+            magic('fail')
+        with pytest.raises(IPythonMagicExit):
+            magic('')
+
+        assert stats.calls == 3
+        assert stats.errors == 1
+        assert magic.cell.stats.calls == 1
+        assert stats.parse_time > 0 and stats.exec_time > 0
+        assert stats.total_time == stats.parse_time + stats.exec_time
+        assert stats.mean_time == stats.total_time / 3
+        assert stats.histogram.count == 3
+
+        data = stats.as_dict()
+        assert data['calls'] == 3
+        assert data['p50'] <= data['p95'] <= data['p99']
+
+        stats.reset()
+        assert (stats.calls, stats.errors, stats.total_time) == (0, 0, 0)
+
+    def test_disabled(self, monkeypatch):
+        """Test the ``stats=`` option and its global default."""
+        @IPython_magic(with_arguments('value'), stats=False)
+        def magic(shell, args):
+            return args.value
+
+        assert magic.stats is None and magic.creator.cell_magic.stats is False
+        assert magic('value') == 'value'
+
+        monkeypatch.setattr(IPython_magic, 'stats', False)
+
+        @IPython_magic(with_arguments('value'))
+        def magic(shell, args):
+            return args.value
+
+        assert magic.stats is None
+        assert magic('value') == 'value'
+
+
+def test_collect_and_reset(magic):
+    """Test :func:`moreshell.stats.collect` and ``reset``."""
+    magic('value')
+    magic.cell('value', 'block')
+    assert magic.stats in collect()
+    assert collect(['%%stats_magic']) == [magic.cell.stats]
+
+    reset(['%stats_magic'])
+    assert magic.stats not in collect()
+    assert collect(['%%stats_magic']) == [magic.cell.stats]
+    reset()
+    assert collect() == []
+
+
+def test_moreshell_stats(magic, capsys):
+    """Test the ``%moreshell_stats`` magic."""
+    reset()
+    magic('value')
+    magic('other')
+    magic.cell('value', 'block')
+
+    moreshell_stats('')
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split()[:3] == ['magic', 'calls', 'errors']
+    assert sorted(line.split()[0] for line in lines[1:]) == [
+        '%%stats_magic', '%stats_magic']
+
+    result = moreshell_stats('--result --sort calls')
+    assert [data['name'] for data in result] == [
+        '%stats_magic', '%%stats_magic']
+    assert result[0]['calls'] == 2
+
+    for column in ('name', 'errors', 'total', 'mean', 'parse', 'exec',
+                   'p95', 'p99'):
+        assert len(moreshell_stats('-r -s ' + column)) == 2
+
+    assert moreshell_stats('--reset %stats_magic') is None
+    assert [data['name'] for data in moreshell_stats('-r')] == [
+        '%%stats_magic']
@@ -0,0 +1,187 @@
+"""Test :mod:`moreshell.stream`."""
+
+import pickle
+
+import pytest
+
+from moreshell import IPython_cell_magic, IPython_magic, with_arguments
+from moreshell.stream import block_reader, file_block, iter_lines, open_block
+
+
+def test_iter_lines():
+    """Test that lines keep their endings and empty text gives none."""
+    assert list(iter_lines(u"a\nb\n\nc")) == [u"a\n", u"b\n", u"\n", u"c"]
+    assert list(iter_lines(u"a\n")) == [u"a\n"]
+    assert list(iter_lines(u"")) == []
+
+
+class Test_block_reader(object):
+    """Test :class:`moreshell.stream.block_reader`."""
+
+    def test_read(self):
+        """Test reading, seeking, and iterating memoryview slices."""
+        data = b"first\nsecond\n"
+        with block_reader(data) as reader:
+            assert len(reader) == len(data)
+            chunk = reader.read(3)
+            assert isinstance(chunk, memoryview)
+            assert chunk.tobytes() == b"fir"
+            assert reader.tell() == 3
+            assert [line.tobytes() for line in reader] == [
+                b"st\n", b"second\n"]
+            assert reader.read().tobytes() == b""
+
+            assert reader.seek(-1) == 0
+            assert reader.seek(100) == len(data)
+            reader.seek(0)
+            assert list(reader.lines()) == [u"first\n", u"second\n"]
+
+
+class Test_file_block(object):
+    """Test :class:`moreshell.stream.file_block`."""
+
+    def test_map(self, tmpdir):
+        """Test memory-mapping of non-empty and empty files."""
+        path = tmpdir.join('data.csv')
+        path.write_binary(b"a,b\n1,2\n")
+        block = file_block(str(path))
+        assert repr(block) == "<file_block {!r}>".format(str(path))
+        assert pickle.loads(pickle.dumps(block)).path == block.path
+
+        reader = open_block(block, 'reader')
+        assert reader.readline().tobytes() == b"a,b\n"
+        assert list(open_block(block, 'lines')) == [u"a,b\n", u"1,2\n"]
+
+        path.write_binary(b"")
+        assert list(open_block(block, 'lines')) == []
+
+    def test_open(self, tmpdir):
+        """Test that closing the reader also closes the memory map."""
+        path = tmpdir.join('data.csv')
+        path.write_binary(b"a,b\n")
+        with file_block(str(path)).open() as reader:
+            mapped = reader._source
+            assert reader.read().tobytes() == b"a,b\n"
+        assert mapped.closed
+
+
+def test_open_block():
+    """Test turning cell text into lines or a reader."""
+    assert list(open_block(u"a\nb", 'lines')) == [u"a\n", u"b"]
+    reader = open_block(u"\xe4\n", 'reader')
+    assert list(reader.lines()) == [u"\xe4\n"]
+    assert open_block(b"a", 'reader').read().tobytes() == b"a"
+
+
+class TestIPython_cell_magic_stream(object):
+    """Test the ``stream=`` option of cell ``%%magic``."""
+
+    def test__init__with_invalid_stream(self):
+        """Test that an unknown ``stream`` mode raises ``ValueError``."""
+        with pytest.raises(
+                ValueError, match=r" 'lines', or 'reader', not: 'bytes'$"):
+            IPython_cell_magic(with_arguments('value'), stream='bytes')
+
+    def test_call__lines(self, tmpdir):
+        """Test that the cell block or file is delivered as line iterator."""
+        @IPython_cell_magic(with_arguments('value'), stream='lines')
+        def magic(shell, args, block):
+            assert not hasattr(args, 'from_file')
+            assert not isinstance(block, str)
+            return [line.rstrip() for line in block]
+
+        assert magic('value', block="a\nb\n") == ["a", "b"]
+
+        path = tmpdir.join('data.txt')
+        path.write_binary(b"c\nd")
+        assert magic('value --from-file {}'.format(path), block="") == [
+            "c", "d"]
+
+        @IPython_cell_magic(with_arguments('value'), stream='reader')
+        def kept(shell, args, block):
+            return block
+
+        reader = kept('value --from-file {}'.format(path), block="")
+        assert reader._source.closed
+
+        with pytest.raises(
+                ValueError,
+                match=r"^%%magic got both a cell block and --from-file "):
+            magic('value --from-file {}'.format(path), block="e")
+
+    def test_call__from_file_results(self, tmpdir):
+        """Test that mapped files stay open while results refer to them."""
+        path = tmpdir.join('data.txt')
+        path.write_binary(b"c\nd")
+        readers = []
+
+        @IPython_cell_magic(with_arguments('value'), stream='reader')
+        def first_line(shell, args, block):
+            readers.append(block)
+            return block.readline()
+
+        line = first_line('value --from-file {}'.format(path), block="")
+        assert line.tobytes() == b"c\n"
+        assert not readers[0]._source.closed
+        line.release()
+
+        @IPython_cell_magic(with_arguments('value'), stream='reader')
+        def lines(shell, args, block):
+            readers.append(block)
+            return (line.tobytes().upper() for line in block)
+
+        result = lines('value --from-file {}'.format(path), block="")
+        assert not readers[1]._source.closed
+        assert list(result) == [b"C\n", b"D"]
+        assert readers[1]._source.closed
+
+        @IPython_cell_magic(with_arguments('value'), stream='reader')
+        def failing(shell, args, block):
+            readers.append(block)
+            raise RuntimeError(block.readline().tobytes())
+
+        with pytest.raises(RuntimeError):
+            failing('value --from-file {}'.format(path), block="")
+        assert readers[2]._source.closed
+
+    def test_call__from_file_lines(self, tmpdir):
+        """Test returning generators over the lines of mapped files."""
+        path = tmpdir.join('data.txt')
+        path.write_binary(b"c\nd")
+
+        @IPython_cell_magic(with_arguments('value'), stream='lines')
+        def upper(shell, args, block):
+            return (line.upper() for line in block)
+
+        assert list(upper('value --from-file {}'.format(path), "")) == [
+            "C\n", "D"]
+
+    def test_call__reader(self):
+        """Test that the cell block is delivered as reader."""
+        @IPython_magic(with_arguments('value'), stream='reader', cache=True)
+        def magic(shell, args):
+            return args.value
+
+        @magic.cell_magic
+        def magic(shell, args, block):
+            return block.read().tobytes()
+
+        assert 'from_file' not in magic.creator.injected_options
+        assert 'from_file' in magic.cell.creator.injected_options
+        assert magic('value') == 'value'
+        assert magic.cell('value', block="cell") == b"cell"
+        assert magic.cell('value', block="cell") == b"cell"
+        assert magic.cell.result_cache.hits == 1
+
+    def test_call__from_file_not_cached(self, tmpdir):
+        """Test that results of ``--from-file`` calls are not cached."""
+        path = tmpdir.join('data.txt')
+        path.write_binary(b"data")
+
+        @IPython_cell_magic(
+            with_arguments('-v', '--value'), stream='reader', cache=True)
+        def magic(shell, args, block):
+            return len(block)
+
+        assert magic('--from-file {}'.format(path), block="") == 4
+        assert len(magic.result_cache) == 0
@@ -0,0 +1,111 @@
+"""Test :mod:`moreshell.trace` span export."""
+
+import json
+
+import pytest
+
+from moreshell import IPython_magic, IPythonMagicExit, trace, with_arguments
+from moreshell.module import import_magic_modules
+from moreshell.trace import span_tracer
+
+
+@pytest.fixture
+def magic():
+    """Create a ``%traced_magic``, which calls a nested ``%inner_magic``."""
+    @IPython_magic(with_arguments('value'), stats=False)
+    def inner_magic(shell, args):
+        return args.value
+
+    @IPython_magic(with_arguments('value'))
+    def traced_magic(shell, args):
+        return inner_magic(args.value)
+
+    return traced_magic
+
+
+@pytest.fixture
+def stopped():
+    """Make sure that tracing is stopped afterwards."""
+    yield
+    trace.stop()
+
+
+def spans(path):
+    """Get the spans from a Chrome trace file as name and event pairs."""
+    with open(path) as trace_file:
+        return [(event['name'], event) for event in json.load(trace_file)]
+
+
+def test_disabled(magic):
+    """Test that nothing is recorded without active tracing."""
+    assert trace.active is None
+    assert magic('value') == 'value'
+    trace.record('nothing', 'test', 0)
+
+
+def test_magic_spans(magic, tmpdir, stopped):
+    """Test the nested spans of ``%magic`` calls."""
+    path = str(tmpdir.join('session.json'))
+    tracer = trace.start(path)
+    assert trace.active is tracer and tracer.format == 'chrome'
+
+    assert magic('value') == 'value'
+    with pytest.raises(IPythonMagicExit):
+        magic('')
+    trace.stop()
+    assert trace.active is None
+
+    events = spans(path)
+    assert [name for name, _ in events] == [
+        '%inner_magic', 'parse', 'execute',
+        '%traced_magic', 'parse', 'execute',
+        '%traced_magic', 'parse']
+
+    inner, outer, parse, execute = (
+        event for _, event in (events[0], events[3], events[4], events[5]))
+    for event in (inner, outer, parse, execute):
+        assert event['ph'] == 'X' and event['cat'] == 'magic'
+    assert outer['ts'] == parse['ts'] < execute['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= execute['ts'] + execute['dur']
+    assert execute['ts'] + execute['dur'] == pytest.approx(
+        outer['ts'] + outer['dur'])
+
+
+def test_module_spans(echo_magic_module__name__, shell, tmpdir, stopped):
+    """Test the spans of magic module imports, loads, and unloads."""
+    path = str(tmpdir.join('session.jsonl'))
+    tracer = trace.start(path)
+    assert tracer.format == 'jsonl'
+
+    mod, = import_magic_modules([echo_magic_module__name__])
+    mod.load(shell)
+    mod.unload(shell)
+    trace.start(str(tmpdir.join('other.json')))
+    assert tracer.close() is None
+
+    with open(path) as trace_file:
+        events = [json.loads(line) for line in trace_file]
+    assert [(event['name'], event['cat']) for event in events] == [
+        ('import ' + echo_magic_module__name__, 'import'),
+        ('load ' + echo_magic_module__name__, 'module'),
+        ('unload ' + echo_magic_module__name__, 'module'),
+    ]
+
+
+def test_span_tracer(tmpdir):
+    """Test :class:`moreshell.trace.span_tracer` directly."""
+    path = str(tmpdir.join('empty.json'))
+    span_tracer(path).close()
+    assert spans(path) == []
+
+    tracer = span_tracer(str(tmpdir.join('args.json')))
+    tracer.record('span', 'test', 1, 2, args={'key': 'value'})
+    tracer.close()
+    tracer.write({'ignored': 'after close'})
+    (name, event), = spans(tracer.path)
+    assert event['args'] == {'key': 'value'}
+    assert event['dur'] == 1e6
+
+    with pytest.raises(ValueError, match=(
+            r" can be only 'chrome' or 'jsonl', not: 'xml'$")):
+        span_tracer(path, format='xml')
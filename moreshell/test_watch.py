@@ -0,0 +1,248 @@
+"""Test :mod:`moreshell.watch`."""
+
+import os
+import sys
+from collections import namedtuple
+from textwrap import dedent
+
+import pytest
+
+import moreshell.watch
+from moreshell import load_magic_modules
+from moreshell.watch import (
+    default_watcher, magic_diff, module_watcher, reload_magic_module)
+
+MODULE = dedent("""
+    from moreshell import IPython_magic_module, IPython_magic, with_arguments
+
+    IPython_magic_module(__name__, {names!r})
+    {magics}
+    """)
+
+MAGIC = dedent("""
+    @IPython_magic(with_arguments('value'){options})
+    def {name}(shell, args):
+        return {result}
+    """)
+
+
+def write_module(path, **magics):
+    """
+    Write a magic module with a ``%magic`` per name in `magics`.
+
+    Each given as ``(result_expression, creator_options)``. The file time is
+    moved forward, since rewrites can happen within the time resolution
+    """
+    path.write(MODULE.format(names=sorted(magics), magics=''.join(
+        MAGIC.format(name=name, result=result, options=options)
+        for name, (result, options) in sorted(magics.items()))))
+    stat = os.stat(str(path))
+    os.utime(str(path), (stat.st_atime, stat.st_mtime + 10))
+
+
+@pytest.fixture
+def magic_dir(tmpdir, monkeypatch):
+    """Get a temporary directory on ``sys.path`` for magic modules."""
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield tmpdir
+    for name in ['moreshell_watched', 'moreshell_other']:
+        sys.modules.pop(name, None)
+
+
+def test_reload_magic_module(magic_dir, shell):
+    """Test that only added, removed, and changed ``%magic`` get replaced."""
+    path = magic_dir.join('moreshell_watched.py')
+    write_module(
+        path, kept=('args.value', ''), edited=('1', ''),
+        optioned=('2', ''), dropped=('3', ''))
+    old, = load_magic_modules('moreshell_watched', shell=shell)
+    kept = old.kept
+    old_func = kept.__func__
+    kept.stats.reset()
+    kept('x')
+
+    # the added magic also moves the line numbers of the others
+    write_module(
+        path, kept=('args.value', ''), edited=('-1', ''),
+        optioned=('2', ', parse_cache=8'), added=('4', ''))
+    new, diff = reload_magic_module('moreshell_watched')
+    assert new is not old
+    assert diff == magic_diff(
+        added=['%added'], removed=['%dropped'],
+        changed=['%edited', '%optioned'])
+
+    magics = shell.magics_manager.magics
+    assert sorted(magics['line']) == ['added', 'edited', 'kept', 'optioned']
+    assert magics['line']['kept'] is kept is new.kept
+    assert new.magic_index['line']['kept'] is kept
+    assert kept.stats.calls == 1
+    assert kept.__func__ is not old_func
+    assert kept('x') == 'x'
+    assert magics['line']['edited'] is new.edited
+    assert new.edited('x') == -1
+    assert magics['line']['added'].shell is shell
+    assert new.loaded_shells == [shell]
+
+    write_module(path, kept=('args.value', ''))
+    _, diff = reload_magic_module('moreshell_watched')
+    assert diff == magic_diff(
+        added=[], removed=['%added', '%edited', '%optioned'], changed=[])
+    assert list(magics['line']) == ['kept']
+
+
+def test_reload_magic_module__cell(magic_dir, shell):
+    """Test that changed line ``%magic`` keep unchanged cell ``%%magic``."""
+    source = dedent("""
+        from moreshell import (
+            IPython_magic_module, IPython_magic, with_arguments)
+
+        IPython_magic_module(__name__, ['both'])
+
+        @IPython_magic(with_arguments('value'))
+        def both(shell, args):
+            return {!r}
+
+        @both.cell_magic
+        def both(shell, args, block):
+            return block
+        """)
+    path = magic_dir.join('moreshell_watched.py')
+    path.write(source.format('line'))
+    old, = load_magic_modules('moreshell_watched', shell=shell)
+    path.write(source.format('changed line'))
+    new, diff = reload_magic_module('moreshell_watched')
+    assert diff == magic_diff(added=[], removed=[], changed=['%both'])
+    assert new.both is not old.both
+    assert new.both.cell is old.both.cell
+    assert shell.magics_manager.magics['cell']['both'] is (
+        old.both.cell)
+
+
+def test_reload_magic_module__error(magic_dir, shell):
+    """Test that the previous module is kept if the import fails."""
+    path = magic_dir.join('moreshell_watched.py')
+    write_module(path, kept=('1', ''))
+    old, = load_magic_modules('moreshell_watched', shell=shell)
+    path.write("raise RuntimeError('broken')\n")
+    with pytest.raises(RuntimeError, match=r"^broken$"):
+        reload_magic_module('moreshell_watched')
+    assert sys.modules['moreshell_watched'] is old
+    assert shell.magics_manager.magics['line']['kept'] is old.kept
+
+
+class Test_module_watcher(object):
+    """Test :class:`moreshell.watch.module_watcher`."""
+
+    def test_polling(self, magic_dir, shell, capsys):
+        """Test reloading changed modules before cell executions."""
+        path = magic_dir.join('moreshell_watched.py')
+        write_module(path, kept=('1', ''))
+        write_module(magic_dir.join('moreshell_other.py'), other=('0', ''))
+        watcher = module_watcher(polling=True)
+        assert watcher.inotify is None
+        load_magic_modules(
+            'moreshell_watched', 'moreshell_other', shell=shell,
+            watch=watcher)
+        watcher.watch('moreshell_watched')
+        watcher.watch('moreshell_missing')
+        load_magic_modules(
+            'moreshell_watched', shell=shell, watch=watcher)
+        assert list(watcher.files.values()) == [
+            'moreshell_watched', 'moreshell_other']
+        assert shell.events.callbacks['pre_run_cell'] == [
+            watcher.pre_run_cell]
+
+        shell.events.trigger('pre_run_cell', None)
+        assert capsys.readouterr().out == ""
+
+        write_module(path, kept=('1', ''), added=('2', ''))
+        shell.events.trigger('pre_run_cell', None)
+        assert capsys.readouterr().out == (
+            "Reloaded moreshell_watched: + %added\n")
+        assert shell.magics_manager.magics['line']['added']('x') == 2
+
+        write_module(path, kept=('1', ''), added=('2', ''))
+        shell.events.trigger('pre_run_cell', None)
+        assert capsys.readouterr().out == (
+            "Reloaded moreshell_watched: no magic changed\n")
+
+        path.write("raise RuntimeError('broken')\n")
+        shell.events.trigger('pre_run_cell', None)
+        captured = capsys.readouterr()
+        assert captured.out == ""
+        assert "RuntimeError: broken" in captured.err
+
+        del sys.modules['moreshell_watched']
+        write_module(path, kept=('1', ''))
+        assert watcher.check() == {}
+
+        path.remove()
+        assert watcher.changed() == []
+
+        watcher.stop()
+        assert shell.events.callbacks['pre_run_cell'] == []
+        assert watcher.shells == []
+
+    def test_inotify(self, magic_dir, monkeypatch):
+        """Test that only files with ``inotify`` events are looked at."""
+        event = namedtuple('event', ['wd', 'name'])
+
+        class inotify(object):
+            """Stand-in for ``inotify_simple.INotify``."""
+
+            def __init__(self):
+                self.watches = []
+                self.events = []
+
+            def add_watch(self, path, mask):
+                self.watches.append((path, mask))
+                return len(self.watches)
+
+            def read(self, timeout=None):
+                assert timeout == 0
+                events, self.events = self.events, []
+                return events
+
+        class inotify_simple(object):
+            INotify = inotify
+
+            class flags(object):
+                CLOSE_WRITE, MOVED_TO, CREATE = 8, 128, 256
+
+        monkeypatch.setattr(moreshell.watch, 'inotify_simple', inotify_simple)
+        path = magic_dir.join('moreshell_watched.py')
+        write_module(path, kept=('1', ''))
+        write_module(magic_dir.join('moreshell_other.py'), other=('0', ''))
+        watcher = module_watcher()
+        watcher.watch('moreshell_watched')
+        watcher.watch('moreshell_other')
+        assert watcher.inotify.watches == [(str(magic_dir), 8 | 128 | 256)]
+
+        write_module(path, kept=('2', ''))
+        assert watcher.changed() == []
+
+        watcher.inotify.events = [
+            event(1, 'moreshell_watched.py'), event(1, 'unrelated.py')]
+        assert watcher.changed() == ['moreshell_watched']
+
+        watcher.inotify.events = [event(1, 'moreshell_watched.py')]
+        assert watcher.changed() == []
+
+    def test_default_watcher(self, monkeypatch):
+        """Test that the shared watcher is created on first use."""
+        monkeypatch.setattr(moreshell.watch, '_default_watcher', None)
+        watcher = default_watcher()
+        assert isinstance(watcher, module_watcher)
+        assert default_watcher() is watcher
+
+    def test_load_magic_modules(
+            self, magic_dir, shell, monkeypatch):
+        """Test ``load_magic_modules(watch=True)``."""
+        monkeypatch.setattr(moreshell.watch, '_default_watcher', None)
+        write_module(magic_dir.join('moreshell_watched.py'), kept=('1', ''))
+        load_magic_modules(
+            'moreshell_watched', shell=shell, watch=True)
+        assert list(default_watcher().files.values()) == [
+            'moreshell_watched']
+        assert shell.events.callbacks['pre_run_cell'] == [
+            default_watcher().pre_run_cell]
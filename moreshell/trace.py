@@ -0,0 +1,136 @@
+"""Export spans of ``%magic`` calls, loads, and imports for trace viewers."""
+
+import atexit
+import json
+import os
+from threading import Lock, current_thread
+from timeit import default_timer
+
+import zetup
+
+__all__ = ('span_tracer', 'start', 'stop', 'record')
+
+#: The :class:`moreshell.trace.span_tracer` while tracing, or ``None``.
+#
+#  Checked before recording anything, so that disabled tracing costs only
+#  this lookup
+active = None
+
+
+class span_tracer(zetup.object):
+    """
+    Writer of spans to a local trace file.
+
+    Either in the Chrome trace event format, a JSON array of complete
+    ``'X'`` events, which is loaded with ``chrome://tracing``, Perfetto, or
+    speedscope, or as JSON lines with one event object per line. Nesting is
+    preserved by the begin timestamps and durations of spans in the same
+    thread
+    """
+
+    def __init__(self, path, format=None):
+        """
+        Open the trace file at `path` for writing.
+
+        The `format` is either ``'chrome'`` or ``'jsonl'``. It defaults to
+        ``'jsonl'`` for ``.jsonl`` files and to ``'chrome'`` otherwise
+        """
+        if format is None:
+            format = 'jsonl' if path.endswith('.jsonl') else 'chrome'
+        if format not in ('chrome', 'jsonl'):
+            raise ValueError(
+                "format of {!r} can be only 'chrome' or 'jsonl', not: {!r}"
+                .format(type(self), format))
+
+        self.path = path
+        self.format = format
+        self.pid = os.getpid()
+        self._lock = Lock()
+        self._file = open(path, 'w')
+        self._separator = '[\n' if format == 'chrome' else ''
+
+    def write(self, event):
+        """Write a single trace `event` ``dict``."""
+        text = json.dumps(event, sort_keys=True)
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.write(self._separator + text)
+            if self.format == 'chrome':
+                self._separator = ',\n'
+            else:
+                self._file.write('\n')
+
+    def record(self, name, category, start, end, args=None):
+        """
+        Write a complete span from `start` to `end`.
+
+        Both are ``timeit.default_timer`` seconds, which are converted to the
+        microseconds of the trace event format
+        """
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': self.pid,
+            'tid': current_thread().ident,
+        }
+        if args:
+            event['args'] = args
+        self.write(event)
+
+    def close(self):
+        """Finish and close the trace file."""
+        with self._lock:
+            if self._file is None:
+                return
+
+            if self.format == 'chrome':
+                self._file.write(self._separator.strip(',\n') + '\n]\n')
+            self._file.close()
+            self._file = None
+
+
+def start(path, format=None):
+    """
+    Start tracing to the file at `path`. See :class:`.span_tracer`.
+
+    Stops any active tracing before. Tracing is stopped automatically on
+    interpreter exit. Returns the new :class:`moreshell.trace.span_tracer`
+    """
+    global active
+
+    stop()
+    active = span_tracer(path, format)
+    return active
+
+
+def stop():
+    """Stop tracing and close the trace file."""
+    global active
+
+    tracer, active = active, None
+    if tracer is not None:
+        tracer.close()
+
+
+def record(name, category, start, end=None, args=None):
+    """
+    Write a complete span to the active trace file, if tracing.
+
+    The `end` timestamp defaults to now
+    """
+    tracer = active
+    if tracer is not None:
+        if end is None:
+            end = default_timer()
+        tracer.record(name, category, start, end, args)
+
+
+atexit.register(stop)
+
+if os.environ.get('MORESHELL_TRACE'):  # pragma: no cover
+    start(os.environ['MORESHELL_TRACE'])
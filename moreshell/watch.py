@@ -0,0 +1,236 @@
+"""Reload changed magic modules without restarting the kernel."""
+
+from __future__ import print_function
+
+import os
+import sys
+import traceback
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import zetup
+
+from .lazy import find_module_file
+from .module import IPython_magic_module, import_magic_module
+from .persist import code_fingerprint
+
+try:
+    import inotify_simple
+except ImportError:  # pragma: no cover
+    # polling fallback on other platforms or without the package
+    inotify_simple = None
+
+__all__ = (
+    'default_watcher', 'magic_diff', 'module_watcher', 'reload_magic_module')
+
+#: The ``%magic`` added, removed, and changed by
+#  :func:`moreshell.watch.reload_magic_module`, as lists of ``%name`` and
+#  ``%%name`` strings.
+magic_diff = namedtuple('magic_diff', ['added', 'removed', 'changed'])
+
+#: The :class:`moreshell.IPython_magic` options compared for changes.
+CREATOR_OPTIONS = (
+    'parse_cache_size', 'compiled', 'schedule', 'background', 'executor',
+    'stats', 'profile_flags', 'cache', 'cache_ttl', 'persist', 'stream',
+    'timeout', 'max_cpu_seconds', 'max_memory')
+
+
+def magic_fingerprint(magic):
+    """Get what identifies the behavior and the arguments of `magic`."""
+    func = magic.__func__
+    return (
+        code_fingerprint(func.__code__), func.__defaults__,
+        magic.creator.format_help(),
+        tuple(getattr(magic.creator, name) for name in CREATOR_OPTIONS))
+
+
+def reload_magic_module(name):
+    """
+    Import the magic module `name` again and update the shells using it.
+
+    The ``%magic`` of the fresh module are compared with the previous ones.
+    Only added, removed, and changed ``%magic`` are loaded into or unloaded
+    from the shells the module was loaded into. Unchanged ``%magic`` stay
+    registered, and keep their statistics and caches, but run the function
+    of the fresh module. If the import fails, the previous module is kept
+
+    :return: The fresh module and its :data:`moreshell.watch.magic_diff`
+    """
+    old = sys.modules[name]
+    del sys.modules[name]
+    try:
+        new = import_magic_module(name)
+
+    except BaseException:
+        sys.modules[name] = old
+        raise
+
+    added, removed, changed = [], [], []
+    old_index, new_index = old.magic_index, new.magic_index
+    for kind in ['line', 'cell']:
+        prefix = '%' if kind == 'line' else '%%'
+        for magic_name in sorted(set(old_index[kind]) | set(new_index[kind])):
+            old_magic = old_index[kind].get(magic_name)
+            new_magic = new_index[kind].get(magic_name)
+            if old_magic is None:
+                added.append((kind, prefix + magic_name, new_magic))
+            elif new_magic is None:
+                removed.append((kind, prefix + magic_name, old_magic))
+            elif magic_fingerprint(old_magic) != magic_fingerprint(new_magic):
+                changed.append((kind, prefix + magic_name, old_magic))
+            else:
+                old_magic.__func__ = new_magic.__func__
+                new_index[kind][magic_name] = old_magic
+                # also for the globals of the fresh module's code
+                if getattr(new.__module__, magic_name, None) is new_magic:
+                    setattr(new.__module__, magic_name, old_magic)
+    for magic in new_index['line'].values():
+        cell = getattr(magic, 'cell', None)
+        if cell is not None:
+            magic.cell = new_index['cell'][cell.__name__]
+
+    for shell in old.loaded_shells:
+        magics = shell.magics_manager.magics
+        for kind, _, magic in removed + changed:
+            if magics[kind].get(magic.__name__) is magic:
+                magic.unload(shell)
+        for kind, _, magic in added + changed:
+            new_index[kind][magic.__name__].load(shell)
+        for index in new_index.values():
+            for magic in index.values():
+                magic.shell = shell
+        new.loaded_shells.append(shell)
+    return new, magic_diff(*(
+        [magic_name for _, magic_name, _ in magics]
+        for magics in (added, removed, changed)))
+
+
+class module_watcher(zetup.object):
+    """
+    Watches the files of magic modules and reloads them when changed.
+
+    Uses ``inotify`` via the optional ``inotify_simple`` package on Linux
+    for only looking at files with events, and otherwise polls the
+    modification times and sizes of all files. Changes are only checked
+    with :meth:`.check`, which is called before every cell execution in
+    the shells given to :meth:`.start`, so that ``%magic`` are never
+    reloaded while running
+    """
+
+    def __init__(self, polling=False):
+        """
+        Prepare watching no modules yet.
+
+        Always using the `polling` fallback if set
+        """
+        #: The names of the watched modules by file name.
+        self.files = OrderedDict()
+        self.stamps = {}
+        self.inotify = None
+        if not polling and inotify_simple is not None:
+            self.inotify = inotify_simple.INotify()
+        self.watched_dirs = {}
+        self.shells = []
+
+    def watch(self, name):
+        """Start watching the file of the magic module `name`."""
+        filename = find_module_file(name)
+        if not filename or filename in self.files:
+            return
+
+        self.files[filename] = name
+        self.stamps[filename] = self.stamp(filename)
+        dirname = os.path.dirname(filename)
+        if self.inotify is None or dirname in self.watched_dirs.values():
+            return
+
+        flags = inotify_simple.flags
+        # editors often replace files instead of writing into them
+        wd = self.inotify.add_watch(
+            dirname, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+        self.watched_dirs[wd] = dirname
+
+    def stamp(self, filename):
+        """Get modification time and size of `filename`, if existing."""
+        try:
+            stat = os.stat(filename)
+
+        except OSError:
+            return None
+
+        return stat.st_mtime, stat.st_size
+
+    def changed(self):
+        """Get the names of the modules whose files changed."""
+        if self.inotify is None:
+            candidates = list(self.files)
+        else:
+            candidates = set(
+                os.path.join(self.watched_dirs[event.wd], event.name)
+                for event in self.inotify.read(timeout=0))
+            candidates = [
+                filename for filename in self.files if filename in candidates]
+        names = []
+        for filename in candidates:
+            stamp = self.stamp(filename)
+            if stamp is not None and stamp != self.stamps[filename]:
+                self.stamps[filename] = stamp
+                names.append(self.files[filename])
+        return names
+
+    def check(self):
+        """
+        Reload the imported magic modules whose files changed.
+
+        Failing imports are reported with their tracebacks, and the previous
+        modules are kept
+
+        :return: The :data:`moreshell.watch.magic_diff` by module name
+        """
+        diffs = OrderedDict()
+        for name in self.changed():
+            if not isinstance(sys.modules.get(name), IPython_magic_module):
+                continue  # still lazy or not imported anymore
+
+            try:
+                diffs[name] = reload_magic_module(name)[1]
+
+            except Exception:
+                traceback.print_exc()
+        return diffs
+
+    def pre_run_cell(self, *info):
+        """Handle IPython's ``pre_run_cell`` event by reloading changes."""
+        for name, diff in self.check().items():
+            print("Reloaded {}: {}".format(name, ', '.join(
+                '{} {}'.format(sign, magic_name)
+                for sign, magic_names in zip('+-~', diff)
+                for magic_name in magic_names) or "no magic changed"))
+
+    def start(self, shell):
+        """Check for changes before every cell execution in `shell`."""
+        if not any(other is shell for other in self.shells):
+            shell.events.register('pre_run_cell', self.pre_run_cell)
+            self.shells.append(shell)
+
+    def stop(self):
+        """Stop checking for changes in all shells."""
+        for shell in self.shells:
+            shell.events.unregister('pre_run_cell', self.pre_run_cell)
+        del self.shells[:]
+
+
+#: The watcher used by ``load_magic_modules(watch=True)``.
+_default_watcher = None
+
+_default_watcher_lock = Lock()
+
+
+def default_watcher():
+    """Get the shared :class:`.module_watcher`."""
+    global _default_watcher
+
+    with _default_watcher_lock:
+        if _default_watcher is None:
+            _default_watcher = module_watcher()
+        return _default_watcher